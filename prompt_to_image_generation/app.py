@@ -1,39 +1,137 @@
+import atexit
+import base64
+import json
+import multiprocessing
 import os
 import threading
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from datetime import datetime, timedelta
 from functools import wraps
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, abort
-from flask_mysqldb import MySQL
+import click
+
+from flask import (
+    Flask, Response, render_template, request, redirect, url_for, session, flash, abort, jsonify, send_file, g,
+    stream_with_context,
+)
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import wrap_file
 
-from image_generator import generate_sketch_image, load_model  # your existing module
+from config import Config
+from case_export import case_folder, contact_sheet_pdf, export_zip
+from bulk_import import (
+    claim_import, find_import, finish_imports, import_chunk, imports_waiting, parse_record, queued_jobs,
+    read_records, source_key, start_import,
+)
+from database import close_db, db_session, get_cursor, get_db, init_db
+from derivatives import FORMATS, MIMETYPES, backfill, derivative_etag, derivative_path, ensure_derivative, pick_format
+from image_store import MIMETYPE as IMAGE_MIMETYPE, default_store, is_sharded, is_valid_key, key_etag, local_copy
+from latent_preview import PREVIEW_MIMETYPE
+from generation_queue import (
+    PRIORITY_BULK, PRIORITY_ROUTINE, PRIORITY_URGENT, GenerationJob, GenerationQueue, QueueFull,
+)
+from generation_service import ProcessGenerationPool
+from metrics import HTTP_REQUEST_SECONDS, PROFILERS, profile, render as render_metrics, stage_timer
+from prompt_builder import composite_prompt
+from read_cache import default_cache
+from similarity import default_index, image_features
+from image_generator import (
+    DEFAULT_MODE, FINAL_MODE, GENERATION_MODES, RESULT_CACHE, candidate_seeds, default_seed, embedding_cache_stats,
+    generate_batch, generation_metadata, get_device, model_state, preload_shared_model, resolve_mode, warm_up,
+)  # your existing module
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
 
-# MySQL Config — adjust as needed:
-app.config['MYSQL_HOST'] = 'localhost'
-app.config['MYSQL_USER'] = 'root'
-app.config['MYSQL_PASSWORD'] = ''
-app.config['MYSQL_DB'] = 'criminal_composite_db'
-app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
+# Pooled MySQL connections (settings in Config), one per request / app context
+init_db(app)
+
+# Sketches are rendered into the staging folder, then moved into the content-addressed image
+# store (settings in Config); composites and revisions record the store key
+app.config['STAGING_FOLDER'] = Config.IMAGE_STAGING_DIR
+os.makedirs(app.config['STAGING_FOLDER'], exist_ok=True)
+IMAGE_STORE = default_store()
+
+# Stored images and their thumbnails are immutable for a given URL; let browsers and proxies keep them for a year
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+
+# Job statuses that never change again
+JOB_FINISHED = ('done', 'failed', 'cancelled')
+# Seconds an idle job event stream waits before re-reading the job and sending a keep-alive
+SSE_KEEPALIVE = 15
+
+# Generation runs either on one worker thread in this process or in a pool of worker
+# processes; in both cases the model is loaded by the worker, never at import, so the
+# web tier starts fast. With MODEL_LOADING=mmap the pool loads it once in a fork server
+# and forks its workers from there, so they share the mapped weights.
+if Config.GENERATION_BACKEND == 'process':
+    generation_pool = ProcessGenerationPool(Config.GENERATION_WORKERS, Config.GENERATION_WORKER_THREADS,
+                                            share_model=Config.MODEL_LOADING == 'mmap')
+    generation_handler, generation_warmup, generation_workers = generation_pool, generation_pool.start, generation_pool.workers
+else:
+    generation_pool = None
+    generation_handler, generation_warmup, generation_workers = generate_batch, warm_up, 1
+
+# Bounded job queue in front of the workers (GPU concurrency safety), scheduling users fairly
+generation_queue = GenerationQueue(
+    generation_handler,
+    maxsize=Config.GENERATION_QUEUE_SIZE,
+    max_batch=Config.GENERATION_BATCH_SIZE,
+    batch_wait=Config.GENERATION_BATCH_WAIT,
+    warmup=generation_warmup,
+    workers=generation_workers,
+    user_concurrency=Config.SCHEDULER_USER_CONCURRENCY,
+    age_boost=Config.SCHEDULER_AGE_BOOST_SECONDS,
+    deadline_slack=Config.SCHEDULER_DEADLINE_SLACK_SECONDS,
+    history=Config.SCHEDULER_HISTORY,
+)
+
+# Spawned generation processes re-import this module as __mp_main__; only the real app starts workers
+IS_MAIN_PROCESS = multiprocessing.parent_process() is None
+
+if Config.GENERATION_PRELOAD and IS_MAIN_PROCESS:
+    if generation_pool is None and Config.MODEL_LOADING == 'mmap':
+        # Map the weights at import, before a preforking server (gunicorn --preload) forks its
+        # workers, so they all share them; each worker's generation thread starts on its first job
+        preload_shared_model()
+    else:
+        generation_queue.start()
+
+def generation_model_state():
+    return generation_pool.model_state() if generation_pool else model_state()
 
-mysql = MySQL(app)
+def generation_device():
+    return generation_pool.device if generation_pool else get_device()
 
-# Upload folder for images
-UPLOAD_FOLDER = os.path.join('static', 'generated')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# --- Request metrics and profiling ---
 
-# Load model once on startup
-try:
-    load_model()
-except Exception as e:
-    print(f"[ERROR] Failed to preload AI model: {e}")
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # ?profile=cprofile dumps a cProfile of this request to PROFILE_DIR (when configured)
+    if Config.PROFILE_DIR and request.args.get('profile') == 'cprofile':
+        g.request_profile = ExitStack()
+        g.request_profile.enter_context(profile('cprofile', f"request_{request.endpoint}", Config.PROFILE_DIR))
 
-# Thread lock for sketch generation (GPU concurrency safety)
-generation_lock = threading.Lock()
+@app.after_request
+def record_request_latency(response):
+    if 'request_start' in g:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=request.endpoint or 'unmatched',
+                                     method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc=None):
+    request_profile = g.pop('request_profile', None)
+    if request_profile is not None:
+        request_profile.close()
+
+def generation_profile():
+    """Profiler asked for on a generation request (?profile= or form field), if profiling is enabled."""
+    kind = request.args.get('profile') or request.form.get('profile')
+    return kind if Config.PROFILE_DIR and kind in PROFILERS else None
 
 # --- Helper decorators ---
 
@@ -41,6 +139,17 @@ generation_lock = threading.Lock()
 def inject_now():
     return {'now': datetime.now()}
 
+@app.template_global()
+def thumbnail_url(key, large=False):
+    """URL of a sketch's thumbnail: the smallest configured size for grids, the largest for lists."""
+    size = Config.THUMBNAIL_SIZES[-1] if large else Config.THUMBNAIL_SIZES[0]
+    return url_for('thumbnail', size=size, key=key)
+
+@app.template_global()
+def image_url(key):
+    """URL of a stored sketch at full size."""
+    return url_for('stored_image', key=key)
+
 
 def login_required(f):
     @wraps(f)
@@ -62,39 +171,610 @@ def role_required(role):
         return decorated
     return decorator
 
-# --- Background sketch generation thread ---
+# --- Read models ---
+
+# Cached rows behind the case, composite and dashboard pages. Each write below
+# invalidates exactly the entries it changes (see the invalidate calls next to each write).
+READ_CACHE = default_cache()
+
+def query(sql, args=(), one=False):
+    cur = get_cursor()
+    cur.execute(sql, args)
+    rows = cur.fetchone() if one else cur.fetchall()
+    cur.close()
+    return rows
+
+def cached_recent_cases(user_id=None):
+    """The five newest cases, of `user_id` only if given."""
+    if user_id is None:
+        return READ_CACHE.fetch('recent_cases', 'all', lambda: query(
+            "SELECT c.*, u.full_name FROM cases c JOIN users u ON c.created_by = u.id ORDER BY c.created_at DESC LIMIT 5"
+        ))
+    return READ_CACHE.fetch('recent_cases', user_id, lambda: query("""
+        SELECT c.*, u.full_name
+        FROM cases c JOIN users u ON c.created_by = u.id
+        WHERE c.created_by = %s
+        ORDER BY c.created_at DESC LIMIT 5
+    """, (user_id,)))
 
-class SketchGenerator(threading.Thread):
-    def __init__(self, prompt, save_path, case_id, user_id, description):
-        super().__init__()
-        self.prompt = prompt
-        self.save_path = save_path
+def cached_case(case_id):
+    """A case with its creator's name, or None."""
+    return READ_CACHE.fetch('case', case_id, lambda: query("""
+        SELECT c.*, u.full_name
+        FROM cases c JOIN users u ON c.created_by = u.id
+        WHERE c.id = %s
+    """, (case_id,), one=True))
+
+def cached_case_composites(case_id):
+    """A case's composites with their authors' names, newest first."""
+    return READ_CACHE.fetch('case_composites', case_id, lambda: query("""
+        SELECT co.*, u.full_name
+        FROM composites co JOIN users u ON co.user_id = u.id
+        WHERE co.case_id = %s
+        ORDER BY co.created_at DESC
+    """, (case_id,)))
+
+def cached_composite(composite_id):
+    """A composite with its author's name and badge, or None."""
+    return READ_CACHE.fetch('composite', composite_id, lambda: query("""
+        SELECT co.*, u.full_name, u.badge_number
+        FROM composites co JOIN users u ON co.user_id = u.id
+        WHERE co.id = %s
+    """, (composite_id,), one=True))
+
+def cached_revisions(composite_id):
+    """A composite's revisions with their requesters' names, newest first."""
+    return READ_CACHE.fetch('revisions', composite_id, lambda: query("""
+        SELECT r.*, u.full_name
+        FROM revisions r LEFT JOIN users u ON r.user_id = u.id
+        WHERE r.composite_id = %s
+        ORDER BY r.created_at DESC
+    """, (composite_id,)))
+
+# --- Background sketch generation ---
+
+# Wakes long-polling status requests and event streams whenever a generation job changes
+# state or has a new preview
+job_status_changed = threading.Condition()
+# Latest latent preview of each running job (job id -> event payload), guarded by job_status_changed
+job_previews = {}
+
+class SketchJob(GenerationJob):
+    def __init__(self, job_id, prompt, save_paths, case_id, user_id, description, mode=None, seeds=None,
+                 profile=None, priority=PRIORITY_ROUTINE, deadline=None):
+        mode = resolve_mode(mode)
+        seeds = seeds or [default_seed(prompt)]
+        options = {'mode': mode, 'profile': profile} if profile else {'mode': mode}
+        super().__init__(prompt, save_paths, on_done=save_composite, on_start=mark_job_running,
+                         options=options, seeds=seeds, on_preview=record_preview, owner=user_id,
+                         priority=priority, deadline=deadline)
+        self.job_id = job_id
+        self.mode = mode
         self.case_id = case_id
         self.user_id = user_id
         self.description = description
 
-    def run(self):
-        with generation_lock:
-            try:
-                ret_path = generate_sketch_image(self.prompt, self.save_path)
-                if not ret_path:
-                    print("[ERROR] Sketch generation failed.")
-                    return
+class RevisionJob(GenerationJob):
+    def __init__(self, job_id, prompt, save_path, parent_image_path, composite_id, user_id, adjustment_text,
+                 mode=None, seed=None, priority=PRIORITY_ROUTINE, deadline=None):
+        mode = resolve_mode(mode)
+        super().__init__(prompt, save_path, on_done=save_revision, on_start=mark_job_running,
+                         options={'mode': mode}, init_image=parent_image_path,
+                         seeds=[default_seed(prompt) if seed is None else seed], on_preview=record_preview,
+                         owner=user_id, priority=priority, deadline=deadline, adjustment=adjustment_text)
+        self.job_id = job_id
+        self.mode = mode
+        self.composite_id = composite_id
+        self.user_id = user_id
+        self.adjustment_text = adjustment_text
 
-                with app.app_context():
-                    cur = mysql.connection.cursor()
-                    cur.execute(
-                        """
-                        INSERT INTO composites (case_id, user_id, description, image_path)
-                        VALUES (%s, %s, %s, %s)
-                        """,
-                        (self.case_id, self.user_id, self.description, os.path.basename(self.save_path))
-                    )
-                    mysql.connection.commit()
-                    cur.close()
-                print(f"[INFO] Sketch generated and saved to DB: {self.save_path}")
-            except Exception as e:
-                print(f"[ERROR] SketchGenerator thread error: {e}")
+def candidate_filenames(filename, count):
+    """Output file per candidate: the job's own filename for one, `<stem>_c<i>.png` for several."""
+    if count == 1:
+        return [filename]
+    stem, ext = os.path.splitext(filename)
+    return [f"{stem}_c{i}{ext}" for i in range(count)]
+
+def job_seeds(row):
+    return json.loads(row['seeds']) if row.get('seeds') else [default_seed(row['prompt'])]
+
+def job_priority(cur, case_id):
+    """Scheduling tier of a job requested now: urgent for admins and for cases flagged urgent."""
+    if session.get('role') == 'admin':
+        return PRIORITY_URGENT
+    cur.execute("SELECT is_urgent FROM cases WHERE id = %s", (case_id,))
+    case = cur.fetchone()
+    return PRIORITY_URGENT if case and case['is_urgent'] else PRIORITY_ROUTINE
+
+def requested_deadline():
+    """Start-by time from the form's optional 'needed within N minutes' field, or None."""
+    minutes = request.form.get('deadline_minutes', type=float)
+    return datetime.now() + timedelta(minutes=minutes) if minutes and minutes > 0 else None
+
+def deadline_timestamp(deadline):
+    return deadline.timestamp() if deadline else None
+
+def revision_prompt(parent_description, adjustment_text):
+    # Stored and cached as one text; the job also passes the adjustment on by itself, so the
+    # prompt builder ranks it above every phrase of the parent when the token budget is tight
+    return f"{adjustment_text}. {parent_description}"
+
+def notify_job_status():
+    with job_status_changed:
+        job_status_changed.notify_all()
+
+def record_preview(job, step, steps, image):
+    """Worker callback: keep a running job's newest latent preview for its event stream."""
+    preview = {
+        'id': job.job_id,
+        'step': step,
+        'steps': steps,
+        'image': f"data:{PREVIEW_MIMETYPE};base64,{base64.b64encode(image).decode('ascii')}",
+    }
+    with job_status_changed:
+        job_previews[job.job_id] = preview
+        job_status_changed.notify_all()
+
+def finish_job(job):
+    """Drop a finished job's preview; True if the job was cancelled (nothing is saved then)."""
+    with job_status_changed:
+        job_previews.pop(job.job_id, None)
+    if job.cancelled:
+        print(f"[INFO] Generation job {job.job_id} cancelled.")
+        notify_job_status()
+    return job.cancelled
+
+def discard_images(cur, keys):
+    """
+    Remove stored sketches (and their thumbnails) that no composite or revision refers to,
+    e.g. renders of a job cancelled while it was being saved. Keys are content hashes, so an
+    identical image another row already uses is kept.
+    """
+    for key in filter(None, keys):
+        cur.execute("""
+            SELECT 1 FROM composites WHERE image_path = %s
+            UNION ALL
+            SELECT 1 FROM revisions WHERE revised_image_path = %s
+            LIMIT 1
+        """, (key, key))
+        if cur.fetchone():
+            continue
+        IMAGE_STORE.delete(key)
+        for size in Config.THUMBNAIL_SIZES:
+            for fmt in FORMATS:
+                path = derivative_path(key, size, fmt)
+                if os.path.exists(path):
+                    os.remove(path)
+
+def mark_job_running(job):
+    """Worker callback: flag a job as running just before its batch is rendered."""
+    with app.app_context():
+        cur = get_cursor()
+        cur.execute(
+            "UPDATE generation_jobs SET status = 'running', started_at = NOW() WHERE id = %s AND status = 'queued'",
+            (job.job_id,)
+        )
+        get_db().commit()
+        cur.close()
+    notify_job_status()
+
+def mark_job_failed(job_id, error_text):
+    with app.app_context():
+        cur = get_cursor()
+        cur.execute(
+            "UPDATE generation_jobs SET status = 'failed', error_text = %s, finished_at = NOW() WHERE id = %s",
+            (error_text, job_id)
+        )
+        get_db().commit()
+        cur.close()
+    notify_job_status()
+
+def save_composite(job, saved):
+    """Worker callback: record each finished candidate in the composites table and close the job."""
+    if finish_job(job):
+        return
+    if not any(saved):
+        print("[ERROR] Sketch generation failed.")
+        mark_job_failed(job.job_id, job.error or 'Sketch generation failed.')
+        return
+
+    failed = saved.count(None)
+    cancelled = False
+    try:
+        with app.app_context(), stage_timer('db_insert', job.mode):
+            cur = get_cursor()
+            composite_ids = []
+            for index, (path, seed) in enumerate(zip(saved, job.seeds)):
+                if not path:
+                    continue
+                extra = {'candidate': index, 'candidates': job.size} if job.size > 1 else {}
+                params = generation_metadata(job.prompt, job.mode, seed=seed, device=generation_device(), **extra)
+                cur.execute(
+                    """
+                    INSERT INTO composites (case_id, user_id, description, image_path, generation_params, seed, job_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (job.case_id, job.user_id, job.description, path, json.dumps(params), seed, job.job_id)
+                )
+                composite_ids.append(cur.lastrowid)
+            cur.execute(
+                """
+                UPDATE generation_jobs
+                SET status = 'done', composite_id = %s, error_text = %s, finished_at = NOW()
+                WHERE id = %s AND status IN ('queued', 'running')
+                """,
+                (composite_ids[0], f"{failed} of {job.size} candidates failed." if failed else None, job.job_id)
+            )
+            # Cancelled after its batch finished rendering: keep the cancel, not the sketches
+            cancelled = cur.rowcount == 0
+            if cancelled:
+                get_db().rollback()
+                discard_images(cur, saved)
+            get_db().commit()
+            cur.close()
+    except Exception as e:
+        mark_job_failed(job.job_id, f"Saving composite failed: {e}")
+        raise
+    if cancelled:
+        print(f"[INFO] Generation job {job.job_id} cancelled before it was saved; its sketches were discarded.")
+        notify_job_status()
+        return
+    READ_CACHE.invalidate('case_composites', job.case_id)
+    notify_job_status()
+    print(f"[INFO] {len(composite_ids)} sketch(es) generated and saved to DB: {next(filter(None, saved))}")
+    with stage_timer('similarity_index', job.mode):
+        index_composites([(composite_id, job.case_id, key)
+                          for composite_id, key in zip(composite_ids, filter(None, saved))])
+
+def save_revision(job, saved):
+    """Worker callback: record a finished revision in the revisions table and close its job."""
+    if finish_job(job):
+        return
+    if not saved[0]:
+        print("[ERROR] Sketch revision failed.")
+        mark_job_failed(job.job_id, job.error or 'Sketch revision failed.')
+        return
+
+    params = generation_metadata(job.prompt, job.mode, seed=job.seeds[0], device=generation_device(),
+                                 revision_of=job.composite_id, strength=Config.REVISION_STRENGTH)
+    cancelled = False
+    try:
+        with app.app_context(), stage_timer('db_insert', job.mode):
+            cur = get_cursor()
+            cur.execute(
+                """
+                INSERT INTO revisions (composite_id, user_id, adjustment_text, revised_image_path, generation_params, seed)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                (job.composite_id, job.user_id, job.adjustment_text, saved[0], json.dumps(params), job.seeds[0])
+            )
+            revision_id = cur.lastrowid
+            cur.execute(
+                """
+                UPDATE generation_jobs
+                SET status = 'done', revision_id = %s, finished_at = NOW()
+                WHERE id = %s AND status IN ('queued', 'running')
+                """,
+                (revision_id, job.job_id)
+            )
+            cancelled = cur.rowcount == 0
+            if cancelled:
+                get_db().rollback()
+                discard_images(cur, saved)
+            get_db().commit()
+            cur.close()
+    except Exception as e:
+        mark_job_failed(job.job_id, f"Saving revision failed: {e}")
+        raise
+    if cancelled:
+        print(f"[INFO] Revision job {job.job_id} cancelled before it was saved; its sketch was discarded.")
+        notify_job_status()
+        return
+    READ_CACHE.invalidate('revisions', job.composite_id)
+    notify_job_status()
+    print(f"[INFO] Revision generated and saved to DB: {saved[0]}")
+
+def staging_paths(filename, count):
+    return [os.path.join(app.config['STAGING_FOLDER'], name) for name in candidate_filenames(filename, count)]
+
+def local_image_path(key):
+    """
+    Local file of a stored sketch, for img2img revisions: the stored file itself, or (object
+    stores) a copy downloaded into the staging folder, kept there for later revisions.
+    """
+    path = IMAGE_STORE.local_path(key)
+    if path is None:
+        path = os.path.join(app.config['STAGING_FOLDER'], 'parents', key.replace('/', '_'))
+        if not os.path.exists(path):
+            IMAGE_STORE.download(key, path)
+    return path
+
+def job_from_row(row):
+    seeds = job_seeds(row)
+    priority = PRIORITY_ROUTINE if row.get('priority') is None else row['priority']
+    deadline = deadline_timestamp(row.get('deadline'))
+    save_paths = staging_paths(row['image_path'], len(seeds))
+    save_path = save_paths[0]
+    if row['kind'] == 'revision':
+        with app.app_context():
+            cur = get_cursor()
+            cur.execute("SELECT image_path FROM composites WHERE id = %s", (row['parent_composite_id'],))
+            parent = cur.fetchone()
+            cur.close()
+        parent_path = local_image_path(parent['image_path'])
+        return RevisionJob(row['id'], row['prompt'], save_path, parent_path, row['parent_composite_id'],
+                           row['user_id'], row['adjustment_text'], mode=row['mode'], seed=seeds[0],
+                           priority=priority, deadline=deadline)
+    return SketchJob(row['id'], row['prompt'], save_paths, row['case_id'], row['user_id'], row['description'],
+                     mode=row['mode'], seeds=seeds, priority=priority, deadline=deadline)
+
+# Jobs the web server owns: its own, plus those of imports it has claimed. Imports still
+# importing, waiting to be claimed or rendered by `flask import-cases` are left alone.
+SERVER_OWNED_JOB = "(j.import_id IS NULL OR (i.status = 'generating' AND i.claimed_by = 'server'))"
+
+def resume_pending_jobs():
+    """Re-queue jobs left queued or running by a previous process."""
+    try:
+        with app.app_context():
+            cur = get_cursor()
+            cur.execute(f"""
+                UPDATE generation_jobs j LEFT JOIN imports i ON j.import_id = i.id
+                SET j.status = 'queued', j.started_at = NULL
+                WHERE j.status = 'running' AND {SERVER_OWNED_JOB}
+            """)
+            get_db().commit()
+            cur.execute(f"""
+                SELECT j.* FROM generation_jobs j LEFT JOIN imports i ON j.import_id = i.id
+                WHERE j.status = 'queued' AND {SERVER_OWNED_JOB}
+                ORDER BY j.id
+            """)
+            rows = cur.fetchall()
+            cur.close()
+    except Exception as e:
+        print(f"[ERROR] Could not resume pending generation jobs: {e}")
+        return
+
+    for row in rows:
+        generation_queue.submit(job_from_row(row), block=True)
+    if rows:
+        print(f"[INFO] Resumed {len(rows)} pending generation job(s).")
+
+def queue_import_jobs(rows, headroom=0):
+    """
+    Submit an import's queued jobs, waiting whenever fewer than `headroom` queue slots are
+    free so interactive requests can still get in ahead of a large import.
+    """
+    for row in rows:
+        while headroom:
+            stats = generation_queue.stats()
+            if stats['queue_capacity'] - stats['queue_depth'] > headroom:
+                break
+            time.sleep(1)
+        generation_queue.submit(job_from_row(row), block=True)
+
+def poll_imports():
+    """Render imports left for the web server (`flask import-cases --no-generate`) and close finished ones."""
+    while True:
+        try:
+            with app.app_context():
+                cur = get_cursor()
+                finish_imports(cur)
+                get_db().commit()
+                claimed = []
+                for import_id in imports_waiting(cur):
+                    if claim_import(cur, import_id, 'server'):
+                        claimed.append((import_id, queued_jobs(cur, import_id)))
+                    get_db().commit()
+                cur.close()
+            for import_id, rows in claimed:
+                print(f"[INFO] Queuing {len(rows)} composite(s) from import {import_id}.")
+                queue_import_jobs(rows, headroom=generation_queue.stats()['queue_capacity'] // 2)
+        except Exception as e:
+            print(f"[ERROR] Import poll failed: {e}")
+        time.sleep(Config.IMPORT_POLL_SECONDS)
+
+_background_lock = threading.Lock()
+_background_started = False
+
+# --- Similar composites ---
+
+def composite_features(key):
+    with local_copy(IMAGE_STORE, key) as path:
+        return image_features(path)
+
+def index_composites(rows, workers=1):
+    """
+    Add (composite id, case id, image key) rows to the similarity index, saving it every
+    SIMILARITY_SAVE_EVERY additions. An unreadable image only skips its composite.
+    Returns how many were indexed.
+    """
+    def features(row):
+        try:
+            return composite_features(row[2])
+        except Exception as e:
+            print(f"[WARN] Could not index composite {row[0]} ({row[2]}): {e}")
+            return None
+
+    index = default_index()
+    indexed = 0
+    with ThreadPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as pool:
+        for (composite_id, case_id, _), result in zip(rows, (pool.map if pool else map)(features, rows)):
+            if result is None:
+                continue
+            index.add(composite_id, case_id, *result)
+            indexed += 1
+            if index.unsaved >= Config.SIMILARITY_SAVE_EVERY:
+                index.save(Config.SIMILARITY_INDEX_PATH)
+    return indexed
+
+def unindexed_composites():
+    with db_session() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, case_id, image_path FROM composites ORDER BY id")
+        rows = cur.fetchall()
+    index = default_index()
+    return [row for row in rows if row[0] not in index]
+
+def sync_similarity_index():
+    """Index composites saved while no server was running (existing archives: `flask backfill-similarity`)."""
+    try:
+        rows = unindexed_composites()
+        if rows:
+            print(f"[INFO] Indexing {len(rows)} composite(s) missing from the similarity index...")
+            index_composites(rows)
+            default_index().save(Config.SIMILARITY_INDEX_PATH)
+    except Exception as e:
+        print(f"[ERROR] Similarity index sync failed: {e}")
+
+def save_similarity_index():
+    index = default_index()
+    if index.unsaved:
+        index.save(Config.SIMILARITY_INDEX_PATH)
+
+def similar_composites(cur, composite, k, same_case=False):
+    """
+    Composites that look most like `composite` (in other cases, unless `same_case`), each a
+    composites row with its case number, similarity and hash distance; most similar first.
+    """
+    index = default_index()
+    features = index.features(composite['id'])
+    if features is None:
+        try:
+            features = composite_features(composite['image_path'])
+        except Exception as e:
+            print(f"[WARN] Could not index composite {composite['id']}: {e}")
+            return []
+        index.add(composite['id'], composite['case_id'], *features)
+
+    matches = index.search(*features, k=k, exclude_case=None if same_case else composite['case_id'],
+                           exclude_ids=(composite['id'],))
+    if not matches:
+        return []
+    cur.execute(f"""
+        SELECT co.id, co.case_id, co.image_path, co.description, co.is_accurate, c.case_number
+        FROM composites co JOIN cases c ON co.case_id = c.id
+        WHERE co.id IN ({', '.join(['%s'] * len(matches))})
+    """, [match['composite_id'] for match in matches])
+    rows = {row['id']: row for row in cur.fetchall()}
+    return [dict(rows[match['composite_id']], **match) for match in matches if match['composite_id'] in rows]
+
+# --- Case exports ---
+
+# Multi-case exports run here, one at a time by default, off the request path
+export_executor = ThreadPoolExecutor(max_workers=Config.EXPORT_WORKERS, thread_name_prefix='case-export')
+
+def load_dossier(cur, case_id):
+    """A case with its composites and revisions (and who made them), or None."""
+    cur.execute("""
+        SELECT c.*, u.full_name
+        FROM cases c LEFT JOIN users u ON c.created_by = u.id
+        WHERE c.id = %s
+    """, (case_id,))
+    case = cur.fetchone()
+    if not case:
+        return None
+    cur.execute("""
+        SELECT co.*, u.full_name, u.badge_number
+        FROM composites co LEFT JOIN users u ON co.user_id = u.id
+        WHERE co.case_id = %s
+        ORDER BY co.created_at, co.id
+    """, (case_id,))
+    composites = cur.fetchall()
+    cur.execute("""
+        SELECT r.*, u.full_name
+        FROM revisions r JOIN composites co ON r.composite_id = co.id LEFT JOIN users u ON r.user_id = u.id
+        WHERE co.case_id = %s
+        ORDER BY r.created_at, r.id
+    """, (case_id,))
+    return {'case': case, 'composites': composites, 'revisions': cur.fetchall()}
+
+def stored_dossiers(case_ids):
+    """Dossiers of `case_ids`, each loaded (on its own pooled connection) only when the export reaches it."""
+    for case_id in case_ids:
+        with db_session() as conn:
+            dossier = load_dossier(conn.cursor(dictionary=True), case_id)
+        if dossier is None:
+            print(f"[WARN] Export skipped case {case_id}: not found")
+            continue
+        yield dossier
+
+def export_path(export_id):
+    return os.path.join(Config.EXPORT_DIR, f"export_{export_id}.zip")
+
+def run_export(export_id):
+    """Background job: write a multi-case export to EXPORT_DIR and record the finished file."""
+    path = export_path(export_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        with db_session() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("UPDATE exports SET status = 'running' WHERE id = %s", (export_id,))
+            cur.execute("SELECT * FROM exports WHERE id = %s", (export_id,))
+            export = cur.fetchone()
+        case_ids = json.loads(export['case_ids'])
+        start = time.time()
+        size = 0
+        os.makedirs(Config.EXPORT_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            for chunk in export_zip(stored_dossiers(case_ids), IMAGE_STORE, contact_sheet=bool(export['contact_sheet'])):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+        with db_session() as conn:
+            conn.cursor().execute(
+                "UPDATE exports SET status = 'done', file_path = %s, bytes = %s, finished_at = NOW() WHERE id = %s",
+                (path, size, export_id)
+            )
+        print(f"[INFO] Export {export_id}: {len(case_ids)} case(s), {size / 2**20:.1f} MB in {time.time() - start:.1f}s")
+    except Exception as e:
+        print(f"[ERROR] Export {export_id} failed: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with db_session() as conn:
+            conn.cursor().execute(
+                "UPDATE exports SET status = 'failed', error_text = %s, finished_at = NOW() WHERE id = %s",
+                (str(e), export_id)
+            )
+
+def resume_exports():
+    """Re-run exports a previous process left queued or unfinished."""
+    try:
+        with db_session() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("SELECT id FROM exports WHERE status IN ('queued', 'running') ORDER BY id")
+            rows = cur.fetchall()
+    except Exception as e:
+        print(f"[ERROR] Could not resume pending exports: {e}")
+        return
+    for row in rows:
+        export_executor.submit(run_export, row['id'])
+    if rows:
+        print(f"[INFO] Resumed {len(rows)} pending export(s).")
+
+def start_background_jobs():
+    """
+    Resume unfinished jobs and exports, start the import poller and catch the similarity
+    index up with composites it is missing, once per server process. Runs on the
+    first request rather than at import, so CLI commands (which import this module too) never
+    pick up jobs the server owns.
+    """
+    global _background_started
+    if _background_started or not IS_MAIN_PROCESS:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    threading.Thread(target=resume_pending_jobs, name="resume-generation-jobs", daemon=True).start()
+    threading.Thread(target=resume_exports, name="resume-exports", daemon=True).start()
+    threading.Thread(target=sync_similarity_index, name="similarity-index-sync", daemon=True).start()
+    atexit.register(save_similarity_index)
+    if Config.IMPORT_POLL_SECONDS:
+        threading.Thread(target=poll_imports, name="import-poller", daemon=True).start()
+
+@app.before_request
+def ensure_background_jobs():
+    start_background_jobs()
 
 # --- Routes ---
 
@@ -102,20 +782,8 @@ class SketchGenerator(threading.Thread):
 @login_required
 def index():
     try:
-        cur = mysql.connection.cursor()
-        if session['role'] == 'admin':
-            # Admin sees all recent cases:
-            cur.execute("SELECT c.*, u.full_name FROM cases c JOIN users u ON c.created_by = u.id ORDER BY c.created_at DESC LIMIT 5")
-        else:
-            # Officers see only their created cases
-            cur.execute("""
-                SELECT c.*, u.full_name
-                FROM cases c JOIN users u ON c.created_by = u.id
-                WHERE c.created_by = %s
-                ORDER BY c.created_at DESC LIMIT 5
-            """, (session['user_id'],))
-        recent_cases = cur.fetchall()
-        cur.close()
+        # Admin sees all recent cases, officers only the ones they created
+        recent_cases = cached_recent_cases(None if session['role'] == 'admin' else session['user_id'])
         return render_template('index.html', recent_cases=recent_cases)
     except Exception as e:
         flash(f"Database error: {e}", "danger")
@@ -131,11 +799,15 @@ def login():
             flash('All fields are required.', 'danger')
             return redirect(url_for('login'))
 
-        cur = mysql.connection.cursor()
-        # Allow login via username or badge number
-        cur.execute("SELECT * FROM users WHERE username = %s OR badge_number = %s", (username, username))
-        user = cur.fetchone()
-        cur.close()
+        # Allow login via username or badge number. Never cached: the row holds the password hash, and
+        # a changed password or badge must take effect at once. Two single-index lookups, as
+        # `username = %s OR badge_number = %s` can't use one index for both.
+        user = query("""
+            (SELECT *, 0 AS by_badge FROM users WHERE username = %s)
+            UNION ALL
+            (SELECT *, 1 AS by_badge FROM users WHERE badge_number = %s)
+            ORDER BY by_badge LIMIT 1
+        """, (username, username), one=True)
 
         if user and check_password_hash(user['password'], password):
             session['logged_in'] = True
@@ -173,7 +845,7 @@ def register():
             return redirect(url_for('register'))
 
         try:
-            cur = mysql.connection.cursor()
+            cur = get_cursor()
             # Check username uniqueness
             cur.execute("SELECT id FROM users WHERE username = %s", (username,))
             if cur.fetchone():
@@ -186,57 +858,82 @@ def register():
                 "INSERT INTO users (username, password, full_name, badge_number, role) VALUES (%s, %s, %s, %s, %s)",
                 (username, hashed_password, full_name, badge_number, role)
             )
-            mysql.connection.commit()
+            get_db().commit()
             cur.close()
             flash('User registered successfully.', 'success')
             return redirect(url_for('index'))
         except Exception as e:
             flash(f'Error: {e}', 'danger')
-            mysql.connection.rollback()
+            get_db().rollback()
             return redirect(url_for('register'))
 
     return render_template('register.html')
 
+def fulltext_terms(search_query):
+    """
+    Turn free text into a BOOLEAN MODE query requiring every word as a prefix. Words shorter
+    than InnoDB's minimum token size (3) are never indexed, so they are left out.
+    """
+    words = ''.join(ch if ch.isalnum() else ' ' for ch in search_query).split()
+    return ' '.join(f"+{word}*" for word in words if len(word) >= 3)
+
+def parse_cases_cursor(value):
+    """`<created_at ISO>,<id>` of the last row on the previous page, or None."""
+    try:
+        created_at, case_id = value.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(case_id)
+    except (AttributeError, ValueError):
+        return None
+
 @app.route('/cases')
 @login_required
 def cases():
     search_query = request.args.get('search', '').strip()
+    after = parse_cases_cursor(request.args.get('cursor'))
+    page_size = Config.CASES_PAGE_SIZE
+
+    conditions, params = [], []
+    if session['role'] != 'admin':
+        conditions.append("c.created_by = %s")
+        params.append(session['user_id'])
+    if search_query:
+        # FULLTEXT match on description/location, or a case-number prefix; both use an index
+        terms = fulltext_terms(search_query)
+        matches = ["SELECT id FROM cases WHERE case_number LIKE %s"]
+        match_params = [search_query.replace('%', r'\%').replace('_', r'\_') + '%']
+        if terms:
+            matches.append("SELECT id FROM cases WHERE MATCH(description, location) AGAINST (%s IN BOOLEAN MODE)")
+            match_params.append(terms)
+        conditions.append(f"c.id IN ({' UNION '.join(matches)})")
+        params.extend(match_params)
+    if after:
+        # Keyset pagination: rows strictly after the previous page's last (created_at, id)
+        conditions.append("(c.created_at < %s OR (c.created_at = %s AND c.id < %s))")
+        params.extend([after[0], after[0], after[1]])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
     try:
-        cur = mysql.connection.cursor()
-        if session['role'] == 'admin':
-            if search_query:
-                like_pattern = f"%{search_query}%"
-                cur.execute("""
-                    SELECT c.*, u.full_name
-                    FROM cases c JOIN users u ON c.created_by = u.id
-                    WHERE c.case_number LIKE %s OR c.description LIKE %s OR c.location LIKE %s
-                    ORDER BY c.created_at DESC
-                """, (like_pattern, like_pattern, like_pattern))
-            else:
-                cur.execute("SELECT c.*, u.full_name FROM cases c JOIN users u ON c.created_by = u.id ORDER BY c.created_at DESC")
-        else:
-            if search_query:
-                like_pattern = f"%{search_query}%"
-                cur.execute("""
-                    SELECT c.*, u.full_name
-                    FROM cases c JOIN users u ON c.created_by = u.id
-                    WHERE c.created_by = %s AND (c.case_number LIKE %s OR c.description LIKE %s OR c.location LIKE %s)
-                    ORDER BY c.created_at DESC
-                """, (session['user_id'], like_pattern, like_pattern, like_pattern))
-            else:
-                cur.execute("""
-                    SELECT c.*, u.full_name
-                    FROM cases c JOIN users u ON c.created_by = u.id
-                    WHERE c.created_by = %s
-                    ORDER BY c.created_at DESC
-                """, (session['user_id'],))
+        cur = get_cursor()
+        cur.execute(f"""
+            SELECT c.*, u.full_name
+            FROM cases c JOIN users u ON c.created_by = u.id
+            {where}
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT %s
+        """, params + [page_size + 1])
         cases_list = cur.fetchall()
         cur.close()
-        return render_template('cases.html', cases=cases_list)
     except Exception as e:
         flash(f"Database error: {e}", "danger")
         return redirect(url_for('index'))
 
+    next_cursor = None
+    if len(cases_list) > page_size:
+        cases_list = cases_list[:page_size]
+        last = cases_list[-1]
+        next_cursor = f"{last['created_at'].isoformat()},{last['id']}"
+    return render_template('cases.html', cases=cases_list, next_cursor=next_cursor, paged=after is not None)
+
 @app.route('/create-case', methods=['GET', 'POST'])
 @login_required
 def create_case():
@@ -251,18 +948,19 @@ def create_case():
             return redirect(url_for('create_case'))
 
         try:
-            cur = mysql.connection.cursor()
+            cur = get_cursor()
             cur.execute(
                 "INSERT INTO cases (case_number, description, location, incident_date, created_by) VALUES (%s, %s, %s, %s, %s)",
                 (case_number, description, location, incident_date, session['user_id'])
             )
-            mysql.connection.commit()
+            get_db().commit()
             case_id = cur.lastrowid
             cur.close()
+            READ_CACHE.invalidate('recent_cases', 'all', session['user_id'])
             flash('Case created successfully.', 'success')
             return redirect(url_for('create_composite', case_id=case_id))
         except Exception as e:
-            mysql.connection.rollback()
+            get_db().rollback()
             flash(f"Error creating case: {e}", "danger")
             return redirect(url_for('create_case'))
 
@@ -272,45 +970,185 @@ def create_case():
 @login_required
 def view_case(case_id):
     try:
-        cur = mysql.connection.cursor()
-        # Fetch case + creator info
-        cur.execute("""
-            SELECT c.*, u.full_name
-            FROM cases c JOIN users u ON c.created_by = u.id
-            WHERE c.id = %s
-        """, (case_id,))
-        case = cur.fetchone()
-
+        # Case + creator info
+        case = cached_case(case_id)
         if not case:
-            cur.close()
             flash('Case not found.', 'danger')
             return redirect(url_for('index'))
 
-        # Fetch composites + author info
+        # Composites + author info
+        composites = cached_case_composites(case_id)
+
+        # Jobs still being generated are shown as placeholders that poll for completion (not
+        # cached: they change every few seconds)
+        cur = get_cursor()
         cur.execute("""
-            SELECT co.*, u.full_name
-            FROM composites co JOIN users u ON co.user_id = u.id
-            WHERE co.case_id = %s
-            ORDER BY co.created_at DESC
+            SELECT id, status, created_at
+            FROM generation_jobs
+            WHERE case_id = %s AND status IN ('queued', 'running')
+            ORDER BY id
         """, (case_id,))
-        composites = cur.fetchall()
+        pending_jobs = cur.fetchall()
 
         cur.close()
-        return render_template('view_case.html', case=case, composites=composites)
+        return render_template('view_case.html', case=case, composites=composites, pending_jobs=pending_jobs)
     except Exception as e:
         flash(f"Database error: {e}", "danger")
         return redirect(url_for('index'))
 
+@app.route('/case/<int:case_id>/export')
+@login_required
+def export_case(case_id):
+    """
+    Stream a case dossier as it is built: a ZIP of every composite and revision image with
+    their metadata and generation parameters (?contact_sheet=1 adds a PDF contact sheet),
+    or ?format=pdf for the contact sheet alone.
+    """
+    cur = get_cursor()
+    dossier = load_dossier(cur, case_id)
+    cur.close()
+    if not dossier:
+        flash('Case not found.', 'danger')
+        return redirect(url_for('index'))
+    # The stream only reads the image store: hand the connection back before it starts
+    close_db()
+
+    folder = case_folder(dossier['case'])
+    if request.args.get('format') == 'pdf':
+        body, mimetype, filename = contact_sheet_pdf(dossier, IMAGE_STORE), 'application/pdf', f"{folder}_contact_sheet.pdf"
+    else:
+        body = export_zip([dossier], IMAGE_STORE, contact_sheet=request.args.get('contact_sheet') == '1')
+        mimetype, filename = 'application/zip', f"{folder}.zip"
+    print(f"[INFO] Case {dossier['case']['case_number']} exported ({filename}) by user {session['user_id']}")
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx would otherwise buffer the whole archive
+    return response
+
+@app.route('/exports', methods=['GET', 'POST'])
+@login_required
+def exports():
+    """Queue a multi-case export (POST, `case_id` per case) or list the user's exports."""
+    cur = get_cursor()
+    if request.method == 'POST':
+        case_ids = list(dict.fromkeys(request.form.getlist('case_id', type=int)))
+        if not case_ids:
+            cur.close()
+            flash('Select at least one case to export.', 'warning')
+            return redirect(request.referrer or url_for('cases'))
+        cur.execute(
+            "INSERT INTO exports (user_id, case_ids, contact_sheet) VALUES (%s, %s, %s)",
+            (session['user_id'], json.dumps(case_ids), request.form.get('contact_sheet') == '1')
+        )
+        get_db().commit()
+        export_id = cur.lastrowid
+        cur.close()
+        export_executor.submit(run_export, export_id)
+        flash(f'Export of {len(case_ids)} case(s) queued. It will be ready to download below.', 'info')
+        return redirect(url_for('exports'))
+
+    if session['role'] == 'admin':
+        cur.execute("SELECT e.*, u.full_name FROM exports e LEFT JOIN users u ON e.user_id = u.id ORDER BY e.id DESC LIMIT 50")
+    else:
+        cur.execute("""
+            SELECT e.*, u.full_name FROM exports e LEFT JOIN users u ON e.user_id = u.id
+            WHERE e.user_id = %s ORDER BY e.id DESC LIMIT 50
+        """, (session['user_id'],))
+    rows = cur.fetchall()
+    cur.close()
+    for row in rows:
+        row['case_count'] = len(json.loads(row['case_ids']))
+    return render_template('exports.html', exports=rows,
+                           pending=any(row['status'] in ('queued', 'running') for row in rows))
+
+@app.route('/exports/<int:export_id>/download')
+@login_required
+def download_export(export_id):
+    cur = get_cursor()
+    cur.execute("SELECT * FROM exports WHERE id = %s", (export_id,))
+    export = cur.fetchone()
+    cur.close()
+    allowed = export and (export['user_id'] == session['user_id'] or session.get('role') == 'admin')
+    if not allowed or export['status'] != 'done' or not os.path.exists(export['file_path']):
+        flash('That export is not available.', 'warning')
+        return redirect(url_for('exports'))
+    return send_file(export['file_path'], mimetype='application/zip', as_attachment=True,
+                     download_name=f"case_export_{export_id}.zip", conditional=True)
+
+@app.route('/case/<int:case_id>/urgent', methods=['POST'])
+@login_required
+@role_required('admin')
+def flag_case(case_id):
+    """Flag a case urgent (or clear the flag); its queued jobs move to the matching tier at once."""
+    urgent = request.form.get('urgent') == '1'
+    cur = get_cursor()
+    cur.execute("UPDATE cases SET is_urgent = %s WHERE id = %s", (urgent, case_id))
+    # Imported jobs stay bulk unless flagged; admins' own requests stay urgent either way
+    cur.execute(
+        """
+        UPDATE generation_jobs j JOIN users u ON u.id = j.user_id
+        SET j.priority = CASE
+            WHEN %s THEN %s
+            WHEN j.import_id IS NOT NULL THEN %s
+            WHEN u.role = 'admin' THEN %s
+            ELSE %s
+        END
+        WHERE j.case_id = %s AND j.status = 'queued'
+        """,
+        (urgent, PRIORITY_URGENT, PRIORITY_BULK, PRIORITY_URGENT, PRIORITY_ROUTINE, case_id)
+    )
+    cur.execute("SELECT id, priority FROM generation_jobs WHERE case_id = %s AND status = 'queued'", (case_id,))
+    priorities = {row['id']: row['priority'] for row in cur.fetchall()}
+    get_db().commit()
+    cur.close()
+    READ_CACHE.invalidate('case', case_id)
+    for job_id, priority in priorities.items():
+        generation_queue.reprioritize(lambda job: getattr(job, 'job_id', None) == job_id, priority)
+    flash('Case flagged urgent.' if urgent else 'Urgent flag cleared.', 'info')
+    return redirect(url_for('view_case', case_id=case_id))
+
+def queue_composite_job(cur, case_id, prompt, mode, seeds, profile=None, deadline=None):
+    """
+    Record a composite job durably (one candidate per seed), then hand it to the background
+    generation worker. Returns None, or the message to show if the queue is full.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    filename = f"sketch_{case_id}_{timestamp}.png"
+    save_paths = staging_paths(filename, len(seeds))
+    priority = job_priority(cur, case_id)
+
+    cur.execute(
+        """
+        INSERT INTO generation_jobs (case_id, user_id, description, prompt, image_path, mode, seeds, priority, deadline)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        (case_id, session['user_id'], prompt, prompt, filename, mode, json.dumps(seeds), priority, deadline)
+    )
+    get_db().commit()
+    job_id = cur.lastrowid
+    try:
+        generation_queue.submit(
+            SketchJob(job_id, prompt, save_paths, case_id, session['user_id'], prompt, mode=mode, seeds=seeds,
+                      profile=profile, priority=priority, deadline=deadline_timestamp(deadline))
+        )
+    except QueueFull as e:
+        cur.execute(
+            "UPDATE generation_jobs SET status = 'failed', error_text = %s, finished_at = NOW() WHERE id = %s",
+            (str(e), job_id)
+        )
+        get_db().commit()
+        return str(e)
+    return None
+
 @app.route('/create-composite/<int:case_id>', methods=['GET', 'POST'])
 @login_required
 def create_composite(case_id):
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM cases WHERE id = %s", (case_id,))
-    case = cur.fetchone()
+    case = cached_case(case_id)
     if not case:
-        cur.close()
         flash('Case not found.', 'danger')
         return redirect(url_for('index'))
+    cur = get_cursor()
 
     if request.method == 'POST':
         description = request.form.get('description', '').strip()
@@ -319,57 +1157,46 @@ def create_composite(case_id):
             cur.close()
             return redirect(url_for('create_composite', case_id=case_id))
 
-        full_prompt = (
-            f"Police sketch of a criminal with features: {description}. "
-            "Forensic sketch, black and white, front view, clean lines, high detail."
-        )
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"sketch_{case_id}_{timestamp}.png"
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        full_prompt = composite_prompt(description)
 
-        # Launch background thread for image generation
-        SketchGenerator(full_prompt, save_path, case_id, session['user_id'], full_prompt).start()
+        mode = resolve_mode(request.form.get('mode'))
+        candidates = min(max(request.form.get('candidates', 1, type=int), 1), Config.GENERATION_MAX_CANDIDATES)
 
-        flash("Sketch generation started. Please check back soon.", 'info')
+        error = queue_composite_job(cur, case_id, full_prompt, mode, candidate_seeds(full_prompt, candidates),
+                                    profile=generation_profile(), deadline=requested_deadline())
         cur.close()
+        if error:
+            flash(error, 'warning')
+            return redirect(url_for('create_composite', case_id=case_id))
+
+        flash("Sketch generation queued. It will appear below when ready.", 'info')
         return redirect(url_for('view_case', case_id=case_id))
 
     cur.close()
-    return render_template('create_composite.html', case=case)
+    return render_template('create_composite.html', case=case, modes=GENERATION_MODES, default_mode=DEFAULT_MODE,
+                           max_candidates=Config.GENERATION_MAX_CANDIDATES)
 
 @app.route('/composite/<int:composite_id>', methods=['GET', 'POST'])
 @login_required
 def view_composite(composite_id):
-    cur = mysql.connection.cursor()
-    # Fetch composite + user info
-    cur.execute("""
-        SELECT co.*, u.full_name, u.badge_number
-        FROM composites co JOIN users u ON co.user_id = u.id
-        WHERE co.id = %s
-    """, (composite_id,))
-    composite = cur.fetchone()
-
+    # Composite + user info
+    composite = cached_composite(composite_id)
     if not composite:
-        cur.close()
         flash('Composite not found.', 'danger')
         return redirect(url_for('index'))
 
-    # Fetch revisions + requester info (assuming revisions has user_id column)
-    cur.execute("""
-        SELECT r.*, u.full_name
-        FROM revisions r LEFT JOIN users u ON r.user_id = u.id
-        WHERE r.composite_id = %s
-        ORDER BY r.created_at DESC
-    """, (composite_id,))
-    revisions = cur.fetchall()
+    # Revisions + requester info
+    revisions = cached_revisions(composite_id)
+    cur = get_cursor()
 
     # Handle POST form submissions
     if request.method == 'POST':
         if 'accurate' in request.form:
             try:
                 cur.execute("UPDATE composites SET is_accurate = 1 WHERE id = %s", (composite_id,))
-                mysql.connection.commit()
+                get_db().commit()
+                READ_CACHE.invalidate('composite', composite_id)
+                READ_CACHE.invalidate('case_composites', composite['case_id'])
                 flash('Composite marked as accurate.', 'success')
             except Exception as e:
                 flash(f'Error updating composite: {e}', 'danger')
@@ -381,15 +1208,600 @@ def view_composite(composite_id):
                 flash('Adjustment details are required.', 'danger')
                 return redirect(url_for('view_composite', composite_id=composite_id))
 
-            # Here you would start a background process to generate the revised sketch,
-            # then insert a revision row after generation.
-            # This is a placeholder for your implementation.
+            # Revise the parent image with img2img instead of rendering from scratch
+            parent = json.loads(composite['generation_params']) if composite.get('generation_params') else {}
+            mode = resolve_mode(request.form.get('mode') or parent.get('mode'))
+            prompt = revision_prompt(composite['description'], adjustment_text)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            filename = f"revision_{composite_id}_{timestamp}.png"
+            save_path = staging_paths(filename, 1)[0]
+            parent_path = local_image_path(composite['image_path'])
+            seed = default_seed(prompt)
+            priority = job_priority(cur, composite['case_id'])
 
-            flash('Revision request submitted, sketch generation should start shortly.', 'info')
+            cur.execute(
+                """
+                INSERT INTO generation_jobs
+                    (kind, case_id, user_id, parent_composite_id, adjustment_text, description, prompt, image_path,
+                     mode, seeds, priority)
+                VALUES ('revision', %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (composite['case_id'], session['user_id'], composite_id, adjustment_text, prompt, prompt, filename,
+                 mode, json.dumps([seed]), priority)
+            )
+            get_db().commit()
+            job_id = cur.lastrowid
+            try:
+                generation_queue.submit(RevisionJob(job_id, prompt, save_path, parent_path, composite_id,
+                                                    session['user_id'], adjustment_text, mode=mode, seed=seed,
+                                                    priority=priority))
+            except QueueFull as e:
+                cur.execute(
+                    "UPDATE generation_jobs SET status = 'failed', error_text = %s, finished_at = NOW() WHERE id = %s",
+                    (str(e), job_id)
+                )
+                get_db().commit()
+                flash(str(e), 'warning')
+                cur.close()
+                return redirect(url_for('view_composite', composite_id=composite_id))
+
+            flash('Revision request queued. It will appear below when ready.', 'info')
+            cur.close()
             return redirect(url_for('view_composite', composite_id=composite_id))
 
+        elif 'regenerate' in request.form:
+            # Re-render from the stored prompt, seed and mode; the result is the same sketch
+            params = json.loads(composite['generation_params']) if composite.get('generation_params') else {}
+            seed = composite['seed'] if composite.get('seed') is not None else params.get('seed')
+            if seed is None:
+                seed = default_seed(composite['description'])
+            error = queue_composite_job(cur, composite['case_id'], composite['description'],
+                                        resolve_mode(params.get('mode')), [seed])
+            cur.close()
+            if error:
+                flash(error, 'warning')
+                return redirect(url_for('view_composite', composite_id=composite_id))
+            flash(f'Regeneration from seed {seed} queued. It will appear on the case page when ready.', 'info')
+            return redirect(url_for('view_case', case_id=composite['case_id']))
+
+        elif 'finalize' in request.form:
+            # Re-render a draft at full size and quality from its seed: the draft started from a
+            # downsampled copy of the same noise, so the composition carries over
+            params = json.loads(composite['generation_params']) if composite.get('generation_params') else {}
+            seed = composite['seed'] if composite.get('seed') is not None else params.get('seed')
+            if seed is None:
+                seed = default_seed(composite['description'])
+            error = queue_composite_job(cur, composite['case_id'], composite['description'], FINAL_MODE, [seed])
+            cur.close()
+            if error:
+                flash(error, 'warning')
+                return redirect(url_for('view_composite', composite_id=composite_id))
+            flash(f'Final render from seed {seed} queued. It will appear on the case page when ready.', 'info')
+            return redirect(url_for('view_case', case_id=composite['case_id']))
+
+    # Revisions still being generated are shown as placeholders that poll for completion
+    cur.execute("""
+        SELECT id, status, created_at
+        FROM generation_jobs
+        WHERE parent_composite_id = %s AND status IN ('queued', 'running')
+        ORDER BY id
+    """, (composite_id,))
+    pending_jobs = cur.fetchall()
+
+    # Other candidates rendered by the same request
+    candidates = []
+    if composite.get('job_id'):
+        cur.execute("""
+            SELECT id, image_path, seed
+            FROM composites
+            WHERE job_id = %s AND id <> %s
+            ORDER BY id
+        """, (composite['job_id'], composite_id))
+        candidates = cur.fetchall()
+
+    # Look-alike composites on file in other cases
+    similar = similar_composites(cur, composite, Config.SIMILAR_COMPOSITES)
+
+    cur.close()
+    generation = json.loads(composite['generation_params']) if composite.get('generation_params') else None
+    return render_template('composite.html', composite=composite, revisions=revisions, generation=generation,
+                           pending_jobs=pending_jobs, candidates=candidates, similar=similar,
+                           final_mode=GENERATION_MODES[FINAL_MODE])
+
+@app.route('/composite/<int:composite_id>/similar')
+@login_required
+def similar_composites_json(composite_id):
+    """JSON top-K look-alikes of a composite: ?k= (default SIMILAR_COMPOSITES, at most 100), ?same_case=1."""
+    k = min(max(request.args.get('k', Config.SIMILAR_COMPOSITES, type=int), 1), 100)
+    cur = get_cursor()
+    cur.execute("SELECT id, case_id, image_path FROM composites WHERE id = %s", (composite_id,))
+    composite = cur.fetchone()
+    if not composite:
+        cur.close()
+        return jsonify({'error': 'Composite not found.'}), 404
+    similar = similar_composites(cur, composite, k, same_case=request.args.get('same_case') == '1')
+    cur.close()
+    return jsonify({
+        'composite_id': composite_id,
+        'similar': [
+            {
+                'composite_id': row['id'],
+                'case_id': row['case_id'],
+                'case_number': row['case_number'],
+                'similarity': row['similarity'],
+                'hash_distance': row['hash_distance'],
+                'composite_url': url_for('view_composite', composite_id=row['id']),
+                'thumbnail_url': thumbnail_url(row['image_path']),
+            }
+            for row in similar
+        ],
+    })
+
+def fetch_job(job_id):
+    cur = get_cursor()
+    cur.execute("""
+        SELECT j.id, j.kind, j.case_id, j.user_id, j.status, j.composite_id, j.parent_composite_id, j.prompt, j.seeds,
+               j.priority, j.deadline, j.error_text, j.created_at, j.started_at, j.finished_at,
+               COALESCE(r.revised_image_path, c.image_path) AS result_path
+        FROM generation_jobs j
+        LEFT JOIN composites c ON c.id = j.composite_id
+        LEFT JOIN revisions r ON r.id = j.revision_id
+        WHERE j.id = %s
+    """, (job_id,))
+    job = cur.fetchone()
+    cur.close()
+    # Hand the connection back while waiting; the next poll takes a fresh snapshot
+    close_db()
+    return job
+
+def job_visible(job):
+    """Whether the signed-in user may watch or cancel `job`: its owner or an admin."""
+    return job and (job['user_id'] == session['user_id'] or session.get('role') == 'admin')
+
+def job_payload(job):
+    payload = {
+        'id': job['id'],
+        'kind': job['kind'],
+        'case_id': job['case_id'],
+        'status': job['status'],
+        'error': job['error_text'],
+        'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+        'started_at': job['started_at'].isoformat() if job['started_at'] else None,
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None,
+        'seeds': job_seeds(job),
+        'priority': job['priority'],
+        'deadline': job['deadline'].isoformat() if job['deadline'] else None,
+    }
+    payload['candidates'] = len(payload['seeds'])
+    if job['status'] == 'queued':
+        # Place in the scheduler's current order and when a worker should get to it
+        estimate = generation_queue.estimate(lambda queued: getattr(queued, 'job_id', None) == job['id'])
+        if estimate:
+            position, start = estimate
+            payload['queue_position'] = position
+            payload['estimated_start'] = datetime.fromtimestamp(start).isoformat() if start else None
+            payload['estimated_wait'] = round(max(0, start - time.time())) if start else None
+    if job['status'] == 'done':
+        composite_id = job['parent_composite_id'] if job['kind'] == 'revision' else job['composite_id']
+        payload['composite_id'] = composite_id
+        payload['image_url'] = image_url(job['result_path'])
+        payload['thumbnail_url'] = thumbnail_url(job['result_path'])
+        payload['composite_url'] = url_for('view_composite', composite_id=composite_id)
+    return payload
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/job/<int:job_id>/status')
+@login_required
+def job_status(job_id):
+    """JSON job status; with ?wait=N, long-polls up to N seconds for the job to finish."""
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 30)
+    deadline = time.time() + wait
+    while True:
+        job = fetch_job(job_id)
+        # Other users' jobs look missing, so ids can't be probed
+        if not job_visible(job):
+            return jsonify({'error': 'Job not found.'}), 404
+
+        remaining = deadline - time.time()
+        if job['status'] in JOB_FINISHED or remaining <= 0:
+            break
+        with job_status_changed:
+            job_status_changed.wait(timeout=remaining)
+    return jsonify(job_payload(job))
+
+@app.route('/job/<int:job_id>/events')
+@login_required
+def job_events(job_id):
+    """
+    Server-sent events for one job: `status` (the job_status payload) whenever its status
+    changes, ending with the final one, and `preview` (step, steps, image data URL) with a
+    low-resolution look at the sketch every few denoising steps while it renders.
+    """
+    job = fetch_job(job_id)
+    if not job_visible(job):
+        return jsonify({'error': 'Job not found.'}), 404
+
+    def stream():
+        current, status, sent = job, None, None
+        while True:
+            if current['status'] != status:
+                status = current['status']
+                yield sse_event('status', job_payload(current))
+                if status in JOB_FINISHED:
+                    return
+            with job_status_changed:
+                woken = job_previews.get(job_id) is not sent or job_status_changed.wait(timeout=SSE_KEEPALIVE)
+                preview = job_previews.get(job_id)
+            if preview is not None and preview is not sent:
+                sent = preview
+                yield sse_event('preview', preview)
+            elif not woken:
+                yield ": keep-alive\n\n"
+            current = fetch_job(job_id) or dict(current, status='failed', error_text='Job not found.')
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold events back
+    return response
+
+@app.route('/job/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """
+    Cancel a queued or running job; a running batch stops at its next denoising step.
+    Only the job's owner or an admin may cancel it.
+    """
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+    if not job_visible(fetch_job(job_id)):
+        if wants_json:
+            return jsonify({'error': 'Job not found.'}), 404
+        flash('Permission denied.', 'danger')
+        return redirect(url_for('index'))
+
+    cur = get_cursor()
+    cur.execute(
+        """
+        UPDATE generation_jobs SET status = 'cancelled', error_text = %s, finished_at = NOW()
+        WHERE id = %s AND status IN ('queued', 'running')
+        """,
+        (f"Cancelled by {session.get('full_name') or session.get('username')}.", job_id)
+    )
+    cancelled = cur.rowcount > 0
+    get_db().commit()
     cur.close()
-    return render_template('composite.html', composite=composite, revisions=revisions)
+    if cancelled:
+        generation_queue.cancel(lambda job: getattr(job, 'job_id', None) == job_id)
+        notify_job_status()
+
+    if wants_json:
+        job = fetch_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found.'}), 404
+        return jsonify(job_payload(job))
+    if cancelled:
+        flash('Sketch generation cancelled.', 'info')
+    else:
+        flash('That job has already finished.', 'warning')
+    return redirect(request.referrer or url_for('index'))
+
+@app.route('/image/<path:key>')
+def stored_image(key):
+    """
+    A sketch from the image store. Keys never change content, so responses are cacheable
+    forever; conditional (ETag / If-Modified-Since) and range requests are answered without
+    reading more of the image than they need, from local disk or the object store alike.
+    """
+    if not is_valid_key(key):
+        abort(404)
+    path = IMAGE_STORE.local_path(key)
+    if path is not None:
+        if not os.path.isfile(path):
+            abort(404)
+        response = send_file(path, mimetype=IMAGE_MIMETYPE, etag=key_etag(key) or derivative_etag(path),
+                             conditional=True, max_age=THUMBNAIL_MAX_AGE)
+    else:
+        try:
+            size, modified = IMAGE_STORE.stat(key)
+        except FileNotFoundError:
+            abort(404)
+        response = Response(wrap_file(request.environ, IMAGE_STORE.open(key, size)), mimetype=IMAGE_MIMETYPE,
+                            direct_passthrough=True)
+        response.content_length = size
+        response.last_modified = modified
+        response.set_etag(key_etag(key) or f"{key}-{size}")
+        response.cache_control.max_age = THUMBNAIL_MAX_AGE
+        response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/thumb/<int:size>/<path:key>')
+def thumbnail(size, key):
+    """
+    Downscaled copy of a stored sketch (WebP when the browser accepts it), cacheable forever
+    like the image itself; thumbnails missing for older images are rendered on the first request.
+    """
+    if size not in Config.THUMBNAIL_SIZES or not is_valid_key(key):
+        abort(404)
+    fmt = pick_format(request.accept_mimetypes)
+    path = ensure_derivative(IMAGE_STORE, key, size, fmt)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=MIMETYPES[fmt], etag=derivative_etag(path),
+                         conditional=True, max_age=THUMBNAIL_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
+@app.cli.command('backfill-thumbnails')
+@click.option('--force', is_flag=True, help='Re-render thumbnails that already exist.')
+@click.option('--workers', default=0, help='Images processed in parallel (0 = one per core).')
+def backfill_thumbnails(force, workers):
+    """Write missing thumbnails for every sketch already in the image store."""
+    start = time.time()
+    images, written = backfill(IMAGE_STORE, force=force, workers=workers)
+    print(f"[INFO] Wrote {written} thumbnail(s) for {images} image(s) in {time.time() - start:.1f}s")
+
+@app.cli.command('backfill-similarity')
+@click.option('--workers', default=0, help='Images processed in parallel (0 = one per core).')
+@click.option('--rebuild', is_flag=True, help='Start from an empty index instead of adding what is missing.')
+def backfill_similarity(workers, rebuild):
+    """Compute the perceptual hash and embedding of every composite missing from the similarity index."""
+    if rebuild and os.path.exists(Config.SIMILARITY_INDEX_PATH):
+        os.remove(Config.SIMILARITY_INDEX_PATH)
+    start = time.time()
+    rows = unindexed_composites()
+    print(f"[INFO] {len(rows)} composite(s) to index ({len(default_index())} already indexed).")
+    indexed = index_composites(rows, workers=workers or os.cpu_count() or 1)
+    default_index().save(Config.SIMILARITY_INDEX_PATH)
+    print(f"[INFO] Indexed {indexed} composite(s) in {time.time() - start:.1f}s; "
+          f"{len(default_index())} in {Config.SIMILARITY_INDEX_PATH}")
+
+def move_thumbnails(old_key, new_key):
+    """Reuse an image's existing thumbnails under its new key instead of rendering them again."""
+    for size in Config.THUMBNAIL_SIZES:
+        for fmt in FORMATS:
+            old_path, new_path = derivative_path(old_key, size, fmt), derivative_path(new_key, size, fmt)
+            if not os.path.exists(old_path):
+                continue
+            if os.path.exists(new_path):
+                os.remove(old_path)
+            else:
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.replace(old_path, new_path)
+
+@app.cli.command('migrate-images')
+@click.option('--source', default=Config.UPLOAD_FOLDER, type=click.Path(file_okay=False),
+              help='Flat folder the images were saved in (default: UPLOAD_FOLDER).')
+@click.option('--chunk-size', default=500, help='Images whose rows are updated per transaction.')
+@click.option('--keep', is_flag=True, help='Leave the flat files in place once they are in the store.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be migrated.')
+def migrate_images(source, chunk_size, keep, dry_run):
+    """
+    Move sketches saved under flat names (before the image store) into the store and point
+    composites and revisions at their content keys. Identical images end up stored once.
+    Each chunk's rows are committed before its flat files are removed, so the command can be
+    interrupted and run again: rows already migrated are skipped.
+    """
+    with db_session() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, image_path FROM composites")
+        composites = [(row_id, name) for row_id, name in cur.fetchall() if not is_sharded(name)]
+        cur.execute("SELECT id, revised_image_path FROM revisions")
+        revisions = [(row_id, name) for row_id, name in cur.fetchall() if not is_sharded(name)]
+    rows = {}
+    for table, (row_id, name) in [('composites', row) for row in composites] + [('revisions', row) for row in revisions]:
+        rows.setdefault(name, []).append((table, row_id))
+    names = sorted(rows)
+    print(f"[INFO] {len(names)} image(s) in {len(composites)} composite(s) and {len(revisions)} revision(s) "
+          f"to migrate from {source}.")
+    if dry_run:
+        missing = [name for name in names if not os.path.isfile(os.path.join(source, name))]
+        print(f"[INFO] {len(names) - len(missing)} would be migrated, {len(missing)} file(s) missing.")
+        return
+
+    start = time.time()
+    migrated, missing, keys = 0, 0, set()
+    for offset in range(0, len(names), max(1, chunk_size)):
+        chunk, updates, done = names[offset:offset + chunk_size], {'composites': [], 'revisions': []}, []
+        for name in chunk:
+            path = os.path.join(source, name)
+            if not os.path.isfile(path):
+                missing += 1
+                print(f"[WARN] {path} is missing; its rows keep the old name.")
+                continue
+            key = IMAGE_STORE.put(path)
+            keys.add(key)
+            move_thumbnails(name, key)
+            for table, row_id in rows[name]:
+                updates[table].append((key, row_id))
+            done.append(path)
+        with db_session() as conn:
+            cur = conn.cursor()
+            cur.executemany("UPDATE composites SET image_path = %s WHERE id = %s", updates['composites'])
+            cur.executemany("UPDATE revisions SET revised_image_path = %s WHERE id = %s", updates['revisions'])
+        # Every cached composite and revision list may hold old image names
+        READ_CACHE.clear()
+        if not keep:
+            for path in done:
+                os.remove(path)
+        migrated += len(done)
+        print(f"[INFO] {migrated + missing}/{len(names)} image(s) processed ({time.time() - start:.1f}s)")
+    print(f"[INFO] Migrated {migrated} image(s) into {len(keys)} stored file(s); {missing} missing.")
+
+def import_records(path, batch, chunk_size):
+    """Stream the file into the import's cases and jobs, one transaction per chunk, from its checkpoint."""
+    size = os.path.getsize(path)
+    start = time.time()
+    totals = {'records': 0, 'created': 0, 'skipped': 0, 'rejected': 0, 'jobs': 0}
+    records, rejected, offset = [], 0, batch['byte_offset']
+
+    def flush(end_offset):
+        with db_session() as conn:
+            created, skipped, jobs = import_chunk(conn.cursor(dictionary=True), batch, records, end_offset, rejected)
+        if created:
+            READ_CACHE.invalidate('recent_cases', 'all', batch['user_id'])
+        for key, value in (('records', len(records) + rejected), ('created', created), ('skipped', skipped),
+                           ('rejected', rejected), ('jobs', jobs)):
+            totals[key] += value
+        elapsed = max(time.time() - start, 1e-6)
+        print(f"[INFO] {totals['records']} record(s): {totals['created']} case(s) created, {totals['skipped']} "
+              f"already present, {totals['rejected']} rejected, {totals['jobs']} composite(s) queued "
+              f"({totals['records'] / elapsed:.0f} records/s, {end_offset * 100 // max(size, 1)}% of file)")
+
+    for record, offset in read_records(path, offset):
+        try:
+            records.append(parse_record(record))
+        except ValueError as e:
+            rejected += 1
+            print(f"[WARN] Rejected the record ending at byte {offset}: {e}")
+        if len(records) + rejected >= chunk_size:
+            flush(offset)
+            records, rejected = [], 0
+    if records or rejected:
+        flush(offset)
+
+    with db_session() as conn:
+        conn.cursor().execute("UPDATE imports SET status = 'imported' WHERE id = %s", (batch['id'],))
+    return totals
+
+def generate_import(batch, report_every):
+    """Render the import's queued composites in this process, printing progress and throughput."""
+    with db_session() as conn:
+        cur = conn.cursor(dictionary=True)
+        if not claim_import(cur, batch['id'], 'cli', takeover=True):
+            print(f"[INFO] Import {batch['id']} is already being rendered by the web server.")
+            return
+        rows = queued_jobs(cur, batch['id'])
+    total = len(rows)
+    if total:
+        print(f"[INFO] Rendering {total} composite(s) in mode '{batch['mode']}'.")
+    before = generation_queue.stats()
+
+    def finished():
+        stats = generation_queue.stats()
+        return sum(stats[key] - before[key] for key in ('completed', 'failed', 'cancelled'))
+
+    start = time.time()
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(report_every):
+            done = finished()
+            per_minute = done / (time.time() - start) * 60
+            eta = f", about {(total - done) / per_minute:.0f} min left" if per_minute else ""
+            print(f"[INFO] {done}/{total} composite(s) rendered ({per_minute:.1f}/min{eta})")
+
+    threading.Thread(target=report, name="import-progress", daemon=True).start()
+    queue_import_jobs(rows)
+    while finished() < total:
+        time.sleep(0.5)
+    stop.set()
+
+    with db_session() as conn:
+        finish_imports(conn.cursor())
+    stats = generation_queue.stats()
+    print(f"[INFO] Rendered {stats['completed'] - before['completed']} composite(s) "
+          f"({stats['failed'] - before['failed']} failed) in {time.time() - start:.1f}s")
+
+@app.cli.command('import-cases')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', default='admin', help='Account the cases and composites are recorded under.')
+@click.option('--mode', default=None, help='Generation mode for the composites (default: GENERATION_MODE).')
+@click.option('--candidates', default=1, help='Candidates rendered per suspect description.')
+@click.option('--chunk-size', default=Config.IMPORT_CHUNK_SIZE, help='Records inserted per transaction.')
+@click.option('--generate/--no-generate', default=True,
+              help='Render the composites in this process (default), or leave them to the running web server.')
+@click.option('--restart', is_flag=True, help='Start over instead of resuming an unfinished import of this file.')
+@click.option('--report-every', default=30.0, help='Seconds between generation progress lines.')
+def import_cases(path, username, mode, candidates, chunk_size, generate, restart, report_every):
+    """
+    Bulk-import cases from a CSV or JSONL file and queue a composite per suspect description.
+
+    Columns/keys: case_number, description, location, incident_date (YYYY-MM-DD) and
+    suspect_description (or, in JSONL, a suspect_descriptions list). Cases whose number
+    already exists are skipped. Progress is checkpointed per chunk, so running the same
+    command again resumes an interrupted import.
+    """
+    source = source_key(path)
+    with db_session() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
+        user = cur.fetchone()
+        if not user:
+            raise click.ClickException(f"No user named '{username}'.")
+        batch = None if restart else find_import(cur, source)
+        if batch:
+            print(f"[INFO] Resuming import {batch['id']} of {source} at byte {batch['byte_offset']} "
+                  f"({batch['rows_read']} record(s) already read, status {batch['status']}).")
+        else:
+            candidates = min(max(candidates, 1), Config.GENERATION_MAX_CANDIDATES)
+            batch = start_import(cur, source, user['id'], resolve_mode(mode), candidates)
+            print(f"[INFO] Started import {batch['id']} of {source}.")
+
+    if batch['status'] == 'importing':
+        start = time.time()
+        totals = import_records(path, batch, max(1, chunk_size))
+        print(f"[INFO] Import {batch['id']}: {totals['records']} record(s) in {time.time() - start:.1f}s.")
+    if generate:
+        generate_import(batch, report_every)
+    elif batch['status'] != 'generating':
+        print(f"[INFO] Composites of import {batch['id']} are left for the web server, which picks "
+              f"imports up every {Config.IMPORT_POLL_SECONDS}s.")
+
+@app.route('/ready')
+def ready():
+    """Readiness probe. The web tier is ready once imported; ?require=model also waits for the model."""
+    state = generation_model_state()
+    payload = {'web': 'ready', 'model': state, 'queue_depth': generation_queue.stats()['queue_depth']}
+    if request.args.get('require') == 'model' and state['state'] != 'ready':
+        return jsonify(payload), 503
+    return jsonify(payload)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: stage/request latency histograms plus queue and cache gauges."""
+    queue_stats = generation_queue.stats()
+    cache_stats = RESULT_CACHE.stats()
+    read_stats = READ_CACHE.stats()
+    gauges = {
+        'sketch_queue_depth': ('Generation jobs waiting for a worker.', queue_stats['queue_depth']),
+        'sketch_queue_capacity': ('Generation queue capacity.', queue_stats['queue_capacity']),
+        'sketch_jobs_completed': ('Generation jobs completed since start.', queue_stats['completed']),
+        'sketch_jobs_failed': ('Generation jobs failed since start.', queue_stats['failed']),
+        'sketch_jobs_cancelled': ('Generation jobs cancelled since start.', queue_stats['cancelled']),
+        'sketch_batch_size_avg': ('Average images per pipeline call.', queue_stats['avg_batch_size']),
+        'sketch_result_cache_bytes': ('Bytes held by the result cache.', cache_stats['bytes']),
+        'sketch_result_cache_hit_ratio': ('Result cache hit ratio.', cache_stats['hit_rate']),
+        'sketch_read_cache_entries': ('Entries held by the read-model cache.', read_stats['entries']),
+        'sketch_read_cache_hit_ratio': ('Read-model cache hit ratio.', read_stats['hit_rate']),
+    }
+    for namespace, counts in read_stats['namespaces'].items():
+        gauges[f'sketch_read_cache_{namespace}_hit_ratio'] = (f'Read-model cache hit ratio for {namespace}.',
+                                                              counts['hit_rate'])
+    memory = generation_model_state().get('memory') or {}
+    if memory:
+        gauges['sketch_memory_rss_megabytes'] = ('Resident memory of the web process.', memory['rss_mb'])
+        gauges['sketch_memory_pss_megabytes'] = ('Web process memory with shared pages split among their users.',
+                                                 memory['pss_mb'])
+    if 'workers_pss_mb' in memory:
+        gauges['sketch_workers_rss_megabytes'] = ('Resident memory of all generation workers.',
+                                                  memory['workers_rss_mb'])
+        gauges['sketch_workers_pss_megabytes'] = ('Generation worker memory with shared pages split among their users.',
+                                                  memory['workers_pss_mb'])
+    return Response(render_metrics(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/generation/stats')
+@login_required
+def generation_stats():
+    stats = generation_queue.stats()
+    stats['result_cache'] = RESULT_CACHE.stats()
+    stats['embedding_cache'] = embedding_cache_stats()
+    stats['read_cache'] = READ_CACHE.stats()
+    return jsonify(stats)
 
 if __name__ == '__main__':
     app.run(debug=True, threaded=True)
@@ -0,0 +1,73 @@
+"""
+Pixel-equivalence check and micro-benchmark for the sketch post-processor.
+
+Run from the project directory:  python -m benchmarks.bench_sketch [--batch 4] [--size 512]
+Exits non-zero if the vectorized path differs from convert_to_sketch on any pixel.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_generator import convert_to_sketch, convert_to_sketch_batch
+
+
+def sample_images(count, size, seed=0):
+    """Saved sketches from static/generated plus smooth random images, all size x size RGB."""
+    images = []
+    for path in sorted(glob.glob(os.path.join('static', 'generated', '*.png')))[:count // 2]:
+        images.append(Image.open(path).convert("RGB").resize((size, size)))
+    rng = np.random.default_rng(seed)
+    while len(images) < count:
+        noise = rng.integers(0, 256, (size // 8, size // 8, 3), dtype=np.uint8)
+        images.append(Image.fromarray(noise).resize((size, size), Image.BICUBIC))
+    return images
+
+
+def check_equivalence(images, threshold):
+    fast = convert_to_sketch_batch(images, threshold=threshold)
+    for i, (image, sketch) in enumerate(zip(images, fast)):
+        reference = np.asarray(convert_to_sketch(image, threshold=threshold).convert("L"))
+        mismatched = int((reference != np.asarray(sketch)).sum())
+        if mismatched:
+            print(f"[FAIL] image {i}: {mismatched} pixel(s) differ at threshold {threshold}")
+            return False
+    return True
+
+
+def best_of(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threshold', type=int, default=185)
+    args = parser.parse_args()
+
+    images = sample_images(args.batch, args.size)
+    for threshold in (100, args.threshold, 250):
+        if not check_equivalence(images, threshold):
+            sys.exit(1)
+    print(f"[BENCH] Pixel-equivalent on {len(images)} image(s) at {args.size}x{args.size}")
+
+    pil = best_of(lambda: [convert_to_sketch(image, args.threshold) for image in images], args.repeats)
+    fast = best_of(lambda: convert_to_sketch_batch(images, args.threshold), args.repeats)
+    print(f"[BENCH] convert_to_sketch (PIL):      {pil / len(images) * 1000:.2f} ms/image")
+    print(f"[BENCH] convert_to_sketch_batch:      {fast / len(images) * 1000:.2f} ms/image")
+    print(f"[BENCH] speedup: {pil / fast:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Web-tier startup benchmark: time a cold `import app` in fresh interpreters.
+
+Run from the project directory:  python -m benchmarks.bench_startup [--runs 5] [--max-seconds 1.0]
+Exits non-zero if the median import time exceeds --max-seconds or if importing the
+app pulled in torch/diffusers (which must stay lazy).
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = time.perf_counter() - start\n"
+    "heavy = sorted(m for m in ('torch', 'diffusers', 'transformers') if m in sys.modules)\n"
+    "print(json.dumps({'seconds': elapsed, 'heavy_modules': heavy}))\n"
+)
+
+
+def measure_once():
+    result = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    seconds = [sample['seconds'] for sample in samples]
+    heavy = sorted({name for sample in samples for name in sample['heavy_modules']})
+    median = statistics.median(seconds)
+    print(f"[BENCH] import app: median {median * 1000:.0f} ms, min {min(seconds) * 1000:.0f} ms, "
+          f"max {max(seconds) * 1000:.0f} ms over {args.runs} run(s)")
+
+    failed = False
+    if heavy:
+        print(f"[FAIL] import app loaded {', '.join(heavy)}; model imports must stay lazy")
+        failed = True
+    if median > args.max_seconds:
+        print(f"[FAIL] median import time exceeds {args.max_seconds:.2f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Benchmark suite on the stub pipeline, emitted as one JSON document for comparing commits.
+
+Run from the project directory:
+    python -m benchmarks.bench_suite [--output results.json] [--compare baseline.json]
+
+Generation runs on stub_pipeline (SKETCH_PIPELINE=stub), so no model is downloaded and
+results measure this project's own overhead. The create_composite and DB query sections
+need MySQL (MYSQL_* settings); they use a separate --database, created and seeded on first
+run, and are reported as skipped when MySQL cannot be reached.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import Config
+
+WORDS = (
+    "male female tall short stocky thin bald bearded scar tattoo glasses hoodie jacket cap "
+    "oval square round face nose lips eyes eyebrows jaw chin cheek mole freckles earring"
+).split()
+LOCATIONS = ("Main St", "Harbour Rd", "Central Station", "Park Ave", "Market Square", "Riverside")
+BENCH_USER = 'bench_officer'
+
+
+def summarize(seconds):
+    ordered = sorted(seconds)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def stage_means():
+    """Mean milliseconds per generation stage since the last call (resets the histogram)."""
+    from metrics import GENERATION_STAGE_SECONDS
+    totals = {}
+    for (stage, _mode), row in GENERATION_STAGE_SECONDS.take().items():
+        count, total = totals.get(stage, (0, 0.0))
+        totals[stage] = (count + sum(row[:-1]), total + row[-1])
+    return {stage: round(total / count * 1000, 3) for stage, (count, total) in sorted(totals.items()) if count}
+
+
+def bench_generation(runs, mode):
+    """generate_sketch_image end to end, one unique prompt per run (no result-cache hits)."""
+    from image_generator import GENERATION_MODES, generate_sketch_image, load_model
+
+    load_model(mode)
+    stage_means()
+    latencies = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for i in range(runs):
+            prompt = f"male, late 40s, oval face, hooked nose, thin lips, bench {i} {time.time()}"
+            start = time.perf_counter()
+            if not generate_sketch_image(prompt, os.path.join(out_dir, f"g{i}.png"), mode=mode):
+                raise RuntimeError("stub generation failed")
+            latencies.append(time.perf_counter() - start)
+    return dict(summarize(latencies), mode=mode, steps=GENERATION_MODES[mode]['steps'], stages_mean_ms=stage_means())
+
+
+def bench_sketch_filter(batch, size, repeats):
+    """convert_to_sketch (PIL, one image) against convert_to_sketch_batch, per image."""
+    from benchmarks.bench_sketch import best_of, sample_images
+    from image_generator import convert_to_sketch, convert_to_sketch_batch
+
+    images = sample_images(batch, size)
+    pil = best_of(lambda: [convert_to_sketch(image) for image in images], repeats) / len(images)
+    fast = best_of(lambda: convert_to_sketch_batch(images), repeats) / len(images)
+    return {
+        'images': len(images),
+        'size': size,
+        'pil_ms_per_image': round(pil * 1000, 3),
+        'batch_ms_per_image': round(fast * 1000, 3),
+        'speedup': round(pil / fast, 2),
+    }
+
+
+def prepare_database(name, cases, composites):
+    """Create and seed the benchmark database if needed; returns (user_id, case_id with composites)."""
+    import mysql.connector
+    from database import create_tables, db_session
+
+    server = mysql.connector.connect(host=Config.MYSQL_HOST, user=Config.MYSQL_USER, password=Config.MYSQL_PASSWORD)
+    server.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+    server.close()
+    Config.MYSQL_DB = name
+    create_tables()
+
+    rng = random.Random(0)
+    with db_session() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT id FROM users WHERE username = %s", (BENCH_USER,))
+        user = cur.fetchone()
+        if user is None:
+            cur.execute(
+                "INSERT INTO users (username, password, full_name, badge_number, role) VALUES (%s, '', %s, %s, 'admin')",
+                (BENCH_USER, 'Benchmark Officer', '9999')
+            )
+            user = {'id': cur.lastrowid}
+
+        cur.execute("SELECT COUNT(*) AS n FROM cases")
+        existing = cur.fetchone()['n']
+        for start in range(existing, cases, 500):
+            rows = [
+                (f"BENCH-{i:07d}", ' '.join(rng.choice(WORDS) for _ in range(12)), rng.choice(LOCATIONS),
+                 '2024-01-01', user['id'])
+                for i in range(start, min(cases, start + 500))
+            ]
+            cur.executemany(
+                "INSERT INTO cases (case_number, description, location, incident_date, created_by) "
+                "VALUES (%s, %s, %s, %s, %s)", rows
+            )
+
+        cur.execute("SELECT id FROM cases WHERE case_number = 'BENCH-0000000'")
+        case_id = cur.fetchone()['id']
+        cur.execute("SELECT COUNT(*) AS n FROM composites WHERE case_id = %s", (case_id,))
+        missing = composites - cur.fetchone()['n']
+        if missing > 0:
+            cur.executemany(
+                "INSERT INTO composites (case_id, user_id, description, image_path) VALUES (%s, %s, %s, %s)",
+                [(case_id, user['id'], 'benchmark composite', 'bench.png')] * missing
+            )
+        cur.close()
+    return user['id'], case_id
+
+
+def logged_in_client(app, user_id):
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session.update(logged_in=True, user_id=user_id, username=BENCH_USER, full_name='Benchmark Officer',
+                       badge_number='9999', role='admin')
+    return client
+
+
+def time_get(client, url, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return summarize(latencies)
+
+
+def bench_db_queries(app, user_id, case_id, repeats):
+    """Route latency (query + render) for the case list, search, second page and case view."""
+    client = logged_in_client(app, user_id)
+    results = {
+        'cases': time_get(client, '/cases', repeats),
+        'cases_search': time_get(client, '/cases?search=scar+glasses', repeats),
+        'view_case': time_get(client, f'/case/{case_id}', repeats),
+    }
+    # Second page through the keyset cursor the first page hands out
+    html = client.get('/cases').get_data(as_text=True)
+    if 'cursor=' in html:
+        cursor = html.split('cursor=', 1)[1].split('"', 1)[0].split('&', 1)[0]
+        results['cases_page_2'] = time_get(client, f'/cases?cursor={cursor}', repeats)
+    return results
+
+
+def bench_create_composite(app, user_id, case_id, submissions, concurrency, mode):
+    """Concurrent POSTs to create_composite; submit latency, then time until every job has rendered."""
+    queue = app.generation_queue
+    before = queue.stats()
+    lock = threading.Lock()
+    latencies = []
+
+    def submit(i):
+        client = logged_in_client(app, user_id)
+        start = time.perf_counter()
+        client.post(f'/create-composite/{case_id}',
+                    data={'description': f'bench suspect {i} {time.time()}, thin lips, scar', 'mode': mode})
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(submit, range(submissions)))
+    submitted = time.perf_counter() - start
+
+    accepted = queue.stats()['submitted'] - before['submitted']
+    while True:
+        stats = queue.stats()
+        finished = stats['completed'] + stats['failed'] - before['completed'] - before['failed']
+        if finished >= accepted:
+            break
+        time.sleep(0.05)
+    drained = time.perf_counter() - start
+    return dict(
+        summarize(latencies),
+        submissions=submissions,
+        concurrency=concurrency,
+        accepted=accepted,
+        rejected=stats['rejected'] - before['rejected'],
+        failed=stats['failed'] - before['failed'],
+        submits_per_second=round(submissions / submitted, 2),
+        sketches_per_minute=round(accepted / drained * 60, 2),
+        avg_batch_size=stats['avg_batch_size'],
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def numeric_leaves(data, prefix=''):
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from numeric_leaves(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def compare(baseline, current):
+    """Print every metric present in both runs with its relative change."""
+    old = dict(numeric_leaves(baseline.get('results', {})))
+    print(f"[BENCH] {baseline.get('commit')} -> {current.get('commit')}")
+    for path, value in numeric_leaves(current['results']):
+        if path in old and old[path]:
+            change = (value - old[path]) / old[path] * 100
+            print(f"[BENCH] {path:<55} {old[path]:>12} -> {value:>12} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', default='cpu_fast')
+    parser.add_argument('--generation-runs', type=int, default=10)
+    parser.add_argument('--sketch-batch', type=int, default=4)
+    parser.add_argument('--submissions', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--query-repeats', type=int, default=20)
+    parser.add_argument('--database', default='criminal_composite_bench')
+    parser.add_argument('--cases', type=int, default=5000, help='cases seeded into the benchmark database')
+    parser.add_argument('--composites', type=int, default=60, help='composites on the benchmarked case')
+    parser.add_argument('--skip-db', action='store_true', help='skip the sections that need MySQL')
+    parser.add_argument('--output', help='also write the JSON document to this file')
+    parser.add_argument('--compare', help='JSON from an earlier run to diff against')
+    args = parser.parse_args()
+
+    # Stub model, throwaway result cache and output folder: nothing real is read or written
+    work_dir = tempfile.mkdtemp(prefix='sketch_bench_')
+    os.environ['SKETCH_PIPELINE'] = Config.SKETCH_PIPELINE = 'stub'
+    Config.GENERATION_BACKEND = 'thread'
+    Config.RESULT_CACHE_DIR = os.path.join(work_dir, 'results')
+    Config.IMAGE_STORE = 'local'
+    Config.IMAGE_STORE_DIR = os.path.join(work_dir, 'generated')
+    Config.IMAGE_STAGING_DIR = os.path.join(work_dir, 'incoming')
+    Config.THUMBNAIL_DIR = os.path.join(work_dir, 'thumbs')
+    Config.GENERATION_PRELOAD = False
+    Config.GENERATION_QUEUE_SIZE = max(Config.GENERATION_QUEUE_SIZE, args.submissions)
+
+    results = {
+        'generate_sketch_image': bench_generation(args.generation_runs, args.mode),
+        'convert_to_sketch': bench_sketch_filter(args.sketch_batch, 512, 5),
+    }
+    print(f"[BENCH] generate_sketch_image p50 {results['generate_sketch_image']['p50_ms']} ms, "
+          f"convert_to_sketch_batch {results['convert_to_sketch']['batch_ms_per_image']} ms/image")
+
+    if args.skip_db:
+        results['create_composite'] = results['db_queries'] = {'skipped': '--skip-db'}
+    else:
+        try:
+            user_id, case_id = prepare_database(args.database, args.cases, args.composites)
+        except Exception as e:
+            print(f"[WARN] MySQL unavailable, skipping DB sections: {e}")
+            results['create_composite'] = results['db_queries'] = {'skipped': str(e)}
+        else:
+            import app
+            results['db_queries'] = bench_db_queries(app, user_id, case_id, args.query_repeats)
+            results['create_composite'] = bench_create_composite(
+                app, user_id, case_id, args.submissions, args.concurrency, args.mode
+            )
+            print(f"[BENCH] create_composite {results['create_composite']['submits_per_second']} submits/s, "
+                  f"{results['create_composite']['sketches_per_minute']} sketches/min")
+
+    document = {
+        'suite': 'bench_suite',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'pipeline': 'stub',
+        'results': results,
+    }
+    output = json.dumps(document, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), document)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
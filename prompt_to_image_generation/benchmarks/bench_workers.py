@@ -0,0 +1,90 @@
+"""
+Generation throughput for 1/2/4 worker processes.
+
+Run from the project directory:  python -m benchmarks.bench_workers [--workers 1,2,4] [--jobs 8] [--mode cpu_fast]
+Every job gets a unique prompt so the result cache never short-circuits the pipeline.
+Each worker gets an even share of the cores unless --threads is given; --share-model
+loads the model once in a fork server and forks the workers from it (set MODEL_LOADING=mmap to
+map the weights).
+Also reports how long the workers took to become ready and their memory afterwards.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from generation_queue import GenerationJob, GenerationQueue
+from generation_service import ProcessGenerationPool
+
+PROMPT = "male, late 40s, oval face, short receding dark hair, thick eyebrows, hooked nose, thin lips ({nonce})"
+
+
+def run(workers, jobs, threads, mode, batch, out_dir, share_model=False):
+    pool = ProcessGenerationPool(workers, threads, share_model=share_model)
+    generation_queue = GenerationQueue(pool, maxsize=jobs, max_batch=batch, batch_wait=0.2,
+                                       warmup=pool.start, workers=workers)
+    started = time.perf_counter()
+    pool.start()
+    while pool.model_state()['state'] == 'loading':
+        time.sleep(0.05)
+    ready_seconds = time.perf_counter() - started
+
+    done = threading.Semaphore(0)
+    failures = []
+
+    def on_done(job, saved):
+        if not all(saved):
+            failures.append(job.output_path)
+        done.release()
+
+    start = time.perf_counter()
+    for i in range(jobs):
+        output_path = os.path.join(out_dir, f"w{workers}_{i}.png")
+        prompt = PROMPT.format(nonce=uuid.uuid4().hex[:8])
+        generation_queue.submit(GenerationJob(prompt, output_path, on_done=on_done, options={'mode': mode}), block=True)
+    for _ in range(jobs):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    state = pool.model_state()
+    pool.shutdown()
+    return {
+        'workers': workers,
+        'threads_per_worker': pool.threads_per_worker,
+        'shared_model': pool.share_model,
+        'jobs': jobs,
+        'failed': len(failures),
+        'ready_seconds': round(ready_seconds, 2),
+        'worker_load_seconds': [s.get('worker_load_seconds') for s in state['per_worker']],
+        'seconds': round(elapsed, 2),
+        'jobs_per_minute': round(jobs / elapsed * 60, 2),
+        'avg_batch_size': generation_queue.stats()['avg_batch_size'],
+        'memory': state['memory'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--jobs', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per worker (0 = cores / workers)')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--mode', default='cpu_fast')
+    parser.add_argument('--share-model', action='store_true', help='load once and fork the workers')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for workers in (int(w) for w in args.workers.split(',')):
+            result = run(workers, args.jobs, args.threads, args.mode, args.batch, out_dir, args.share_model)
+            print(f"[BENCH] {workers} worker(s) x {result['threads_per_worker']} thread(s): "
+                  f"{result['jobs_per_minute']} sketches/min ({result['seconds']}s for {args.jobs}), "
+                  f"ready in {result['ready_seconds']}s, workers' PSS {result['memory'].get('workers_pss_mb')} MB")
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import csv
+import json
+import os
+from datetime import datetime
+
+from database import insert_many
+from generation_queue import PRIORITY_BULK
+from image_generator import candidate_seeds
+from prompt_builder import composite_prompt
+from result_cache import normalize_prompt
+
+CASE_COLUMNS = ('case_number', 'description', 'location', 'incident_date', 'created_by')
+JOB_COLUMNS = ('case_id', 'user_id', 'description', 'prompt', 'image_path', 'mode', 'seeds', 'import_id', 'priority')
+
+
+def read_records(path, offset=0):
+    """
+    Stream records from a CSV file (first row is the header) or a JSONL file (.jsonl/.ndjson),
+    starting at byte `offset`. Yields (record, byte offset just after the record), so an
+    interrupted import can seek straight back to where it stopped. CSV records are dicts;
+    JSONL records are left as text for parse_record, so one bad line only rejects itself.
+    """
+    jsonl = path.lower().endswith(('.jsonl', '.ndjson'))
+    with open(path, 'rb') as f:
+        if jsonl:
+            f.seek(offset)
+            for line in iter(f.readline, b''):
+                if line.strip():
+                    yield line.decode('utf-8'), f.tell()
+            return
+
+        header = [name.strip() for name in next(csv.reader([f.readline().decode('utf-8-sig')]), [])]
+        f.seek(max(offset, f.tell()))
+        # csv.reader pulls one line at a time (more for quoted newlines), so tell() marks the record's end
+        lines = (line.decode('utf-8') for line in iter(f.readline, b''))
+        for values in csv.reader(lines):
+            if any(values):
+                yield dict(zip(header, values)), f.tell()
+
+
+def parse_record(record):
+    """
+    (case fields, suspect descriptions) from one input record. Suspect descriptions come from
+    `suspect_descriptions` (a JSON list) or `suspect_description`; there may be none.
+    Raises ValueError for a record that cannot become a case.
+    """
+    if isinstance(record, str):
+        record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError("not a JSON object")
+    case_number = str(record.get('case_number') or '').strip().upper()
+    if not case_number:
+        raise ValueError("missing case_number")
+    incident_date = str(record.get('incident_date') or '').strip()
+    case = {
+        'case_number': case_number,
+        'description': str(record.get('description') or '').strip() or None,
+        'location': str(record.get('location') or '').strip() or None,
+        'incident_date': datetime.strptime(incident_date, '%Y-%m-%d').date() if incident_date else None,
+    }
+
+    suspects = record.get('suspect_descriptions')
+    if suspects is None:
+        suspects = [record.get('suspect_description')]
+    elif isinstance(suspects, str):
+        suspects = [suspects]
+    return case, [str(s).strip() for s in suspects if s and str(s).strip()]
+
+
+def sketch_filename(case_id, stamp, index=0):
+    suffix = f"_{index}" if index else ""
+    return f"sketch_{case_id}_{stamp}{suffix}.png"
+
+
+def find_import(cur, source):
+    """Latest unfinished import of `source`, to resume; None if there is none."""
+    cur.execute(
+        "SELECT * FROM imports WHERE source = %s AND status <> 'done' ORDER BY id DESC LIMIT 1",
+        (source,)
+    )
+    return cur.fetchone()
+
+
+def start_import(cur, source, user_id, mode, candidates):
+    cur.execute(
+        "INSERT INTO imports (source, user_id, mode, candidates) VALUES (%s, %s, %s, %s)",
+        (source, user_id, mode, candidates)
+    )
+    cur.execute("SELECT * FROM imports WHERE id = %s", (cur.lastrowid,))
+    return cur.fetchone()
+
+
+def import_chunk(cur, batch, records, end_offset, rejected):
+    """
+    Insert one chunk of parsed records in the caller's transaction: new cases with one multi-row
+    INSERT, then a queued generation job per suspect description with another, and move the
+    import's checkpoint to `end_offset` in the same transaction. Cases whose number already
+    exists are skipped (so are their descriptions). Returns (cases created, skipped, jobs queued).
+    """
+    numbers = list(dict.fromkeys(case['case_number'] for case, _ in records))
+    existing = set()
+    if numbers:
+        cur.execute(
+            f"SELECT case_number FROM cases WHERE case_number IN ({', '.join(['%s'] * len(numbers))})", numbers
+        )
+        existing = {row['case_number'] for row in cur.fetchall()}
+
+    new, seen = [], set(existing)
+    for case, suspects in records:
+        if case['case_number'] not in seen:
+            seen.add(case['case_number'])
+            new.append((case, suspects))
+    insert_many(cur, 'cases', CASE_COLUMNS, [
+        (case['case_number'], case['description'], case['location'], case['incident_date'], batch['user_id'])
+        for case, _ in new
+    ])
+
+    jobs = []
+    if new:
+        created = [case['case_number'] for case, _ in new]
+        cur.execute(
+            f"SELECT id, case_number FROM cases WHERE case_number IN ({', '.join(['%s'] * len(created))})", created
+        )
+        case_ids = {row['case_number']: row['id'] for row in cur.fetchall()}
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        for case, suspects in new:
+            case_id = case_ids[case['case_number']]
+            for index, description in enumerate(suspects):
+                prompt = composite_prompt(description)
+                seeds = candidate_seeds(prompt, batch['candidates'])
+                jobs.append((case_id, batch['user_id'], prompt, prompt, sketch_filename(case_id, stamp, index),
+                             batch['mode'], json.dumps(seeds), batch['id'], PRIORITY_BULK))
+    insert_many(cur, 'generation_jobs', JOB_COLUMNS, jobs)
+
+    skipped = len(records) - len(new)
+    cur.execute(
+        """
+        UPDATE imports
+        SET byte_offset = %s, rows_read = rows_read + %s, rows_rejected = rows_rejected + %s,
+            cases_created = cases_created + %s, cases_skipped = cases_skipped + %s, jobs_queued = jobs_queued + %s
+        WHERE id = %s
+        """,
+        (end_offset, len(records) + rejected, rejected, len(new), skipped, len(jobs), batch['id'])
+    )
+    return len(new), skipped, len(jobs)
+
+
+def imports_waiting(cur):
+    """Ids of imports whose cases are all in and whose composites nobody is rendering yet."""
+    cur.execute("SELECT id FROM imports WHERE status = 'imported' ORDER BY id")
+    return [row['id'] for row in cur.fetchall()]
+
+
+def claim_import(cur, import_id, owner, takeover=False):
+    """
+    Take on rendering an import's composites (`owner` is 'cli' or 'server'); False if another
+    owner already has. With `takeover`, an import left generating by a stopped run of the same
+    owner is taken back too.
+    """
+    cur.execute(
+        "UPDATE imports SET status = 'generating', claimed_by = %s "
+        "WHERE id = %s AND (status = 'imported' OR (%s AND status = 'generating' AND claimed_by = %s))",
+        (owner, import_id, takeover, owner)
+    )
+    if not takeover:
+        return cur.rowcount == 1
+    # A takeover leaves the row unchanged, which MySQL reports as 0 rows, so check the owner
+    cur.execute("SELECT status, claimed_by FROM imports WHERE id = %s", (import_id,))
+    row = cur.fetchone()
+    return row['status'] == 'generating' and row['claimed_by'] == owner
+
+
+def finish_imports(cur):
+    """Mark generating imports with no queued or running job left as done; returns how many."""
+    cur.execute("""
+        UPDATE imports SET status = 'done', finished_at = NOW()
+        WHERE status = 'generating' AND NOT EXISTS (
+            SELECT 1 FROM generation_jobs j WHERE j.import_id = imports.id AND j.status IN ('queued', 'running')
+        )
+    """)
+    return cur.rowcount
+
+
+def queued_jobs(cur, import_id):
+    """
+    The import's jobs still waiting to render, ordered for the generation queue: by mode (so
+    batches fill up with compatible jobs), then by normalized prompt (so repeated descriptions
+    run back to back and hit the result and embedding caches).
+    """
+    cur.execute("UPDATE generation_jobs SET status = 'queued', started_at = NULL "
+                "WHERE import_id = %s AND status = 'running'", (import_id,))
+    cur.execute("SELECT * FROM generation_jobs WHERE import_id = %s AND status = 'queued'", (import_id,))
+    rows = cur.fetchall()
+    rows.sort(key=lambda row: (row['mode'] or '', normalize_prompt(row['prompt']), row['id']))
+    return rows
+
+
+def source_key(path):
+    return os.path.abspath(path)
@@ -0,0 +1,292 @@
+"""
+Case dossiers for court and other agencies, streamed while they are built.
+
+export_zip() yields a ZIP archive piece by piece: per case its details, every composite
+and revision image (copied out of the image store READ_BLOCK bytes at a time) with its
+generation parameters, optionally a PDF contact sheet, and finally a manifest of SHA-256
+digests so the recipient can verify every file. At no point is more than one block or
+one thumbnail in memory, however many composites a case has, and nothing is ever
+seeked, so the same generator feeds an HTTP response or a file on disk.
+"""
+import hashlib
+import io
+import json
+import re
+import zipfile
+from datetime import datetime
+
+from PIL import Image
+
+from config import Config
+from derivatives import ensure_derivative
+from image_store import READ_BLOCK
+
+# A4 in PDF points, and the contact sheet grid
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 36
+COLUMNS, ROWS = 3, 3
+CAPTION_HEIGHT = 30
+HEADER_HEIGHT = 30
+TILE_JPEG_QUALITY = 85
+
+
+def case_folder(case):
+    """Archive folder of a case: its number, reduced to characters safe in any file system."""
+    number = re.sub(r"[^A-Za-z0-9._-]+", "_", str(case["case_number"])).strip("._") or str(case["id"])
+    return f"case_{number}"
+
+
+def _timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _params(row):
+    return json.loads(row["generation_params"]) if row.get("generation_params") else None
+
+
+def dossier_metadata(dossier, folder):
+    """JSON-ready description of a case, its composites and their revisions, pointing at the archived images."""
+    case = dossier["case"]
+    revisions = {}
+    for revision in dossier["revisions"]:
+        revisions.setdefault(revision["composite_id"], []).append({
+            "id": revision["id"],
+            "adjustment": revision["adjustment_text"],
+            "requested_by": revision.get("full_name"),
+            "created_at": _timestamp(revision["created_at"]),
+            "seed": revision.get("seed"),
+            "generation_params": _params(revision),
+            "image": f"{folder}/revisions/revision_{revision['id']}.png",
+        })
+    return {
+        "case_number": case["case_number"],
+        "description": case["description"],
+        "location": case["location"],
+        "incident_date": _timestamp(case["incident_date"]),
+        "created_by": case.get("full_name"),
+        "created_at": _timestamp(case["created_at"]),
+        "composites": [
+            {
+                "id": composite["id"],
+                "description": composite["description"],
+                "created_by": composite.get("full_name"),
+                "badge_number": composite.get("badge_number"),
+                "created_at": _timestamp(composite["created_at"]),
+                "verified_accurate": bool(composite["is_accurate"]),
+                "seed": composite.get("seed"),
+                "generation_params": _params(composite),
+                "image": f"{folder}/composites/composite_{composite['id']}.png",
+                "revisions": revisions.get(composite["id"], []),
+            }
+            for composite in dossier["composites"]
+        ],
+    }
+
+
+class _Sink:
+    """Write-only file the archive writes into; the generator hands its contents on as they arrive."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(name, when, compress):
+    info = zipfile.ZipInfo(name, date_time=(when or datetime.now()).timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def _write_entry(archive, sink, info, chunks, manifest):
+    """Stream `chunks` into one archive entry, yielding the archive bytes as they are produced."""
+    digest = hashlib.sha256()
+    size = 0
+    with archive.open(info, "w") as entry:
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            entry.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+    manifest.append({"path": info.filename, "bytes": size, "sha256": digest.hexdigest()})
+
+
+def _images(dossier, folder):
+    """(archive path, store key, created at) of every composite and revision image of a case."""
+    for composite in dossier["composites"]:
+        yield f"{folder}/composites/composite_{composite['id']}.png", composite["image_path"], composite["created_at"]
+    for revision in dossier["revisions"]:
+        yield (f"{folder}/revisions/revision_{revision['id']}.png", revision["revised_image_path"],
+               revision["created_at"])
+
+
+def export_zip(dossiers, store, contact_sheet=False):
+    """
+    Yield a ZIP of every dossier in `dossiers` ({'case', 'composites', 'revisions'} rows; any
+    iterable, so cases can be loaded one at a time). Images missing from the store are listed
+    in the manifest as missing rather than failing the export.
+    """
+    sink = _Sink()
+    manifest = []
+    cases = 0
+    with zipfile.ZipFile(sink, "w") as archive:
+        for dossier in dossiers:
+            cases += 1
+            folder = case_folder(dossier["case"])
+            metadata = json.dumps(dossier_metadata(dossier, folder), indent=2, default=str).encode("utf-8")
+            yield from _write_entry(archive, sink, _zip_info(f"{folder}/case.json", None, True), [metadata], manifest)
+            for path, key, created_at in _images(dossier, folder):
+                try:
+                    source = store.open(key)
+                except FileNotFoundError:
+                    print(f"[WARN] Export of case {dossier['case']['case_number']}: image {key} is missing")
+                    manifest.append({"path": path, "missing": True})
+                    continue
+                # PNGs are already compressed: store them as they are
+                with source:
+                    yield from _write_entry(archive, sink, _zip_info(path, created_at, False),
+                                            iter(lambda: source.read(READ_BLOCK), b""), manifest)
+            if contact_sheet:
+                yield from _write_entry(archive, sink, _zip_info(f"{folder}/contact_sheet.pdf", None, False),
+                                        contact_sheet_pdf(dossier, store), manifest)
+        summary = {"exported_at": datetime.now().isoformat(), "cases": cases, "files": manifest}
+        yield from _write_entry(archive, sink, _zip_info("manifest.json", None, True),
+                                [json.dumps(summary, indent=2).encode("utf-8")], [])
+    # Central directory
+    yield sink.drain()
+
+
+def _pdf_text(text):
+    """A PDF string literal in the standard fonts' Latin-1 encoding."""
+    encoded = str(text).encode("latin-1", "replace")
+    return b"(" + encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _tile_jpeg(store, key, size):
+    """Grayscale JPEG of a stored image's thumbnail fitted in `size` pixels, as (bytes, width, height), or None."""
+    path = ensure_derivative(store, key, max(Config.THUMBNAIL_SIZES), "png")
+    if path is None:
+        return None
+    with Image.open(path) as image:
+        tile = image.convert("L")
+    tile.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    tile.save(buffer, "JPEG", quality=TILE_JPEG_QUALITY)
+    return buffer.getvalue(), tile.width, tile.height
+
+
+class _PdfWriter:
+    """Sequential PDF objects with their byte offsets remembered for the cross-reference table."""
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.next_number = 4  # 1 catalog, 2 page tree (written last), 3 font
+
+    def reserve(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def chunk(self, data):
+        self.position += len(data)
+        return data
+
+    def obj(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        data = b"%d 0 obj\n" % number + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return self.chunk(data + b"\nendobj\n")
+
+    def trailer(self):
+        count = max(self.offsets) + 1
+        rows = [b"0000000000 65535 f \n"] + [
+            b"%010d 00000 n \n" % self.offsets[number] if number in self.offsets else b"0000000000 65535 f \n"
+            for number in range(1, count)
+        ]
+        xref = self.position
+        return self.chunk(b"xref\n0 %d\n" % count + b"".join(rows)
+                          + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref))
+
+
+def contact_sheet_pdf(dossier, store):
+    """
+    Yield a PDF contact sheet of a case: every composite and revision as a captioned tile,
+    COLUMNS x ROWS per A4 page. Each page is written out before the next tile is decoded.
+    """
+    case = dossier["case"]
+    tiles = [
+        (composite["image_path"], f"Composite #{composite['id']}",
+         f"{str(_timestamp(composite['created_at']))[:10]}{' - verified' if composite['is_accurate'] else ''}")
+        for composite in dossier["composites"]
+    ] + [
+        (revision["revised_image_path"], f"Revision #{revision['id']} of #{revision['composite_id']}",
+         str(_timestamp(revision["created_at"]))[:10])
+        for revision in dossier["revisions"]
+    ]
+    pdf = _PdfWriter()
+    yield pdf.chunk(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    yield pdf.obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    yield pdf.obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    cell_width = (PAGE_WIDTH - 2 * MARGIN) / COLUMNS
+    cell_height = (PAGE_HEIGHT - 2 * MARGIN - HEADER_HEIGHT) / ROWS
+    box = int(min(cell_width, cell_height - CAPTION_HEIGHT)) - 10
+    per_page = COLUMNS * ROWS
+    pages = []
+    for first in range(0, max(len(tiles), 1), per_page):
+        page_number = len(pages) + 1
+        header = f"Case {case['case_number']} - composite sketches (page {page_number})"
+        content = [b"BT /F1 12 Tf %d %d Td %s Tj ET" % (MARGIN, PAGE_HEIGHT - MARGIN - 12, _pdf_text(header))]
+        images = []
+        for slot, (key, title, subtitle) in enumerate(tiles[first:first + per_page]):
+            left = MARGIN + (slot % COLUMNS) * cell_width
+            top = PAGE_HEIGHT - MARGIN - HEADER_HEIGHT - (slot // COLUMNS) * cell_height
+            try:
+                tile = _tile_jpeg(store, key, box * 2)  # twice the point size: sharp when printed
+            except OSError as e:
+                print(f"[WARN] Contact sheet of case {case['case_number']}: {key} unreadable: {e}")
+                tile = None
+            if tile is not None:
+                data, width, height = tile
+                scale = box / max(width, height)
+                number = pdf.reserve()
+                yield pdf.obj(number, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                                      b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>" % (width, height, len(data)),
+                              data)
+                images.append(number)
+                shown_width, shown_height = width * scale, height * scale
+                x = left + (cell_width - shown_width) / 2
+                y = top - box + (box - shown_height)
+                content.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /Im%d Do Q" % (shown_width, shown_height, x, y, number))
+            else:
+                content.append(b"BT /F1 9 Tf %.2f %.2f Td (Image unavailable) Tj ET" % (left + 5, top - box / 2))
+            content.append(b"BT /F1 9 Tf %.2f %.2f Td %s Tj ET" % (left + 5, top - box - 14, _pdf_text(title)))
+            content.append(b"BT /F1 8 Tf %.2f %.2f Td %s Tj ET" % (left + 5, top - box - 25, _pdf_text(subtitle)))
+        stream = b"\n".join(content)
+        contents = pdf.reserve()
+        yield pdf.obj(contents, b"<< /Length %d >>" % len(stream), stream)
+        xobjects = b" ".join(b"/Im%d %d 0 R" % (number, number) for number in images)
+        page = pdf.reserve()
+        yield pdf.obj(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R "
+                            b"/Resources << /Font << /F1 3 0 R >> /XObject << %s >> >> >>"
+                      % (PAGE_WIDTH, PAGE_HEIGHT, contents, xobjects))
+        pages.append(page)
+    kids = b" ".join(b"%d 0 R" % page for page in pages)
+    yield pdf.obj(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(pages)))
+    yield pdf.trailer()
@@ -9,5 +9,92 @@ class Config:
     MYSQL_USER = os.getenv('MYSQL_USER') or 'root'
     MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD') or ''
     MYSQL_DB = os.getenv('MYSQL_DB') or 'criminal_composite_db'
+    # Connection pool shared by requests and generation callbacks; seconds to wait for a free connection
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or 8)
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT') or 5)
+    # Rows per page on the case list
+    CASES_PAGE_SIZE = int(os.getenv('CASES_PAGE_SIZE') or 25)
+    # Flat directory sketches were saved in before the image store (read by `flask migrate-images`)
     UPLOAD_FOLDER = 'static/generated'
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
\ No newline at end of file
+    # Where finished sketches are kept: 'local' (content-addressed shards under IMAGE_STORE_DIR), 's3'
+    # (IMAGE_STORE_BUCKET on an S3-compatible service, needs boto3; IMAGE_STORE_ENDPOINT for non-AWS) or
+    # 'local-bucket' (the object-store code against a directory under IMAGE_STORE_DIR, for development)
+    IMAGE_STORE = os.getenv('IMAGE_STORE') or 'local'
+    IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR') or 'static/generated'
+    IMAGE_STORE_BUCKET = os.getenv('IMAGE_STORE_BUCKET') or 'sketches'
+    IMAGE_STORE_ENDPOINT = os.getenv('IMAGE_STORE_ENDPOINT') or ''
+    # Scratch directory sketches are rendered into before they move into the store
+    IMAGE_STAGING_DIR = os.getenv('IMAGE_STAGING_DIR') or 'cache/incoming'
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    # Sketch generation queue: pending-job capacity, jobs per pipeline call, seconds to wait for a batch to fill
+    GENERATION_QUEUE_SIZE = int(os.getenv('GENERATION_QUEUE_SIZE') or 16)
+    GENERATION_BATCH_SIZE = int(os.getenv('GENERATION_BATCH_SIZE') or 4)
+    GENERATION_BATCH_WAIT = float(os.getenv('GENERATION_BATCH_WAIT') or 0.5)
+    # Generation scheduling: jobs one user may have rendering while others wait (0 = no limit), seconds of
+    # waiting that lift a job one priority tier (0 = never), seconds before its deadline a job jumps ahead,
+    # and finished jobs per mode whose durations feed start-time estimates
+    SCHEDULER_USER_CONCURRENCY = int(os.getenv('SCHEDULER_USER_CONCURRENCY') or 2)
+    SCHEDULER_AGE_BOOST_SECONDS = float(os.getenv('SCHEDULER_AGE_BOOST_SECONDS') or 300)
+    SCHEDULER_DEADLINE_SLACK_SECONDS = float(os.getenv('SCHEDULER_DEADLINE_SLACK_SECONDS') or 120)
+    SCHEDULER_HISTORY = int(os.getenv('SCHEDULER_HISTORY') or 50)
+    # On-disk cache of finished sketches, keyed by prompt/seed/generation settings
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR') or 'cache/results'
+    RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB') or 512)
+    # Prompt embeddings kept per loaded model (the negative prompt is always kept)
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE') or 256)
+    # Default generation mode (standard, cpu_fast, cpu_fast_int8) and torch CPU threads (0 = all available cores).
+    # cpu_fast_int8 is for speed, not memory: its quantized UNet and text encoder (convolutions still float32)
+    # are held on top of the float32 model the other modes share, in every process that renders in it
+    GENERATION_MODE = os.getenv('GENERATION_MODE') or 'standard'
+    # Draft mode, for iterating on a description live: pixel size the pipeline renders at (a multiple of 64;
+    # the result is upscaled to full size) and denoising steps
+    DRAFT_SIZE = int(os.getenv('DRAFT_SIZE') or 256)
+    DRAFT_STEPS = int(os.getenv('DRAFT_STEPS') or 8)
+    TORCH_THREADS = int(os.getenv('TORCH_THREADS') or 0)
+    # How model weights are loaded on CPU: 'copy' (every process reads its own copy) or 'mmap' (safetensors
+    # files memory-mapped copy-on-write, so processes share the pages; the process backend then loads the
+    # model once in a fork-server helper process and forks its workers from it)
+    MODEL_LOADING = os.getenv('MODEL_LOADING') or 'copy'
+    # Load the model on the generation worker at startup instead of on the first job
+    GENERATION_PRELOAD = (os.getenv('GENERATION_PRELOAD') or '0') == '1'
+    # Where generation runs: 'thread' (in the web process) or 'process' (a pool of worker processes,
+    # each with its own model; 0 threads per worker = split the available cores evenly)
+    GENERATION_BACKEND = os.getenv('GENERATION_BACKEND') or 'thread'
+    GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS') or 1)
+    GENERATION_WORKER_THREADS = int(os.getenv('GENERATION_WORKER_THREADS') or 0)
+    # Fraction of the denoising steps a revision re-runs on top of its parent composite
+    REVISION_STRENGTH = float(os.getenv('REVISION_STRENGTH') or 0.5)
+    # Thumbnail edge lengths (px) written for each saved sketch, and WebP quality for color (non-sketch) images
+    THUMBNAIL_SIZES = tuple(int(size) for size in (os.getenv('THUMBNAIL_SIZES') or '256,384').split(','))
+    THUMBNAIL_WEBP_QUALITY = int(os.getenv('THUMBNAIL_WEBP_QUALITY') or 80)
+    # Thumbnails live on local disk whatever the image store, sharded like the store's keys
+    THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR') or 'static/generated/thumbs'
+    # Perceptual-hash / embedding index of every composite (for "similar composites"), saved to this file
+    # after every N newly indexed composites and when the server exits; similar composites shown per page
+    SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH') or 'cache/similarity_index.npz'
+    SIMILARITY_SAVE_EVERY = int(os.getenv('SIMILARITY_SAVE_EVERY') or 50)
+    SIMILAR_COMPOSITES = int(os.getenv('SIMILAR_COMPOSITES') or 6)
+    # Most candidates (alternative renders, one seed each) a single composite request may ask for
+    GENERATION_MAX_CANDIDATES = int(os.getenv('GENERATION_MAX_CANDIDATES') or 4)
+    # Where ?profile=cprofile|torch dumps per-request / per-batch profiles (empty = profiling disabled)
+    PROFILE_DIR = os.getenv('PROFILE_DIR') or ''
+    # Pipeline behind load_model: 'diffusers' (the real model) or 'stub' (NumPy stand-in for benchmarks),
+    # and the seconds each stub denoising step sleeps to imitate model compute
+    SKETCH_PIPELINE = os.getenv('SKETCH_PIPELINE') or 'diffusers'
+    STUB_STEP_SECONDS = float(os.getenv('STUB_STEP_SECONDS') or 0)
+    # Stream a low-resolution latent preview of running jobs every N denoising steps (0 = off)
+    PREVIEW_EVERY_STEPS = int(os.getenv('PREVIEW_EVERY_STEPS') or 3)
+    # Records per transaction in `flask import-cases`, and how often the web server looks for imports
+    # left for it to render (`--no-generate`; 0 = never)
+    IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE') or 500)
+    IMPORT_POLL_SECONDS = float(os.getenv('IMPORT_POLL_SECONDS') or 30)
+    # Where multi-case exports are written, and how many are built at once
+    EXPORT_DIR = os.getenv('EXPORT_DIR') or 'cache/exports'
+    EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS') or 1)
+    # Cache of page read models (cases, composite lists, revisions, recent cases): 'memory' (per process),
+    # 'sqlite' (a local file shared by every web process on the host, READ_CACHE_PATH) or 'off'; seconds an
+    # entry lives, and entries kept
+    READ_CACHE = os.getenv('READ_CACHE') or 'memory'
+    READ_CACHE_PATH = os.getenv('READ_CACHE_PATH') or 'cache/read_cache.sqlite3'
+    READ_CACHE_TTL = float(os.getenv('READ_CACHE_TTL') or 60)
+    READ_CACHE_SIZE = int(os.getenv('READ_CACHE_SIZE') or 2048)
@@ -1,19 +1,128 @@
-from flask_mysqldb import MySQL
+import time
+import threading
+from contextlib import contextmanager
+
+from flask import g
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+
 from config import Config
 
-mysql = MySQL()
+# One connection pool per process, shared by request handlers and background threads
+_pool = None
+_pool_lock = threading.Lock()
 
 def init_db(app):
-    app.config['MYSQL_HOST'] = Config.MYSQL_HOST
-    app.config['MYSQL_USER'] = Config.MYSQL_USER
-    app.config['MYSQL_PASSWORD'] = Config.MYSQL_PASSWORD
-    app.config['MYSQL_DB'] = Config.MYSQL_DB
-    app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
-    mysql.init_app(app)
+    app.teardown_appcontext(close_db)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables, columns and indexes."""
+        create_tables()
+        print("[INFO] Database schema is up to date.")
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pooling.MySQLConnectionPool(
+                pool_name='composite_db',
+                pool_size=Config.DB_POOL_SIZE,
+                host=Config.MYSQL_HOST,
+                user=Config.MYSQL_USER,
+                password=Config.MYSQL_PASSWORD,
+                database=Config.MYSQL_DB,
+                autocommit=False,
+            )
+        return _pool
+
+def checkout_connection(timeout=None):
+    """Borrow a pooled connection, waiting up to DB_POOL_TIMEOUT seconds for one to free up."""
+    deadline = time.time() + (Config.DB_POOL_TIMEOUT if timeout is None else timeout)
+    while True:
+        try:
+            return get_pool().get_connection()
+        except PoolError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.05)
+
+def get_db():
+    """Connection scoped to the current app context (request or `with app.app_context()`)."""
+    if 'db' not in g:
+        g.db = checkout_connection()
+    return g.db
+
+def get_cursor():
+    return get_db().cursor(dictionary=True)
+
+def close_db(exc=None):
+    """Return the context's connection to the pool, discarding any uncommitted work."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        try:
+            conn.rollback()
+        finally:
+            conn.close()
+
+@contextmanager
+def db_session():
+    """Pooled connection for code outside Flask (scripts, benchmarks); commits on success."""
+    conn = checkout_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def add_column_if_missing(cur, table, column, definition):
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    if not cur.fetchone()['n']:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def add_index_if_missing(cur, table, index, definition):
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, index)
+    )
+    if not cur.fetchone()['n']:
+        cur.execute(f"ALTER TABLE {table} ADD {definition}")
+
+def add_enum_value_if_missing(cur, table, column, value, definition):
+    cur.execute(
+        "SELECT COLUMN_TYPE AS type FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    row = cur.fetchone()
+    if row and f"'{value}'" not in str(row['type']):
+        cur.execute(f"ALTER TABLE {table} MODIFY COLUMN {column} {definition}")
+
+def insert_many(cur, table, columns, rows):
+    """One multi-row INSERT of `rows` (tuples in `columns` order); returns the number of rows inserted."""
+    if not rows:
+        return 0
+    placeholders = f"({', '.join(['%s'] * len(columns))})"
+    cur.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(rows))}",
+        [value for row in rows for value in row]
+    )
+    return cur.rowcount
 
 def create_tables():
-    conn = mysql.connection
-    cur = conn.cursor()
+    with db_session() as conn:
+        _create_tables(conn)
+
+def _create_tables(conn):
+    cur = conn.cursor(dictionary=True)
     
     # Create tables if they don't exist
     cur.execute("""
@@ -24,7 +133,8 @@ def create_tables():
         full_name VARCHAR(100),
         badge_number VARCHAR(20),
         role ENUM('officer', 'admin') DEFAULT 'officer',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_users_badge (badge_number)
     )
     """)
     
@@ -35,8 +145,12 @@ def create_tables():
         description TEXT,
         location VARCHAR(100),
         incident_date DATE,
+        is_urgent TINYINT(1) DEFAULT 0,
         created_by INT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_cases_created (created_at, id),
+        INDEX idx_cases_creator_created (created_by, created_at, id),
+        FULLTEXT INDEX ft_cases_search (description, location),
         FOREIGN KEY (created_by) REFERENCES users(id)
     )
     """)
@@ -48,8 +162,13 @@ def create_tables():
         user_id INT,
         description TEXT NOT NULL,
         image_path VARCHAR(255) NOT NULL,
+        generation_params TEXT,
+        seed BIGINT NULL,
+        job_id INT NULL,
         is_accurate BOOLEAN DEFAULT FALSE,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_composites_case_created (case_id, created_at),
+        INDEX idx_composites_job (job_id),
         FOREIGN KEY (case_id) REFERENCES cases(id),
         FOREIGN KEY (user_id) REFERENCES users(id)
     )
@@ -60,12 +179,130 @@ def create_tables():
         id INT AUTO_INCREMENT PRIMARY KEY,
         composite_id INT,
         adjustment_text TEXT NOT NULL,
+        user_id INT,
         revised_image_path VARCHAR(255) NOT NULL,
+        generation_params TEXT,
+        seed BIGINT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_revisions_composite_created (composite_id, created_at),
+        FOREIGN KEY (composite_id) REFERENCES composites(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+    
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS imports (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        source VARCHAR(512) NOT NULL,
+        user_id INT,
+        mode VARCHAR(32) DEFAULT 'standard',
+        candidates INT DEFAULT 1,
+        status ENUM('importing', 'imported', 'generating', 'done') DEFAULT 'importing',
+        claimed_by ENUM('cli', 'server') NULL,
+        byte_offset BIGINT DEFAULT 0,
+        rows_read INT DEFAULT 0,
+        rows_rejected INT DEFAULT 0,
+        cases_created INT DEFAULT 0,
+        cases_skipped INT DEFAULT 0,
+        jobs_queued INT DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (composite_id) REFERENCES composites(id)
+        finished_at DATETIME NULL,
+        INDEX idx_imports_source (source(191), id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
     )
     """)
     
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS generation_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        kind ENUM('composite', 'revision') DEFAULT 'composite',
+        case_id INT,
+        user_id INT,
+        parent_composite_id INT NULL,
+        adjustment_text TEXT,
+        description TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        image_path VARCHAR(255) NOT NULL,
+        mode VARCHAR(32) DEFAULT 'standard',
+        seeds TEXT,
+        priority TINYINT DEFAULT 1,
+        deadline DATETIME NULL,
+        status ENUM('queued', 'running', 'done', 'failed', 'cancelled') DEFAULT 'queued',
+        composite_id INT NULL,
+        revision_id INT NULL,
+        import_id INT NULL,
+        error_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at DATETIME NULL,
+        finished_at DATETIME NULL,
+        INDEX idx_generation_jobs_status (status),
+        INDEX idx_generation_jobs_case_status (case_id, status),
+        INDEX idx_generation_jobs_parent_status (parent_composite_id, status),
+        INDEX idx_generation_jobs_import_status (import_id, status),
+        FOREIGN KEY (case_id) REFERENCES cases(id),
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (parent_composite_id) REFERENCES composites(id),
+        FOREIGN KEY (composite_id) REFERENCES composites(id),
+        FOREIGN KEY (revision_id) REFERENCES revisions(id)
+    )
+    """)
+    
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS exports (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT,
+        case_ids TEXT NOT NULL,
+        contact_sheet BOOLEAN DEFAULT FALSE,
+        status ENUM('queued', 'running', 'done', 'failed') DEFAULT 'queued',
+        file_path VARCHAR(255) NULL,
+        bytes BIGINT NULL,
+        error_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME NULL,
+        INDEX idx_exports_user (user_id, id),
+        INDEX idx_exports_status (status),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+    
+    # Columns added after the first release; CREATE TABLE IF NOT EXISTS won't add them to old tables
+    add_column_if_missing(cur, 'composites', 'generation_params', 'TEXT')
+    add_column_if_missing(cur, 'generation_jobs', 'mode', "VARCHAR(32) DEFAULT 'standard'")
+    add_column_if_missing(cur, 'generation_jobs', 'kind', "ENUM('composite', 'revision') DEFAULT 'composite'")
+    add_column_if_missing(cur, 'generation_jobs', 'parent_composite_id', 'INT NULL')
+    add_column_if_missing(cur, 'generation_jobs', 'adjustment_text', 'TEXT')
+    add_column_if_missing(cur, 'generation_jobs', 'revision_id', 'INT NULL')
+    add_column_if_missing(cur, 'revisions', 'user_id', 'INT NULL')
+    add_column_if_missing(cur, 'revisions', 'generation_params', 'TEXT')
+    # Per-candidate seeds: the job's list, then the seed each saved image was rendered with
+    add_column_if_missing(cur, 'generation_jobs', 'seeds', 'TEXT')
+    add_column_if_missing(cur, 'composites', 'seed', 'BIGINT NULL')
+    add_column_if_missing(cur, 'composites', 'job_id', 'INT NULL')
+    add_column_if_missing(cur, 'revisions', 'seed', 'BIGINT NULL')
+    # Jobs created by `flask import-cases`
+    add_column_if_missing(cur, 'generation_jobs', 'import_id', 'INT NULL')
+    # Jobs stopped by their requester
+    add_enum_value_if_missing(cur, 'generation_jobs', 'status', 'cancelled',
+                              "ENUM('queued', 'running', 'done', 'failed', 'cancelled') DEFAULT 'queued'")
+    # Scheduling: cases flagged urgent by an admin, and each job's tier and requested start-by time
+    add_column_if_missing(cur, 'cases', 'is_urgent', 'TINYINT(1) DEFAULT 0')
+    add_column_if_missing(cur, 'generation_jobs', 'priority', 'TINYINT DEFAULT 1')
+    add_column_if_missing(cur, 'generation_jobs', 'deadline', 'DATETIME NULL')
+
+    # Secondary indexes for login, the dashboard, case list/search and case/composite pages
+    add_index_if_missing(cur, 'users', 'idx_users_badge', 'INDEX idx_users_badge (badge_number)')
+    add_index_if_missing(cur, 'cases', 'idx_cases_created', 'INDEX idx_cases_created (created_at, id)')
+    add_index_if_missing(cur, 'cases', 'idx_cases_creator_created',
+                         'INDEX idx_cases_creator_created (created_by, created_at, id)')
+    add_index_if_missing(cur, 'cases', 'ft_cases_search', 'FULLTEXT INDEX ft_cases_search (description, location)')
+    add_index_if_missing(cur, 'composites', 'idx_composites_case_created',
+                         'INDEX idx_composites_case_created (case_id, created_at)')
+    add_index_if_missing(cur, 'composites', 'idx_composites_job', 'INDEX idx_composites_job (job_id)')
+    add_index_if_missing(cur, 'revisions', 'idx_revisions_composite_created',
+                         'INDEX idx_revisions_composite_created (composite_id, created_at)')
+    add_index_if_missing(cur, 'generation_jobs', 'idx_generation_jobs_import_status',
+                         'INDEX idx_generation_jobs_import_status (import_id, status)')
+    
     # Create admin user if not exists
     cur.execute("SELECT * FROM users WHERE username = 'admin'")
     admin = cur.fetchone()
@@ -78,5 +315,4 @@ def create_tables():
             ('admin', password_hash, 'Admin User', '0000', 'admin')
         )
     
-    conn.commit()
     cur.close()
\ No newline at end of file
@@ -0,0 +1,143 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from PIL import Image, ImageChops, features
+
+from config import Config
+from image_store import local_copy, tmp_name
+
+# Derivative formats, preferred first; WebP only if this Pillow build can encode it
+FORMATS = ('webp', 'png') if features.check('webp') else ('png',)
+MIMETYPES = {'webp': 'image/webp', 'png': 'image/png'}
+# Sketches are black-and-white line art: a few gray levels keep the downscaled strokes
+# smooth while letting lossless WebP / 2-bit PNG beat the size of lossy encodings
+GRAY_LEVELS = 4
+
+
+def derivative_path(key, size, fmt):
+    """<THUMBNAIL_DIR>/<size>/<key dirs>/<key stem>.<fmt>, on local disk whatever the image store."""
+    directory, name = os.path.split(key)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(Config.THUMBNAIL_DIR, str(size), *directory.split('/'), f"{stem}.{fmt}")
+
+
+def is_grayscale(image):
+    if image.mode in ('1', 'L'):
+        return True
+    r, g, b = image.convert('RGB').split()
+    return ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(g, b).getbbox() is None
+
+
+def posterize(image, levels=GRAY_LEVELS):
+    step = 255 / (levels - 1)
+    return image.point([round(round(v / step) * step) for v in range(256)])
+
+
+def _save(image, path, fmt, gray):
+    # Write to a temp name and rename, so concurrent readers never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # (per thread: a request and the generation worker may render the same thumbnail at once)
+    tmp_path = tmp_name(path)
+    try:
+        if gray and fmt == 'webp':
+            posterize(image).save(tmp_path, 'WEBP', lossless=True)
+        elif gray:
+            levels = posterize(image).convert('P', palette=Image.ADAPTIVE, colors=GRAY_LEVELS)
+            levels.save(tmp_path, 'PNG', optimize=True, bits=max(1, (GRAY_LEVELS - 1).bit_length()))
+        elif fmt == 'webp':
+            image.save(tmp_path, 'WEBP', quality=Config.THUMBNAIL_WEBP_QUALITY, method=4)
+        else:
+            image.save(tmp_path, 'PNG', optimize=True)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def make_derivatives(source_path, key, sizes=None, formats=None, force=False):
+    """
+    Write every missing thumbnail of the image stored under `key` (one per size and format),
+    reading it from `source_path`. Keys never change content, so an existing thumbnail is
+    current. The source is decoded once and downscaled from the previous, larger size.
+    Returns the paths written.
+    """
+    sizes = sorted(sizes or Config.THUMBNAIL_SIZES, reverse=True)
+    formats = formats or FORMATS
+    todo = [
+        (size, fmt) for size in sizes for fmt in formats
+        if force or not os.path.exists(derivative_path(key, size, fmt))
+    ]
+    if not todo:
+        return []
+
+    written = []
+    with Image.open(source_path) as source:
+        gray = is_grayscale(source)
+        image = source.convert('L' if gray else 'RGB')
+    for size in sizes:
+        if image.width > size or image.height > size:
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+        for fmt in formats:
+            if (size, fmt) in todo:
+                path = derivative_path(key, size, fmt)
+                _save(image, path, fmt, gray)
+                written.append(path)
+    return written
+
+
+def ensure_derivative(store, key, size, fmt):
+    """
+    Path of one thumbnail, rendering it first if it is missing (images saved before thumbnails
+    existed). Returns None if `store` has no image under `key`.
+    """
+    path = derivative_path(key, size, fmt)
+    if not os.path.exists(path):
+        if not store.exists(key):
+            return None
+        with local_copy(store, key) as source_path:
+            make_derivatives(source_path, key, sizes=[size], formats=[fmt])
+    return path
+
+
+@lru_cache(maxsize=4096)
+def _digest(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def derivative_etag(path):
+    """Strong ETag: content hash, recomputed only when the file's mtime or size changes."""
+    stat = os.stat(path)
+    return _digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+def backfill(store, force=False, workers=0):
+    """
+    Write missing thumbnails for every image in `store`, several images at a time (Pillow
+    releases the GIL while resizing and encoding). Returns (images, files written).
+    """
+    images = written = 0
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for paths in pool.map(lambda key: _backfill_one(store, key, force), store.keys()):
+            images += 1
+            written += len(paths)
+    return images, written
+
+
+def _backfill_one(store, key, force):
+    try:
+        with local_copy(store, key) as source_path:
+            return make_derivatives(source_path, key, force=force)
+    except Exception as e:
+        print(f"[ERROR] Thumbnails for {key} failed: {e}")
+        return []
+
+
+def pick_format(accept_mimetypes):
+    """WebP for clients that list it explicitly in Accept (browsers do for images), else PNG."""
+    if 'webp' in FORMATS and MIMETYPES['webp'] in accept_mimetypes.values():
+        return 'webp'
+    return 'png'
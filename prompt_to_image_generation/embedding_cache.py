@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class PromptEmbeddingCache:
+    """
+    CLIP text embeddings for one loaded pipeline.
+
+    The negative prompt is encoded once and kept for the life of the model; full prompts
+    live in a bounded LRU keyed by prompt text. Results are shaped for the pipeline's
+    `prompt_embeds` / `negative_prompt_embeds` arguments.
+    """
+
+    def __init__(self, pipe, maxsize=256):
+        self.pipe = pipe
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._negative = {}
+        self.hits = 0
+        self.misses = 0
+
+    @torch.no_grad()
+    def _encode(self, texts):
+        tokenizer = self.pipe.tokenizer
+        tokens = tokenizer(
+            texts,
+            padding="max_length",
+            max_length=tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt",
+        )
+        text_encoder = self.pipe.text_encoder
+        embeds = text_encoder(tokens.input_ids.to(self.pipe.device))[0]
+        return embeds.to(dtype=text_encoder.dtype)
+
+    def negative(self, text, count):
+        """Negative-prompt embeddings repeated for a batch of `count` prompts."""
+        with self._lock:
+            embeds = self._negative.get(text)
+        if embeds is None:
+            embeds = self._encode([text])
+            with self._lock:
+                self._negative[text] = embeds
+        return embeds.repeat(count, 1, 1)
+
+    def prompts(self, texts):
+        """Embeddings for `texts` in order; only texts missing from the LRU are encoded, in one call."""
+        with self._lock:
+            found = {}
+            for text in texts:
+                if text in self._entries:
+                    self._entries.move_to_end(text)
+                    found[text] = self._entries[text]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            encoded = self._encode(missing)
+            with self._lock:
+                for text, embeds in zip(missing, encoded):
+                    found[text] = embeds.unsqueeze(0)
+                    self._entries[text] = found[text]
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return torch.cat([found[text] for text in texts])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
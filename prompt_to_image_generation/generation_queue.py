@@ -0,0 +1,425 @@
+import itertools
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from metrics import observe_stage
+
+# Scheduling tiers, lowest first: bulk imports, routine requests, admins and urgent cases
+PRIORITY_BULK = 0
+PRIORITY_ROUTINE = 1
+PRIORITY_URGENT = 2
+# Tiers a job jumps once it is within the deadline slack (so it overtakes fresh urgent work)
+DEADLINE_BOOST = 2
+
+
+class QueueFull(Exception):
+    """Raised when the generation queue cannot accept another job."""
+
+
+class GenerationJob:
+    """
+    A prompt waiting to be rendered, plus what to do once it is saved.
+    `options` are passed to the handler as keyword arguments; only jobs with equal
+    options are batched together. Jobs with an `init_image` (revisions) are only
+    batched with other such jobs, and the handler gets their paths as `init_images`
+    and their `adjustment` texts (the requested change) as `adjustments`.
+
+    With `seeds`, the job renders one candidate per seed, to the matching entry of
+    `output_path` (then a list of paths), all in the same handler call. `on_done(job,
+    saved)` gets the saved path (or None) of every output, in order.
+
+    `on_preview(job, step, steps, image)` receives JPEG previews of the job's first output
+    while it renders. A job can be cancelled while queued or running; it still gets its
+    `on_done` call (with nothing saved), so check `cancelled` there.
+
+    `owner` (the requesting user) is the unit of fair sharing, `priority` one of the
+    PRIORITY_* tiers and `deadline` an optional epoch time the job should have started by.
+    """
+
+    def __init__(self, prompt, output_path, on_done=None, on_start=None, options=None, init_image=None, seeds=None,
+                 on_preview=None, owner=None, priority=PRIORITY_ROUTINE, deadline=None, adjustment=None):
+        self.prompt = prompt
+        self.output_paths = [output_path] if isinstance(output_path, str) else list(output_path)
+        self.seeds = list(seeds) if seeds else [None] * len(self.output_paths)
+        if len(self.seeds) != len(self.output_paths):
+            raise ValueError("A generation job needs one output path per seed.")
+        self.init_image = init_image
+        self.adjustment = adjustment
+        self.on_done = on_done
+        self.on_start = on_start
+        self.on_preview = on_preview
+        self.options = options or {}
+        self.owner = owner
+        self.priority = priority
+        self.deadline = deadline
+        self.error = None
+        self.submitted_at = time.time()
+        self._sequence = 0
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def output_path(self):
+        return self.output_paths[0]
+
+    @property
+    def size(self):
+        """Images this job adds to a pipeline call."""
+        return len(self.output_paths)
+
+    @property
+    def batch_key(self):
+        return (self.init_image is not None,) + tuple(sorted(self.options.items()))
+
+
+class BatchProgress:
+    """
+    Per-image hooks for one handler call, passed as `progress=`. Image indexes follow the
+    handler's prompt list. `preview_indexes` are the images worth previewing (each job's
+    first output); `cancelled()` lists the images whose job has been cancelled since.
+    """
+
+    def __init__(self, jobs):
+        self._owners = [job for job in jobs for _ in job.output_paths]
+        self.preview_indexes = []
+        offset = 0
+        for job in jobs:
+            if job.on_preview is not None:
+                self.preview_indexes.append(offset)
+            offset += job.size
+
+    def preview(self, index, step, steps, image):
+        job = self._owners[index]
+        try:
+            job.on_preview(job, step, steps, image)
+        except Exception as e:
+            print(f"[ERROR] Generation job preview callback error: {e}")
+
+    def cancelled(self):
+        return [i for i, job in enumerate(self._owners) if job.cancelled]
+
+
+class GenerationQueue:
+    """
+    Bounded job queue drained by long-lived worker threads (one by default).
+
+    The worker takes the job the scheduler ranks first, waits up to `batch_wait` seconds
+    for more with the same options to arrive and hands up to `max_batch` images to `handler`
+    in one call (a multi-candidate job larger than that runs on its own).
+    `handler(prompts, output_paths, seeds=..., progress=..., **options)` must return one
+    saved path (or None) per prompt; `progress` is the batch's BatchProgress. Jobs with
+    other options wait for the next batch. Cancelled jobs are dropped before they run.
+    `warmup`, if given, runs once on each worker thread before its first batch
+    (e.g. to load the model off the request path). With `workers` > 1 the handler
+    is called concurrently, one batch per worker thread.
+
+    Scheduling: the highest tier goes first, a job's tier rising by one for every
+    `age_boost` seconds it has waited and by DEADLINE_BOOST once its deadline is less than
+    `deadline_slack` seconds away. Within a tier, owners share the workers fairly
+    (start-time fair queuing over images rendered: the owner served least goes next, and an
+    owner returning from idle starts level with the busiest, not ahead on old credit). An
+    owner with `user_concurrency` jobs already rendering is passed over while anyone else
+    is waiting; when nobody is, the worker takes their jobs anyway rather than idle.
+    Start-time estimates replay that order against the last `history` job durations.
+    """
+
+    def __init__(self, handler, maxsize=16, max_batch=4, batch_wait=0.5, warmup=None, workers=1,
+                 user_concurrency=0, age_boost=0, deadline_slack=0, history=50):
+        self.handler = handler
+        self.warmup = warmup
+        self.workers = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.batch_wait = batch_wait
+        self.maxsize = maxsize
+        self.user_concurrency = user_concurrency
+        self.age_boost = age_boost
+        self.deadline_slack = deadline_slack
+        self._pending = []
+        # Guards the pending list and everything the scheduler keeps per owner
+        self._schedule = threading.Condition()
+        self._sequence = itertools.count(1)
+        self._served = defaultdict(float)  # owner -> images taken so far (virtual finish time)
+        self._virtual_time = 0.0  # service level of the most recently scheduled owner
+        self._running_by_owner = Counter()
+        self._running = {}  # worker thread -> (started at, batch)
+        self._durations = defaultdict(lambda: deque(maxlen=max(1, history)))  # mode -> seconds per image
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._batch_sizes = Counter()
+        self._live = set()  # submitted jobs whose on_done has not run yet
+
+    def start(self):
+        with self._start_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f"sketch-generation-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job, block=False):
+        """Queue a job; unless `block` is set, raises QueueFull when the queue is at capacity."""
+        self.start()
+        with self._schedule:
+            while len(self._pending) >= self.maxsize:
+                if not block:
+                    with self._stats_lock:
+                        self._rejected += 1
+                    raise QueueFull("Generation queue is full, please try again in a few minutes.")
+                self._schedule.wait()
+            if not self._is_active(job.owner):
+                self._served[job.owner] = max(self._served[job.owner], self._virtual_time)
+            job._sequence = next(self._sequence)
+            with self._stats_lock:
+                self._live.add(job)
+                self._submitted += 1
+            self._pending.append(job)
+            self._schedule.notify_all()
+        return job
+
+    def cancel(self, predicate):
+        """
+        Cancel every queued or running job for which `predicate(job)` is true; returns how
+        many. Queued jobs never reach the handler; a running batch stops at its next
+        denoising step once all of its jobs are cancelled.
+        """
+        with self._stats_lock:
+            matches = [job for job in self._live if not job.cancelled and predicate(job)]
+        for job in matches:
+            job.cancel()
+        return len(matches)
+
+    def reprioritize(self, predicate, priority):
+        """Move every queued job for which `predicate(job)` is true to tier `priority`; returns how many."""
+        with self._schedule:
+            matches = [job for job in self._pending if predicate(job)]
+            for job in matches:
+                job.priority = priority
+        return len(matches)
+
+    def estimates(self, now=None):
+        """
+        {queued job: (position, estimated start time)}. Running batches finish after the
+        recent average seconds per image of their mode; queued jobs then go, in today's
+        scheduling order, to whichever worker frees up first. Start times are None until a
+        job of some mode has finished.
+        """
+        now = now or time.time()
+        with self._schedule:
+            queued = self._schedule_order(now)
+            running = list(self._running.values())
+            per_image = {mode: sum(times) / len(times) for mode, times in self._durations.items() if times}
+        fallback = sum(per_image.values()) / len(per_image) if per_image else None
+
+        def cost(job):
+            seconds = per_image.get(job.options.get('mode'), fallback)
+            return None if seconds is None else seconds * job.size
+
+        free_at = [now] * self.workers
+        for slot, (started, batch) in enumerate(running[:self.workers]):
+            costs = [cost(job) for job in batch]
+            free_at[slot] = max(now, started + sum(costs)) if None not in costs else now
+        result = {}
+        for position, job in enumerate(queued, 1):
+            seconds = cost(job)
+            if seconds is None:
+                result[job] = (position, None)
+                continue
+            slot = free_at.index(min(free_at))
+            result[job] = (position, free_at[slot])
+            free_at[slot] += seconds
+        return result
+
+    def estimate(self, predicate):
+        """(queue position, estimated start time) of the first queued job matching `predicate`, or None."""
+        for job, estimate in self.estimates().items():
+            if predicate(job):
+                return estimate
+        return None
+
+    def stats(self):
+        with self._schedule:
+            queued_by_owner = Counter(str(job.owner) for job in self._pending)
+            queued_by_priority = Counter(str(job.priority) for job in self._pending)
+            running_by_owner = {str(owner): count for owner, count in self._running_by_owner.items() if count}
+            seconds_per_image = {str(mode): round(sum(times) / len(times), 3)
+                                 for mode, times in self._durations.items() if times}
+            depth = len(self._pending)
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            images_batched = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                'queue_depth': depth,
+                'queue_capacity': self.maxsize,
+                'max_batch': self.max_batch,
+                'workers': self.workers,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'failed': self._failed,
+                'cancelled': self._cancelled,
+                'batches': batches,
+                'avg_batch_size': round(images_batched / batches, 2) if batches else 0.0,
+                'batch_sizes': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'queued_by_owner': dict(queued_by_owner),
+                'queued_by_priority': dict(queued_by_priority),
+                'running_by_owner': running_by_owner,
+                'seconds_per_image': seconds_per_image,
+            }
+
+    def _is_active(self, owner):
+        return self._running_by_owner[owner] > 0 or any(job.owner == owner for job in self._pending)
+
+    def _rank(self, job, now, served=None):
+        tier = job.priority
+        if self.age_boost:
+            tier += int((now - job.submitted_at) // self.age_boost)
+        if job.deadline is not None and job.deadline - now <= self.deadline_slack:
+            tier += DEADLINE_BOOST
+        return (-tier, (served or self._served)[job.owner], job._sequence)
+
+    def _schedule_order(self, now):
+        """Pending jobs in the order _take would hand them out (quotas and batching aside)."""
+        served = defaultdict(float, self._served)
+        pending = list(self._pending)
+        order = []
+        while pending:
+            job = min(pending, key=lambda job: self._rank(job, now, served))
+            pending.remove(job)
+            served[job.owner] += job.size
+            order.append(job)
+        return order
+
+    def _take(self, fits=None):
+        """Remove and return the best-ranked pending job (that `fits`), charging its owner; None if there is none."""
+        candidates = [job for job in self._pending if fits is None or fits(job)]
+        if self.user_concurrency:
+            candidates = [job for job in candidates
+                          if self._running_by_owner[job.owner] < self.user_concurrency] or candidates
+        if not candidates:
+            return None
+        now = time.time()
+        job = min(candidates, key=lambda job: self._rank(job, now))
+        self._pending.remove(job)
+        self._virtual_time = max(self._virtual_time, self._served[job.owner])
+        self._served[job.owner] += job.size
+        self._running_by_owner[job.owner] += 1
+        return job
+
+    def _collect_batch(self):
+        # One worker collects at a time, so a batch filling up is not raided by another worker
+        with self._collect_lock:
+            return self._collect_batch_locked()
+
+    def _collect_batch_locked(self):
+        with self._schedule:
+            while not self._pending:
+                self._schedule.wait()
+            first = self._take()
+            batch = [first]
+            images = first.size
+            deadline = time.time() + self.batch_wait
+            while images < self.max_batch:
+                job = self._take(lambda job: job.batch_key == first.batch_key and images + job.size <= self.max_batch)
+                if job is not None:
+                    batch.append(job)
+                    images += job.size
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._schedule.wait(remaining)
+            # Wake submitters blocked on a full queue
+            self._schedule.notify_all()
+        return batch
+
+    def _finish(self, job, saved):
+        with self._stats_lock:
+            if job.cancelled:
+                self._cancelled += 1
+            elif any(saved):
+                self._completed += 1
+            else:
+                self._failed += 1
+        if job.on_done is not None:
+            try:
+                job.on_done(job, saved)
+            except Exception as e:
+                print(f"[ERROR] Generation job callback error: {e}")
+        with self._stats_lock:
+            self._live.discard(job)
+        with self._schedule:
+            self._running_by_owner[job.owner] -= 1
+            if self._running_by_owner[job.owner] <= 0:
+                del self._running_by_owner[job.owner]
+
+    def _run(self):
+        if self.warmup is not None:
+            try:
+                self.warmup()
+            except Exception as e:
+                print(f"[ERROR] Generation worker warm-up failed: {e}")
+        while True:
+            batch = []
+            for job in self._collect_batch():
+                if job.cancelled:
+                    self._finish(job, [None] * job.size)
+                else:
+                    batch.append(job)
+            if not batch:
+                continue
+            now = time.time()
+            for job in batch:
+                observe_stage('queue_wait', now - job.submitted_at, job.options.get('mode', ''))
+                if job.on_start is not None:
+                    try:
+                        job.on_start(job)
+                    except Exception as e:
+                        print(f"[ERROR] Generation job start callback error: {e}")
+            # Multi-candidate jobs contribute one prompt per output to the pipeline call
+            images = sum(job.size for job in batch)
+            started = time.time()
+            with self._schedule:
+                self._running[threading.current_thread()] = (started, batch)
+            try:
+                options = dict(batch[0].options)
+                if batch[0].init_image is not None:
+                    options['init_images'] = [job.init_image for job in batch for _ in job.output_paths]
+                    options['adjustments'] = [job.adjustment for job in batch for _ in job.output_paths]
+                results = self.handler(
+                    [job.prompt for job in batch for _ in job.output_paths],
+                    [path for job in batch for path in job.output_paths],
+                    seeds=[seed for job in batch for seed in job.seeds],
+                    progress=BatchProgress(batch),
+                    **options
+                )
+            except Exception as e:
+                print(f"[ERROR] Generation worker batch error: {e}")
+                for job in batch:
+                    job.error = str(e)
+                results = [None] * images
+
+            with self._stats_lock:
+                self._batch_sizes[images] += 1
+            with self._schedule:
+                self._running.pop(threading.current_thread(), None)
+                if any(results):
+                    self._durations[batch[0].options.get('mode')].append((time.time() - started) / images)
+
+            offset = 0
+            for job in batch:
+                self._finish(job, list(results[offset:offset + job.size]))
+                offset += job.size
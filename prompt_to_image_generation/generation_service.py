@@ -0,0 +1,259 @@
+import itertools
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import queue
+import threading
+import time
+
+from metrics import merge_samples, observe_stage, process_memory, take_samples
+
+# How often a waiting dispatcher forwards cancellations and checks that its worker process is still alive
+_POLL_INTERVAL = 0.5
+
+
+def default_threads_per_worker(workers):
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, cores // max(1, workers))
+
+
+class _WorkerProgress:
+    """BatchProgress stand-in inside a worker: previews go back over `results`, cancellations arrive on `control`."""
+
+    def __init__(self, batch_id, preview_indexes, results, control):
+        self.batch_id = batch_id
+        self.preview_indexes = preview_indexes
+        self._results = results
+        self._control = control
+        self._cancelled = set()
+
+    def preview(self, index, step, steps, image):
+        self._results.put(('preview', self.batch_id, index, step, steps, image))
+
+    def cancelled(self):
+        while True:
+            try:
+                batch_id, indexes = self._control.get_nowait()
+            except queue.Empty:
+                break
+            if batch_id == self.batch_id:  # late messages for an earlier batch are dropped
+                self._cancelled.update(indexes)
+        return sorted(self._cancelled)
+
+
+def _worker_main(index, threads, jobs, results, control):
+    """
+    Generation process: owns one pipeline sized to `threads` cores and renders batches from
+    `jobs`. A worker forked from the fork server finds the pipeline it preloaded; a spawned one loads its own.
+    """
+    # Must be set before torch is imported so OpenMP/MKL size their pools to this worker's share
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+
+    from config import Config
+    Config.TORCH_THREADS = threads
+    import image_generator
+
+    start = time.perf_counter()
+    try:
+        image_generator.configure_cpu_threads()
+        image_generator.load_model()
+        state = dict(image_generator.model_state(), worker_load_seconds=round(time.perf_counter() - start, 3))
+        results.put(('ready', index, image_generator.get_device(), state))
+    except Exception as e:
+        results.put(('failed', index, None, image_generator.model_state()))
+        print(f"[ERROR] Generation worker {index} could not load the model: {e}")
+    results.put(('metrics', take_samples()))
+
+    while True:
+        message = jobs.get()
+        if message is None:
+            break
+        prompts, output_paths, options, batch_id, preview_indexes = message
+        progress = _WorkerProgress(batch_id, preview_indexes, results, control)
+        try:
+            saved = image_generator.generate_batch(prompts, output_paths, progress=progress, **options)
+            reply = ('done', saved, None)
+        except Exception as e:
+            reply = ('done', [None] * len(prompts), str(e))
+        # Stage timings are recorded here but exposed by the web process's /metrics
+        results.put(('metrics', take_samples()))
+        results.put(('memory', index, process_memory()))
+        results.put(reply)
+
+
+class _Worker:
+    def __init__(self, ctx, index, threads, on_state, on_memory):
+        self.index = index
+        self.threads = threads
+        self.jobs = ctx.Queue()
+        self.results = ctx.Queue()
+        self.control = ctx.Queue()
+        self.replies = queue.Queue()
+        # BatchProgress of the batch this worker is rendering, for routing its previews
+        self.batch = (None, None)
+        self.started = time.perf_counter()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(index, threads, self.jobs, self.results, self.control),
+            name=f"sketch-generation-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        # Drain the result pipe on a thread so load-state messages are seen even while idle
+        self._on_state = on_state
+        self._on_memory = on_memory
+        threading.Thread(target=self._read_results, name=f"sketch-generation-{index}-results", daemon=True).start()
+
+    def _read_results(self):
+        while True:
+            try:
+                message = self.results.get()
+            except (EOFError, OSError):
+                return
+            if message[0] in ('ready', 'failed'):
+                _, index, device, state = message
+                state['ready_seconds'] = round(time.perf_counter() - self.started, 3)
+                self._on_state(index, device, state)
+            elif message[0] == 'metrics':
+                merge_samples(message[1])
+            elif message[0] == 'memory':
+                self._on_memory(message[1], message[2])
+            elif message[0] == 'preview':
+                _, batch_id, index, step, steps, image = message
+                current_id, progress = self.batch
+                if batch_id == current_id and progress is not None:
+                    progress.preview(index, step, steps, image)
+            else:
+                self.replies.put(message)
+
+
+class ProcessGenerationPool:
+    """
+    Generation service made of N worker processes, each with its own pipeline.
+
+    Use an instance as the GenerationQueue handler with `workers=N`: every call takes an
+    idle process, sends it the batch and blocks until the process has written the images
+    to their output paths. Only prompts and file paths cross the process boundary, plus
+    latent previews on the way back and cancelled image indexes on the way in.
+
+    With `share_model` (where fork exists), the model is loaded once in a fork server (a
+    helper process that imports worker_preload before it has any threads) and the workers,
+    including restarted ones, are forked from it: they start in milliseconds and share the
+    weights' pages (memory-mapped with MODEL_LOADING=mmap, copy-on-write otherwise) instead
+    of each holding a copy. This process is never forked itself: by then it runs the queue,
+    import and export threads, and a child could inherit a lock one of them holds.
+    Otherwise workers are spawned fresh and load their own.
+    """
+
+    def __init__(self, workers=1, threads_per_worker=0, share_model=False):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(self.workers)
+        self.device = None
+        self.share_model = share_model and "forkserver" in multiprocessing.get_all_start_methods()
+        if share_model and not self.share_model:
+            print("[WARN] Worker processes cannot be forked here; each loads its own copy of the model")
+        self._ctx = multiprocessing.get_context("forkserver" if self.share_model else "spawn")
+        self._start_lock = threading.Lock()
+        self._pool = None
+        self._idle = queue.Queue()
+        self._states = {}
+        self._batch_ids = itertools.count(1)
+
+    def start(self):
+        """Spawn the worker processes (idempotent)."""
+        with self._start_lock:
+            if self._pool is not None:
+                return
+            for i in range(self.workers):
+                self._states[i] = {'state': 'loading'}
+            if self.share_model:
+                # The server loads the model as it starts; the first worker waits for it
+                self._ctx.set_forkserver_preload(["worker_preload"])
+                multiprocessing.forkserver.ensure_running()
+            self._pool = [self._new_worker(i) for i in range(self.workers)]
+            for worker in self._pool:
+                self._idle.put(worker)
+            print(f"[INFO] Started {self.workers} generation worker process(es), "
+                  f"{self.threads_per_worker} torch thread(s) each")
+
+    def shutdown(self, timeout=10):
+        """Ask every worker process to exit and wait for it."""
+        with self._start_lock:
+            pool, self._pool = self._pool, None
+            self._idle = queue.Queue()
+        for worker in pool or []:
+            worker.jobs.put(None)
+        for worker in pool or []:
+            worker.process.join(timeout)
+
+    def _new_worker(self, index):
+        return _Worker(self._ctx, index, self.threads_per_worker, self._set_state, self._set_memory)
+
+    def _set_state(self, index, device, state):
+        self._states[index] = state
+        self.device = device or self.device
+
+    def _set_memory(self, index, memory):
+        self._states[index] = dict(self._states.get(index, {}), memory=memory)
+
+    def model_state(self):
+        states = [self._states.get(i, {'state': 'not_loaded'}) for i in range(self.workers)]
+        ready = sum(1 for s in states if s['state'] == 'ready')
+        if ready == self.workers:
+            overall = 'ready'
+        elif any(s['state'] == 'failed' for s in states):
+            overall = 'failed'
+        elif self._pool is None:
+            overall = 'not_loaded'
+        else:
+            overall = 'loading'
+        memory = [s.get('memory') or {} for s in states]
+        return {'state': overall, 'workers': self.workers, 'workers_ready': ready,
+                'threads_per_worker': self.threads_per_worker, 'device': self.device,
+                'shared_model': self.share_model,
+                'memory': dict(process_memory(), **{
+                    f'workers_{key}': round(sum(m.get(key, 0) for m in memory), 1)
+                    for key in ('rss_mb', 'pss_mb', 'shared_mb', 'private_mb')
+                }),
+                'per_worker': states}
+
+    def _restart(self, worker):
+        print(f"[ERROR] Generation worker {worker.index} died (exit code {worker.process.exitcode}); restarting.")
+        self._states[worker.index] = {'state': 'loading'}
+        replacement = self._new_worker(worker.index)
+        self._pool[worker.index] = replacement
+        return replacement
+
+    def __call__(self, prompts, output_paths, progress=None, **options):
+        self.start()
+        start = time.perf_counter()
+        worker = self._idle.get()
+        observe_stage('worker_wait', time.perf_counter() - start, options.get('mode', ''))
+        batch_id = next(self._batch_ids)
+        worker.batch = (batch_id, progress)
+        forwarded = set()
+        try:
+            preview_indexes = list(progress.preview_indexes) if progress is not None else []
+            worker.jobs.put((list(prompts), list(output_paths), options, batch_id, preview_indexes))
+            while True:
+                try:
+                    _, saved, error = worker.replies.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    if not worker.process.is_alive():
+                        worker = self._restart(worker)
+                        raise RuntimeError("Generation worker process died mid-batch.")
+                    cancelled = set(progress.cancelled()) - forwarded if progress is not None else set()
+                    if cancelled:
+                        worker.control.put((batch_id, sorted(cancelled)))
+                        forwarded |= cancelled
+                    continue
+                if error:
+                    raise RuntimeError(error)
+                return saved
+        finally:
+            worker.batch = (None, None)
+            self._idle.put(worker)
@@ -1,44 +1,397 @@
-from diffusers import StableDiffusionPipeline  # NOT StableDiffusionXLPipeline for dreamlike-anime-1.0
-import torch
+# torch and diffusers are imported lazily inside the functions that need them, so web
+# processes that never render a sketch start in well under a second.
+import numpy as np
 from PIL import Image, ImageOps, ImageFilter
 from functools import lru_cache
+import hashlib
+import json
+import mmap
 import os
+import struct
+import threading
 import time
+import warnings
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"[INFO] Using device: {DEVICE}")
+from config import Config
+from derivatives import make_derivatives
+from image_store import default_store, file_digest
+from latent_preview import encode_preview
+from metrics import observe_stage, process_memory, profile as profiled, stage_timer
+from prompt_builder import build_prompt
+from result_cache import ResultCache, make_cache_key, normalize_prompt
+from sketch_filter import sketch_batch
 
-_PIPE = None
+MODEL_ID = "dreamlike-art/dreamlike-anime-1.0"
+# safetensors file of each pipeline component, within the model repository
+WEIGHT_FILES = {
+    "unet": "unet/diffusion_pytorch_model.safetensors",
+    "vae": "vae/diffusion_pytorch_model.safetensors",
+    "text_encoder": "text_encoder/model.safetensors",
+}
+
+GUIDANCE_SCALE = 8.0
+IMAGE_SIZE = 512
+
+# Per-request generation modes; all share guidance and output size. Drafts render at `size`
+# and are upscaled to IMAGE_SIZE, for fast iteration before finalizing in a full-size mode.
+GENERATION_MODES = {
+    "standard": {
+        "label": "Standard quality (28 steps)",
+        "scheduler": "default",
+        "steps": 28,
+        "quantize": False,
+        "size": IMAGE_SIZE,
+        "draft": False,
+    },
+    "cpu_fast": {
+        "label": "CPU fast (DPM-Solver, 12 steps)",
+        "scheduler": "dpm_multistep",
+        "steps": 12,
+        "quantize": False,
+        "size": IMAGE_SIZE,
+        "draft": False,
+    },
+    "cpu_fast_int8": {
+        "label": "CPU fast + int8 (DPM-Solver, 12 steps, quantized)",
+        "scheduler": "dpm_multistep",
+        "steps": 12,
+        "quantize": True,
+        "size": IMAGE_SIZE,
+        "draft": False,
+    },
+    "draft": {
+        "label": f"Draft ({Config.DRAFT_SIZE}px, DPM-Solver, {Config.DRAFT_STEPS} steps, finalize later)",
+        "scheduler": "dpm_multistep",
+        "steps": Config.DRAFT_STEPS,
+        "quantize": False,
+        "size": Config.DRAFT_SIZE,
+        "draft": True,
+    },
+}
+DEFAULT_MODE = Config.GENERATION_MODE if Config.GENERATION_MODE in GENERATION_MODES else "standard"
+# Mode a draft is finalized in: the configured default, unless that is itself a draft mode
+FINAL_MODE = "standard" if GENERATION_MODES[DEFAULT_MODE]["draft"] else DEFAULT_MODE
+
+# Finished sketches keyed by every generation parameter, so resubmitted descriptions skip the pipeline
+RESULT_CACHE = ResultCache(Config.RESULT_CACHE_DIR, Config.RESULT_CACHE_MAX_MB * 1024 * 1024)
+
+# Text-encoder outputs per loaded pipeline (keyed by id), reused across requests
+_EMBEDDING_CACHES = {}
+
+# Load progress reported by model_state() for the readiness endpoint
+_MODEL_STATE = {"state": "not_loaded", "error": None, "load_seconds": None, "modes": []}
+_MODEL_STATE_LOCK = threading.Lock()
+# Mode of the batch the current thread is rendering, for timings taken inside the pipeline
+_ACTIVE = threading.local()
+
+class GenerationCancelled(Exception):
+    """Raised from the step callback once every image in the batch has been cancelled."""
+
+def resolve_mode(mode):
+    return mode if mode in GENERATION_MODES else DEFAULT_MODE
+
+def stub_pipeline_enabled():
+    """SKETCH_PIPELINE=stub swaps the model for stub_pipeline.StubPipeline (benchmarks, no download)."""
+    return Config.SKETCH_PIPELINE == "stub"
 
 @lru_cache(maxsize=1)
-def load_model():
+def get_device():
+    if stub_pipeline_enabled():
+        return "cpu"
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"[INFO] Using device: {device}")
+    return device
+
+def _set_model_state(**changes):
+    with _MODEL_STATE_LOCK:
+        _MODEL_STATE.update(changes)
+
+def model_state():
+    """Snapshot of model loading (not_loaded, loading, ready or failed) and this process's memory."""
+    with _MODEL_STATE_LOCK:
+        state = dict(_MODEL_STATE, modes=list(_MODEL_STATE["modes"]))
+    state["memory"] = process_memory()
+    return state
+
+def mmap_safetensors(path):
+    """
+    {name: tensor} viewing a .safetensors file through a private (copy-on-write) memory map:
+    pages are read on first use, never written back, and shared by every process mapping
+    the file until one of them modifies a page.
+    """
+    import torch
+    dtypes = {
+        "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+        "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+        "BOOL": torch.bool,
+    }
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = dtypes[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # torch warns about sharing non-owned memory
+            tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=base + start)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+def _map_weights(pipe):
+    """
+    Point the pipeline's unet, VAE and text encoder at memory-mapped safetensors weights in
+    the Hugging Face cache, dropping the copies from_pretrained read. Tensors whose dtype or
+    shape differ from the file keep their copy. Returns the bytes now mapped.
+    """
+    from huggingface_hub import try_to_load_from_cache
+
+    mapped = 0
+    for name, filename in WEIGHT_FILES.items():
+        module = pipe.components.get(name)
+        path = try_to_load_from_cache(MODEL_ID, filename)
+        if module is None or not isinstance(path, str):
+            print(f"[WARN] No cached {filename}; {name} weights stay copied into memory")
+            continue
+        current = module.state_dict()
+        weights = {
+            key: tensor for key, tensor in mmap_safetensors(path).items()
+            if key in current and current[key].dtype == tensor.dtype and current[key].shape == tensor.shape
+        }
+        module.load_state_dict(weights, strict=False, assign=True)
+        mapped += sum(tensor.numel() * tensor.element_size() for tensor in weights.values())
+    return mapped
+
+def preload_shared_model(modes=()):
+    """
+    Load the model (DEFAULT_MODE's pipeline, or each of `modes`) in a process about to fork
+    generation workers, which then inherit it instead of loading their own. torch stays on
+    one thread here: an OpenMP pool started before the fork would hang the children, which
+    size their own pool when they warm up.
+    """
+    threads, Config.TORCH_THREADS = Config.TORCH_THREADS, 1
+    try:
+        if not stub_pipeline_enabled():
+            import torch
+            torch.set_num_threads(1)
+        for mode in modes or (DEFAULT_MODE,):
+            load_model(mode)
+    finally:
+        Config.TORCH_THREADS = threads
+
+def warm_up():
+    """Generation thread warm-up: size torch's thread pool, then load the default pipeline."""
+    configure_cpu_threads()
+    load_model()
+
+@lru_cache(maxsize=1)
+def load_base_model():
     """Loads and caches the Stable Diffusion pipeline for forensic sketch generation."""
-    global _PIPE
-    if _PIPE is not None:
-        return _PIPE
+    _set_model_state(state="loading", error=None)
+    if stub_pipeline_enabled():
+        from stub_pipeline import StubPipeline
+        print("[MODEL] Using the stub pipeline (SKETCH_PIPELINE=stub); images are not real sketches")
+        _set_model_state(state="ready", load_seconds=0.0)
+        return StubPipeline(step_seconds=Config.STUB_STEP_SECONDS)
 
-    # Dreamlike anime 1.0 is an SD 1.5 model (not SDXL), so use StableDiffusionPipeline
-    model_id = "dreamlike-art/dreamlike-anime-1.0"
     print("[MODEL] Loading Stable Diffusion pipeline ...")
     start = time.time()
     try:
+        import torch
+        from diffusers import StableDiffusionPipeline  # NOT StableDiffusionXLPipeline for dreamlike-anime-1.0
+
+        # Dreamlike anime 1.0 is an SD 1.5 model (not SDXL), so use StableDiffusionPipeline
+        device = get_device()
         pipe = StableDiffusionPipeline.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16 if DEVICE == "cuda" else torch.float32
+            MODEL_ID,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32
         )
-        if DEVICE == "cuda":
+        if device == "cuda":
             pipe = pipe.to("cuda")
             pipe.enable_xformers_memory_efficient_attention()
             pipe.enable_attention_slicing()
         else:
             pipe = pipe.to("cpu")
-        _PIPE = pipe
-        print(f"[MODEL] Model loaded in {time.time() - start:.2f}s")
+            if Config.MODEL_LOADING == "mmap":
+                mapped = _map_weights(pipe)
+                print(f"[MODEL] {mapped / 2**20:.0f} MB of weights memory-mapped from safetensors")
+            else:
+                # channels_last suits oneDNN's CPU convolutions. Every mode (standard included) shares
+                # these modules, so the layout is set once here rather than whenever a fast mode is
+                # built; not with mmap, where converting would copy the mapped conv weights
+                pipe.unet.to(memory_format=torch.channels_last)
+                pipe.vae.to(memory_format=torch.channels_last)
+        if Config.MODEL_LOADING == "mmap" and device == "cuda":
+            print("[WARN] MODEL_LOADING=mmap only applies on CPU; weights were copied to the GPU")
+        elapsed = time.time() - start
+        observe_stage("model_load", elapsed)
+        _set_model_state(state="ready", load_seconds=round(elapsed, 2))
+        print(f"[MODEL] Model loaded in {elapsed:.2f}s")
         return pipe
     except Exception as e:
+        _set_model_state(state="failed", error=str(e))
         print(f"[ERROR] Failed to load SD pipeline: {e}")
         raise
 
+def configure_cpu_threads():
+    """Size torch's intra-op thread pool to the cores this process may run on."""
+    if stub_pipeline_enabled():
+        return
+    import torch
+    threads = Config.TORCH_THREADS
+    if not threads:
+        try:
+            threads = len(os.sched_getaffinity(0))
+        except AttributeError:
+            threads = os.cpu_count() or 1
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+        print(f"[MODEL] torch using {threads} CPU thread(s)")
+
+def _sync():
+    """Wait for queued GPU work, so stage timings measure execution rather than kernel launches."""
+    if stub_pipeline_enabled():
+        return
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def _instrument_vae(pipe):
+    """Time VAE encode/decode with forward hooks; installed once per module since modes share the VAE."""
+    for module, stage in ((pipe.vae.encoder, "vae_encode"), (pipe.vae.decoder, "vae_decode")):
+        if getattr(module, "_stage_timed", False):
+            continue
+        module._stage_timed = True
+
+        def before(mod, args):
+            _sync()
+            mod._stage_start = time.perf_counter()
+
+        def after(mod, args, output, stage=stage):
+            _sync()
+            observe_stage(stage, time.perf_counter() - mod._stage_start, getattr(_ACTIVE, "mode", ""))
+
+        module.register_forward_pre_hook(before)
+        module.register_forward_hook(after)
+
+def _step_callback(mode, steps, progress=None, pending=()):
+    """
+    callback_on_step_end that records each denoising step as a `denoise_step` sample and,
+    given the batch's `progress`, streams latent previews every PREVIEW_EVERY_STEPS steps
+    and stops the pipeline once all `pending` images (by batch index) are cancelled.
+    """
+    last = [time.perf_counter()]
+    every = Config.PREVIEW_EVERY_STEPS
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        _sync()
+        now = time.perf_counter()
+        observe_stage("denoise_step", now - last[0], mode)
+        last[0] = now
+        if progress is None:
+            return callback_kwargs
+
+        cancelled = set(progress.cancelled())
+        if cancelled.issuperset(pending):
+            raise GenerationCancelled(f"cancelled after step {step + 1} of {steps}")
+        latents = callback_kwargs.get("latents")
+        if every and latents is not None and (step + 1) % every == 0 and step + 1 < steps:
+            with stage_timer("preview", mode):
+                # Row of each image in the pipeline's latents = its position among the pending images
+                for row, index in enumerate(pending):
+                    if index in progress.preview_indexes and index not in cancelled:
+                        progress.preview(index, step + 1, steps, encode_preview(latents[row]))
+        return callback_kwargs
+    return on_step_end
+
+@lru_cache(maxsize=None)
+def _load_mode_pipeline(mode):
+    pipe = _build_mode_pipeline(mode)
+    if not stub_pipeline_enabled():
+        _instrument_vae(pipe)
+    with _MODEL_STATE_LOCK:
+        _MODEL_STATE["modes"].append(mode)
+    return pipe
+
+def _build_mode_pipeline(mode):
+    settings = GENERATION_MODES[mode]
+    base = load_base_model()
+    if (settings["scheduler"] == "default" and not settings["quantize"]) or stub_pipeline_enabled():
+        return base
+
+    import torch
+    from diffusers import StableDiffusionPipeline
+
+    start = time.time()
+    # Reuse the loaded weights; only the scheduler (and quantized copies, if asked) differ
+    components = dict(base.components)
+    if settings["scheduler"] == "dpm_multistep":
+        from diffusers import DPMSolverMultistepScheduler
+        components["scheduler"] = DPMSolverMultistepScheduler.from_config(base.scheduler.config)
+
+    device = get_device()
+    if device == "cpu":
+        configure_cpu_threads()
+        if settings["quantize"]:
+            # Dynamic int8 for the Linear layers (attention/MLP); convolutions stay float32. These are
+            # copies: the float32 originals stay loaded for the other modes (see GENERATION_MODE)
+            components["unet"] = torch.ao.quantization.quantize_dynamic(
+                components["unet"], {torch.nn.Linear}, dtype=torch.qint8
+            )
+            components["text_encoder"] = torch.ao.quantization.quantize_dynamic(
+                components["text_encoder"], {torch.nn.Linear}, dtype=torch.qint8
+            )
+    elif settings["quantize"]:
+        print(f"[WARN] Dynamic int8 quantization is CPU-only; mode '{mode}' runs unquantized on {device}.")
+
+    pipe = StableDiffusionPipeline(**components)
+    print(f"[MODEL] Mode '{mode}' ready in {time.time() - start:.2f}s")
+    return pipe
+
+def load_model(mode=None):
+    """Pipeline configured for a generation mode (default: GENERATION_MODE from config)."""
+    return _load_mode_pipeline(resolve_mode(mode))
+
+@lru_cache(maxsize=None)
+def _load_img2img_pipeline(mode):
+    if stub_pipeline_enabled():
+        return load_model(mode)  # the stub does img2img when given an image
+    from diffusers import StableDiffusionImg2ImgPipeline
+
+    # Built from the text-to-image pipeline's modules: no second copy of the weights
+    return StableDiffusionImg2ImgPipeline(**load_model(mode).components)
+
+def load_img2img_model(mode=None):
+    """Image-to-image pipeline sharing weights and scheduler config with load_model(mode)."""
+    return _load_img2img_pipeline(resolve_mode(mode))
+
+def generation_metadata(prompt, mode=None, seed=None, device=None, **extra):
+    """Settings a sketch was rendered with, stored alongside the composite."""
+    mode = resolve_mode(mode)
+    settings = GENERATION_MODES[mode]
+    device = device or get_device()
+    return dict({
+        "mode": mode,
+        "model": "stub" if stub_pipeline_enabled() else MODEL_ID,
+        "scheduler": settings["scheduler"],
+        "steps": settings["steps"],
+        "quantized": settings["quantize"] and device == "cpu",
+        "guidance": GUIDANCE_SCALE,
+        "width": settings["size"],
+        "height": settings["size"],
+        "draft": settings["draft"],
+        "seed": default_seed(prompt) if seed is None else seed,
+    }, **extra)
+
 def truncate_prompt(prompt, max_tokens=75):
     """Ensures prompt fits token count limit (approximate; exact limit is 77 tokens for most SD1.5 pipelines)."""
     words = prompt.split()
@@ -61,53 +414,337 @@ def convert_to_sketch(image, threshold=185):
         print(f"[ERROR] Sketch postprocessing failed: {e}")
         return image
 
-def generate_sketch_image(prompt, output_path, enhance_sketch=True, threshold=185):
+def convert_to_sketch_batch(images, threshold=185):
     """
-    Generate a forensic-style sketch from a text prompt and save it.
-    Returns output_path on success; None on failure.
+    Same output as convert_to_sketch for a list of images, computed in one vectorized pass.
+    Returns single-channel ("L") images since the result is monochrome anyway.
+    """
+    try:
+        # PIL's C luma conversion is the cheapest way to get the (N, H, W) grayscale stack
+        batch = np.stack([np.asarray(image.convert("L")) for image in images])
+        return [Image.fromarray(sketch) for sketch in sketch_batch(batch, threshold=threshold)]
+    except Exception as e:
+        print(f"[ERROR] Sketch postprocessing failed: {e}")
+        return images
+
+NEGATIVE_PROMPT = (
+    "photo, photorealistic, painting, colorful, color, shadow, shading, 3d, blur, cartoon, anime, watermark, logo, text, background"
+)
+
+def build_full_prompt(prompt, tokenizer=None, adjustment=None):
+    """
+    Wrap a suspect description in the line-art style prompt used for every sketch. A
+    revision's `adjustment` (already at the head of its prompt) is kept ahead of the rest.
+    """
+    if tokenizer is not None:
+        # Exact CLIP token budget, keeping the adjustment and face features ahead of style boilerplate
+        return build_prompt(tokenizer, prompt, adjustment)
+
+    # Truncate prompt to avoid tokenizer/indexing errors
+    base_prompt = truncate_prompt(prompt, max_tokens=55)
+    # Compose a full prompt suitable for line-art
+    full_prompt = (
+        f"highly detailed police composite sketch, {base_prompt}, "
+        "black and white pencil line drawing, front view, clean strong lines, sharp contours, forensic sketch, solid black outlines, no shading, white background"
+    )
+    # Final safety truncation to prevent over-length
+    return truncate_prompt(full_prompt, max_tokens=75)
+
+def get_embedding_cache(pipe):
+    cache = _EMBEDDING_CACHES.get(id(pipe))
+    if cache is None:
+        if stub_pipeline_enabled():
+            from stub_pipeline import StubEmbeddingCache as PromptEmbeddingCache
+        else:
+            from embedding_cache import PromptEmbeddingCache  # imports torch
+        cache = _EMBEDDING_CACHES[id(pipe)] = PromptEmbeddingCache(pipe, maxsize=Config.EMBEDDING_CACHE_SIZE)
+    return cache
+
+def make_generators(seeds):
+    """One seeded RNG per image, so each image's noise is independent of the rest of the batch."""
+    if stub_pipeline_enabled():
+        from stub_pipeline import make_generators as make_stub_generators
+        return make_stub_generators(seeds)
+    import torch
+    return [torch.Generator(device=get_device()).manual_seed(seed) for seed in seeds]
+
+def draft_latents(seeds, size, pipe):
+    """
+    Starting noise for rendering at `size` px: the seeded noise a full IMAGE_SIZE render starts
+    from, area-downsampled and rescaled to unit variance. A draft and its finalized render then
+    share the seed's low frequencies, i.e. its composition.
+    """
+    if stub_pipeline_enabled():
+        from stub_pipeline import draft_latents as stub_draft_latents
+        return stub_draft_latents(seeds, IMAGE_SIZE, size)
+    import torch
+    import torch.nn.functional as F
+    full, small = IMAGE_SIZE // 8, size // 8
+    # Drawn like diffusers' randn_tensor: one (1, 4, h, w) tensor per image from its own generator
+    noise = torch.cat([
+        torch.randn((1, 4, full, full), generator=generator, device=generator.device, dtype=torch.float32)
+        for generator in make_generators(seeds)
+    ])
+    noise = F.adaptive_avg_pool2d(noise, small)
+    noise = noise / noise.std(dim=(1, 2, 3), keepdim=True)
+    return noise.to(device=pipe.device, dtype=pipe.unet.dtype)
+
+def upscale(images, mode):
+    """Bring images rendered below IMAGE_SIZE (drafts) up to it before the sketch filter."""
+    if all(image.size == (IMAGE_SIZE, IMAGE_SIZE) for image in images):
+        return images
+    with stage_timer("upscale", mode):
+        return [image.resize((IMAGE_SIZE, IMAGE_SIZE), Image.LANCZOS) for image in images]
+
+def embedding_cache_stats():
+    return [cache.stats() for cache in _EMBEDDING_CACHES.values()]
+
+def default_seed(prompt):
+    """Deterministic seed for a prompt, so identical descriptions render (and cache) identically."""
+    digest = hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16)
+
+def candidate_seeds(prompt, count):
+    """
+    Seeds for `count` alternative renders of one prompt: the prompt's default seed first
+    (so a single candidate matches a plain request), then seeds derived from it.
+    """
+    base = default_seed(prompt)
+    return [base] + [
+        int(hashlib.sha256(f"{base}:{i}".encode("utf-8")).hexdigest()[:8], 16) for i in range(1, count)
+    ]
+
+def resolve_seeds(prompts, seeds):
+    """Per-prompt seeds, with the prompt's default seed wherever none was given."""
+    seeds = seeds or [None] * len(prompts)
+    return [default_seed(p) if seed is None else seed for p, seed in zip(prompts, seeds)]
+
+def result_cache_key(prompt, seed, enhance_sketch, threshold, mode, **extra):
+    settings = GENERATION_MODES[mode]
+    if stub_pipeline_enabled():
+        extra["pipeline"] = "stub"  # stub images must never be served for real requests
+    return make_cache_key(
+        prompt=normalize_prompt(prompt),
+        negative_prompt=normalize_prompt(NEGATIVE_PROMPT),
+        seed=seed,
+        mode=mode,
+        scheduler=settings["scheduler"],
+        quantized=settings["quantize"],
+        steps=settings["steps"],
+        guidance=GUIDANCE_SCALE,
+        width=settings["size"],
+        height=settings["size"],
+        threshold=threshold if enhance_sketch else None,
+        **extra
+    )
+
+def _split_cached(keys, output_paths):
+    """Serve result-cache hits; returns (saved paths with hits filled in, indexes still to render)."""
+    saved = [None] * len(keys)
+    pending = []
+    for i, (key, output_path) in enumerate(zip(keys, output_paths)):
+        if RESULT_CACHE.get(key, output_path):
+            print(f"[GEN] Result cache hit: {output_path}")
+            saved[i] = output_path
+        else:
+            pending.append(i)
+    return saved, pending
+
+def _save_rendered(images, pending, saved, keys, output_paths, enhance_sketch, threshold, mode, progress=None):
+    if progress is not None:
+        # Jobs cancelled while the rest of their batch kept rendering are not saved
+        cancelled = set(progress.cancelled())
+        kept = [(i, image) for i, image in zip(pending, images) if i not in cancelled]
+        pending, images = [i for i, _ in kept], [image for _, image in kept]
+        if not pending:
+            return saved
+
+    if enhance_sketch:
+        with stage_timer("sketch_postprocess", mode):
+            images = convert_to_sketch_batch(images, threshold=threshold)
+
+    for i, image in zip(pending, images):
+        output_path = output_paths[i]
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with stage_timer("png_encode", mode):
+                image.save(output_path)
+            RESULT_CACHE.put(keys[i], output_path)
+            saved[i] = output_path
+        except Exception as e:
+            print(f"[ERROR] Saving sketch {output_path} failed: {e}")
+    return saved
+
+def generate_sketch_batch(prompts, output_paths, enhance_sketch=True, threshold=185, seeds=None, mode=None,
+                          progress=None):
+    """
+    Generate one sketch per prompt with a single pipeline call and save each to its output path.
+    All prompts share the same mode (scheduler/steps) and guidance/size; prompts already in the
+    result cache skip the pipeline. Returns a list with the saved path (or None on failure) for
+    every prompt, in order. Every image gets its own generator seeded from `seeds`, so its
+    starting noise does not depend on which other prompts share the call; the same prompt,
+    seed and mode re-render the same sketch. `progress` (a generation_queue.BatchProgress)
+    receives latent previews and can cancel the call between steps.
     """
     start = time.time()
+    mode = resolve_mode(mode)
+    seeds = resolve_seeds(prompts, seeds)
+    keys = [result_cache_key(p, seed, enhance_sketch, threshold, mode) for p, seed in zip(prompts, seeds)]
+
+    saved, pending = _split_cached(keys, output_paths)
+    if not pending:
+        return saved
+
     try:
-        pipe = load_model()
-        # Truncate prompt to avoid tokenizer/indexing errors
-        base_prompt = truncate_prompt(prompt, max_tokens=55)
-        # Compose a full prompt suitable for line-art
-        full_prompt = (
-            f"highly detailed police composite sketch, {base_prompt}, "
-            "black and white pencil line drawing, front view, clean strong lines, sharp contours, forensic sketch, solid black outlines, no shading, white background"
-        )
-        # Final safety truncation to prevent over-length
-        full_prompt = truncate_prompt(full_prompt, max_tokens=75)
+        pipe = load_model(mode)
+        full_prompts = [build_full_prompt(prompts[i], pipe.tokenizer) for i in pending]
+        for full_prompt in full_prompts:
+            print(f"[GEN] Generating from prompt: {full_prompt}")
 
-        negative_prompt = (
-            "photo, photorealistic, painting, colorful, color, shadow, shading, 3d, blur, cartoon, anime, watermark, logo, text, background"
+        embeddings = get_embedding_cache(pipe)
+        with stage_timer("text_encode", mode):
+            prompt_embeds = embeddings.prompts(full_prompts)
+            negative_embeds = embeddings.negative(NEGATIVE_PROMPT, len(full_prompts))
+        _ACTIVE.mode = mode
+        steps, size = GENERATION_MODES[mode]["steps"], GENERATION_MODES[mode]["size"]
+        extra = {}
+        if size != IMAGE_SIZE:
+            extra["latents"] = draft_latents([seeds[i] for i in pending], size, pipe)
+        result = pipe(
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_embeds,
+            num_inference_steps=steps,
+            guidance_scale=GUIDANCE_SCALE,
+            width=size,
+            height=size,
+            generator=make_generators([seeds[i] for i in pending]),
+            callback_on_step_end=_step_callback(mode, steps, progress, pending),
+            **extra
         )
-        print(f"[GEN] Generating from prompt: {full_prompt}")
+    except GenerationCancelled as e:
+        print(f"[GEN] Batch of {len(pending)} sketch(es) {e}")
+        return saved
+    except Exception as e:
+        print(f"[ERROR] Sketch generation failed: {e}")
+        return saved
+
+    _save_rendered(upscale(result.images, mode), pending, saved, keys, output_paths, enhance_sketch, threshold, mode,
+                   progress)
+    print(f"[GEN] Batch of {len(pending)} sketch(es) done in mode '{mode}' ({time.time() - start:.2f}s)")
+    return saved
+
+def generate_revision_batch(prompts, output_paths, init_images, enhance_sketch=True, threshold=185,
+                            seeds=None, mode=None, strength=None, progress=None, adjustments=None):
+    """
+    Revise existing sketches: img2img from each `init_images` path toward its prompt, whose
+    `adjustments` entry (the requested change) survives any truncation.
+    Only `strength` of the mode's denoising steps run, so a revision costs a fraction of
+    a fresh sketch. Same return contract as generate_sketch_batch.
+    """
+    start = time.time()
+    mode = resolve_mode(mode)
+    strength = Config.REVISION_STRENGTH if strength is None else strength
+    seeds = resolve_seeds(prompts, seeds)
+    keys = [
+        result_cache_key(p, seed, enhance_sketch, threshold, mode, init_image=file_digest(init), strength=strength)
+        for p, seed, init in zip(prompts, seeds, init_images)
+    ]
+
+    saved, pending = _split_cached(keys, output_paths)
+    if not pending:
+        return saved
 
+    try:
+        pipe = load_img2img_model(mode)
+        adjustments = adjustments or [None] * len(prompts)
+        full_prompts = [build_full_prompt(prompts[i], pipe.tokenizer, adjustments[i]) for i in pending]
+        for full_prompt in full_prompts:
+            print(f"[GEN] Revising toward prompt: {full_prompt}")
+
+        size = GENERATION_MODES[mode]["size"]
+        init = [Image.open(init_images[i]).convert("RGB").resize((size, size)) for i in pending]
+        # Same text encoder as the text-to-image pipeline, so share its embedding cache
+        embeddings = get_embedding_cache(load_model(mode))
+        with stage_timer("text_encode", mode):
+            prompt_embeds = embeddings.prompts(full_prompts)
+            negative_embeds = embeddings.negative(NEGATIVE_PROMPT, len(full_prompts))
+        _ACTIVE.mode = mode
+        steps = GENERATION_MODES[mode]["steps"]
         result = pipe(
-            prompt=full_prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=28,
-            guidance_scale=8.0,
-            width=512,
-            height=512
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_embeds,
+            image=init,
+            strength=strength,
+            num_inference_steps=steps,
+            guidance_scale=GUIDANCE_SCALE,
+            generator=make_generators([seeds[i] for i in pending]),
+            # img2img skips the first (1 - strength) of the schedule
+            callback_on_step_end=_step_callback(mode, max(1, int(steps * strength)), progress, pending),
         )
-        image = result.images[0]
+    except GenerationCancelled as e:
+        print(f"[GEN] Batch of {len(pending)} revision(s) {e}")
+        return saved
+    except Exception as e:
+        print(f"[ERROR] Sketch revision failed: {e}")
+        return saved
 
-        if enhance_sketch:
-            image = convert_to_sketch(image, threshold=threshold)
+    _save_rendered(upscale(result.images, mode), pending, saved, keys, output_paths, enhance_sketch, threshold, mode,
+                   progress)
+    print(f"[GEN] Batch of {len(pending)} revision(s) done in mode '{mode}' ({time.time() - start:.2f}s)")
+    return saved
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        image.save(output_path)
-        print(f"[GEN] Sketch saved: {output_path} ({time.time() - start:.2f}s)")
-        return output_path
-    except Exception as e:
-        print(f"[ERROR] Sketch generation failed: {e}")
-        return None
+def store_rendered(saved, mode=""):
+    """
+    Move freshly saved sketches from the staging folder into the image store and render their
+    page thumbnails. Returns the store key of each (None where rendering or storing failed).
+    """
+    store = default_store()
+    keys = []
+    for path in saved:
+        key = None
+        if path:
+            try:
+                with stage_timer("store", mode):
+                    key = store.put(path)
+            except Exception as e:
+                print(f"[ERROR] Storing sketch {path} failed: {e}")
+        if key:
+            write_thumbnails(path, key, mode)
+            os.remove(path)
+        keys.append(key)
+    return keys
 
-# Optionally preload for CUDA
-if DEVICE == "cuda":
+def write_thumbnails(path, key, mode=""):
+    """A failure here never fails the job: missing thumbnails are rendered on first request."""
     try:
-        load_model()
+        with stage_timer("thumbnails", mode):
+            make_derivatives(path, key)
     except Exception as e:
-        print(f"[ERROR] Model preload failed: {e}")
+        print(f"[WARN] Thumbnails for {key} failed, they will be rendered on first request: {e}")
+
+def generate_batch(prompts, output_paths, init_images=None, profile=None, progress=None, **options):
+    """
+    Generation handler: new sketches, or img2img revisions when init images are given.
+    Images are rendered to `output_paths` and then moved into the image store; returns their
+    store keys. With `profile` ('cprofile' or 'torch') and Config.PROFILE_DIR set, the batch
+    is profiled.
+    """
+    mode = resolve_mode(options.get("mode"))
+    kind = "revision" if init_images else "sketch"
+    with profiled(profile, f"{kind}_batch", Config.PROFILE_DIR), stage_timer("batch_total", mode):
+        if init_images:
+            saved = generate_revision_batch(prompts, output_paths, init_images, progress=progress, **options)
+        else:
+            saved = generate_sketch_batch(prompts, output_paths, progress=progress, **options)
+        saved = store_rendered(saved, mode)
+    return saved
+
+def generate_sketch_image(prompt, output_path, enhance_sketch=True, threshold=185, seed=None, mode=None):
+    """
+    Generate a forensic-style sketch from a text prompt and save it.
+    Returns output_path on success; None on failure.
+    """
+    seeds = None if seed is None else [seed]
+    return generate_sketch_batch(
+        [prompt], [output_path], enhance_sketch=enhance_sketch, threshold=threshold, seeds=seeds, mode=mode
+    )[0]
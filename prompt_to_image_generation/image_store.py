@@ -0,0 +1,370 @@
+"""
+Content-addressed storage for generated sketches.
+
+Every image is stored once under the SHA-256 of its bytes, at the key
+`<2 hex>/<2 hex>/<digest>.png`, so no directory grows past a few hundred entries, two
+renders can never overwrite each other and identical outputs (result-cache hits,
+regenerations from the same seed) share one file. Keys never change content, which
+makes them safe to cache forever and to use as ETags.
+
+Two backends share one interface: LocalStore (a sharded directory, served straight
+from disk) and ObjectStore (any S3-compatible API; LocalBucketClient stands in for the
+bucket during development). Keys written before the store existed (flat
+`sketch_<case>_<time>.png` names) stay readable until `flask migrate-images` moves them.
+"""
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from config import Config
+
+SHARDED_KEY = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.png$")
+LEGACY_KEY = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*\.png$")
+MIMETYPE = "image/png"
+# Object-store reads are buffered in blocks this large (most sketches fit in one request)
+READ_BLOCK = 1024 * 1024
+
+
+def file_digest(path):
+    """sha256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def shard_key(digest, ext=".png"):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_valid_key(key):
+    return bool(SHARDED_KEY.match(key) or LEGACY_KEY.match(key))
+
+
+def is_sharded(key):
+    return bool(SHARDED_KEY.match(key))
+
+
+def key_etag(key):
+    """The content digest for sharded keys; None for legacy ones (hash the file instead)."""
+    return os.path.splitext(os.path.basename(key))[0] if is_sharded(key) else None
+
+
+def tmp_name(path):
+    """Temp file name next to `path`, unique per process and thread, to write and then rename into place."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_atomic(source_path, dest):
+    """Hardlink (or copy) `source_path` to a temp name next to `dest`, then rename it into place."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = tmp_name(dest)
+    try:
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class LocalStore:
+    """Sharded directory on local disk."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key):
+        """Path of the stored file (readable in place, so it can be sent with sendfile)."""
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def stat(self, key):
+        """(size in bytes, last-modified datetime); raises FileNotFoundError."""
+        st = os.stat(self.local_path(key))
+        return st.st_size, datetime.fromtimestamp(st.st_mtime, timezone.utc)
+
+    def open(self, key):
+        return open(self.local_path(key), "rb")
+
+    def put(self, source_path):
+        """Store a file under its content key (once: an identical image is not written again). Returns the key."""
+        key = shard_key(file_digest(source_path))
+        dest = self.local_path(key)
+        if not os.path.exists(dest):
+            _write_atomic(source_path, dest)
+        return key
+
+    def download(self, key, dest):
+        _write_atomic(self.local_path(key), dest)
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        """Every stored key: legacy flat files first, then the shards in order."""
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if LEGACY_KEY.match(name) and os.path.isfile(path):
+                yield name
+            elif re.fullmatch(r"[0-9a-f]{2}", name) and os.path.isdir(path):
+                for sub in sorted(os.listdir(path)):
+                    for leaf in sorted(os.listdir(os.path.join(path, sub))):
+                        key = f"{name}/{sub}/{leaf}"
+                        if SHARDED_KEY.match(key):
+                            yield key
+
+
+class ObjectNotFound(Exception):
+    """Raised by LocalBucketClient like botocore's ClientError for a missing key."""
+
+    def __init__(self, key):
+        super().__init__(f"No such key: {key}")
+        self.response = {"Error": {"Code": "NoSuchKey"}}
+
+
+def _not_found(error):
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class ObjectStore:
+    """
+    Bucket behind an S3-compatible client (boto3's, or LocalBucketClient). Only the calls
+    every compatible service implements are used: put/head/get (with Range)/delete object
+    and list_objects_v2.
+    """
+
+    def __init__(self, client, bucket, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def local_path(self, key):
+        return None
+
+    def _head(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def exists(self, key):
+        try:
+            self._head(key)
+        except Exception as e:
+            if _not_found(e):
+                return False
+            raise
+        return True
+
+    def stat(self, key):
+        try:
+            head = self._head(key)
+        except Exception as e:
+            if _not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return head["ContentLength"], head["LastModified"]
+
+    def open(self, key, size=None):
+        """
+        Seekable reader fetching ranges on demand, so range requests never download the whole
+        object. Pass `size` when it is already known from stat() to save a request.
+        """
+        if size is None:
+            size, _ = self.stat(key)
+        return io.BufferedReader(_RangeReader(self, key, size), buffer_size=READ_BLOCK)
+
+    def read_range(self, key, start, end):
+        """Bytes [start, end] (inclusive) of an object."""
+        body = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key, Range=f"bytes={start}-{end}")["Body"]
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def put(self, source_path):
+        key = shard_key(file_digest(source_path))
+        if not self.exists(key):
+            with open(source_path, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=f, ContentType=MIMETYPE)
+        return key
+
+    def download(self, key, dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = tmp_name(dest)
+        try:
+            with self.open(key) as source, open(tmp_path, "wb") as f:
+                shutil.copyfileobj(source, f, READ_BLOCK)
+            os.replace(tmp_path, dest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def keys(self):
+        options = {"Bucket": self.bucket, "Prefix": self.prefix}
+        while True:
+            page = self.client.list_objects_v2(**options)
+            for item in page.get("Contents", []):
+                key = item["Key"][len(self.prefix):]
+                if is_valid_key(key):
+                    yield key
+            if not page.get("IsTruncated"):
+                return
+            options["ContinuationToken"] = page["NextContinuationToken"]
+
+
+class _RangeReader(io.RawIOBase):
+    def __init__(self, store, key, size):
+        self.store = store
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        data = self.store.read_range(self.key, self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class LocalBucketClient:
+    """
+    Stand-in for an S3 client that keeps each bucket in a directory, for running the object
+    store backend without object storage. Implements only what ObjectStore calls.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = tmp_name(path)
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(Body, f)
+        os.replace(tmp_path, path)
+        return {}
+
+    def head_object(self, Bucket, Key):
+        try:
+            st = os.stat(self._path(Bucket, Key))
+        except FileNotFoundError:
+            raise ObjectNotFound(Key)
+        return {"ContentLength": st.st_size, "LastModified": datetime.fromtimestamp(st.st_mtime, timezone.utc)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        try:
+            f = open(self._path(Bucket, Key), "rb")
+        except FileNotFoundError:
+            raise ObjectNotFound(Key)
+        with f:
+            if Range:
+                start, end = (int(n) for n in Range[len("bytes="):].split("-"))
+                f.seek(start)
+                data = f.read(end - start + 1)
+            else:
+                data = f.read()
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000):
+        base = os.path.join(self.root, Bucket)
+        found = []
+        for directory, _, names in os.walk(base):
+            for name in names:
+                key = os.path.relpath(os.path.join(directory, name), base).replace(os.sep, "/")
+                if key.startswith(Prefix) and not name.endswith(".tmp"):
+                    found.append(key)
+        found.sort()
+        start = int(ContinuationToken or 0)
+        page = found[start:start + MaxKeys]
+        truncated = start + MaxKeys < len(found)
+        result = {"Contents": [{"Key": key} for key in page], "IsTruncated": truncated}
+        if truncated:
+            result["NextContinuationToken"] = str(start + MaxKeys)
+        return result
+
+
+def open_store(backend=None):
+    """
+    The image store configured by Config.IMAGE_STORE: 'local' (sharded directory at
+    IMAGE_STORE_DIR), 's3' (IMAGE_STORE_BUCKET through boto3, at IMAGE_STORE_ENDPOINT when
+    set) or 'local-bucket' (the same object store code against a directory under IMAGE_STORE_DIR).
+    """
+    backend = backend or Config.IMAGE_STORE
+    if backend == "local":
+        return LocalStore(Config.IMAGE_STORE_DIR)
+    if backend == "local-bucket":
+        return ObjectStore(LocalBucketClient(Config.IMAGE_STORE_DIR), Config.IMAGE_STORE_BUCKET)
+    if backend == "s3":
+        import boto3
+        client = boto3.client("s3", endpoint_url=Config.IMAGE_STORE_ENDPOINT or None)
+        return ObjectStore(client, Config.IMAGE_STORE_BUCKET)
+    raise ValueError(f"Unknown IMAGE_STORE '{backend}' (expected local, s3 or local-bucket)")
+
+
+@lru_cache(maxsize=None)
+def default_store():
+    """The process-wide store, opened on first use."""
+    return open_store()
+
+
+@contextmanager
+def local_copy(store, key):
+    """A local path to read a stored image from: the file itself, or a temporary download."""
+    path = store.local_path(key)
+    if path is not None:
+        yield path
+        return
+    fd, tmp_path = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    try:
+        store.download(key, tmp_path)
+        yield tmp_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,45 @@
+"""
+Cheap previews of partially denoised latents, shown while a sketch renders.
+
+Instead of a VAE decode (seconds on CPU) the four SD 1.x latent channels are projected
+straight to RGB with a fixed linear map: a 64x64 latent becomes a blurry but recognisable
+image in about a millisecond.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Least-squares fit from SD 1.x latent channels (rows) to R, G, B (columns)
+LATENT_RGB_FACTORS = np.array([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+], dtype=np.float32)
+
+PREVIEW_SIZE = 128
+PREVIEW_QUALITY = 70
+PREVIEW_MIMETYPE = "image/jpeg"
+
+
+def to_numpy(latent):
+    """(4, h, w) float32 array from a torch tensor (any device/dtype) or a NumPy array."""
+    if hasattr(latent, "detach"):
+        latent = latent.detach().float().cpu().numpy()
+    return np.asarray(latent, dtype=np.float32)
+
+
+def latent_to_image(latent, size=PREVIEW_SIZE):
+    """Grayscale preview (sketches end up black and white anyway), `size` px square."""
+    rgb = np.einsum("chw,cr->hwr", to_numpy(latent), LATENT_RGB_FACTORS)
+    rgb = np.clip((rgb + 1) * 127.5, 0, 255).astype(np.uint8)
+    image = ImageOps.autocontrast(Image.fromarray(rgb).convert("L"))
+    return image.resize((size, size), Image.BILINEAR)
+
+
+def encode_preview(latent, size=PREVIEW_SIZE):
+    """JPEG bytes of one latent's preview (a few KB, small enough to stream every few steps)."""
+    buffer = io.BytesIO()
+    latent_to_image(latent, size).save(buffer, "JPEG", quality=PREVIEW_QUALITY)
+    return buffer.getvalue()
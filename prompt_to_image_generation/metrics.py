@@ -0,0 +1,192 @@
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) covering a single denoise step up to a full CPU render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label set."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def _row(self, key):
+        row = self._series.get(key)
+        if row is None:
+            row = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        return row
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            row = self._row(key)
+            row[index] += 1
+            row[-1] += value
+
+    def take(self):
+        """Return and reset every series (used to ship a worker process's samples to the web process)."""
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series):
+        with self._lock:
+            for key, counts in series.items():
+                row = self._row(tuple(key))
+                for i, count in enumerate(counts):
+                    row[i] += count
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(row)) for key, row in self._series.items())
+        for key, row in series:
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), row):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = ','.join(labels + ['le="%s"' % le])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {row[-1]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+GENERATION_STAGE_SECONDS = Histogram(
+    'sketch_generation_stage_seconds',
+    'Time spent in each sketch generation stage.',
+    ('stage', 'mode'),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Flask request latency by endpoint.',
+    ('endpoint', 'method', 'status'),
+)
+HISTOGRAMS = {h.name: h for h in (GENERATION_STAGE_SECONDS, HTTP_REQUEST_SECONDS)}
+
+
+def observe_stage(stage, seconds, mode=''):
+    GENERATION_STAGE_SECONDS.observe(seconds, stage=stage, mode=mode)
+
+
+@contextmanager
+def stage_timer(stage, mode=''):
+    """Time the enclosed block as one `stage` sample, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, mode)
+
+
+def process_memory():
+    """
+    This process's memory in MB from /proc/self/smaps_rollup: resident (rss), proportional
+    (pss: shared pages divided among the processes mapping them), shared and private.
+    Empty where smaps_rollup is unavailable (non-Linux, kernels before 4.14).
+    """
+    kilobytes = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == 'kB':
+                    kilobytes[key] = int(parts[0])
+    except OSError:
+        return {}
+
+    def mb(*keys):
+        return round(sum(kilobytes.get(key, 0) for key in keys) / 1024, 1)
+
+    return {
+        'rss_mb': mb('Rss'),
+        'pss_mb': mb('Pss'),
+        'shared_mb': mb('Shared_Clean', 'Shared_Dirty'),
+        'private_mb': mb('Private_Clean', 'Private_Dirty'),
+    }
+
+
+def _reset_in_child():
+    # A forked generation worker starts with a copy of the parent's series (which the parent
+    # already counts) and maybe a lock a parent thread was holding: start both afresh
+    for histogram in HISTOGRAMS.values():
+        histogram._lock = threading.Lock()
+        histogram._series = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def take_samples():
+    """Every histogram's series since the last call; pair with merge_samples in another process."""
+    return {name: histogram.take() for name, histogram in HISTOGRAMS.items()}
+
+
+def merge_samples(samples):
+    for name, series in (samples or {}).items():
+        if name in HISTOGRAMS:
+            HISTOGRAMS[name].merge(series)
+
+
+PROFILERS = ('cprofile', 'torch')
+
+
+@contextmanager
+def profile(kind, name, out_dir):
+    """
+    Profile the enclosed block and dump it to `out_dir`: cProfile stats (`.prof`, open with
+    pstats/snakeviz) or a torch profiler Chrome trace (`.json`). Does nothing unless `kind`
+    is one of PROFILERS and `out_dir` is set.
+    """
+    if kind not in PROFILERS or not out_dir:
+        yield
+        return
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.join(out_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{stem}.prof")
+            print(f"[INFO] cProfile dump written to {stem}.prof")
+        return
+
+    import torch
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities) as profiler:
+        yield
+    profiler.export_chrome_trace(f"{stem}.json")
+    print(f"[INFO] torch profiler trace written to {stem}.json")
+
+
+def render(gauges=None):
+    """Prometheus text exposition of every histogram plus `gauges` ({name: (help, value)})."""
+    lines = []
+    for histogram in HISTOGRAMS.values():
+        lines.extend(histogram.render())
+    for name, (help_text, value) in sorted((gauges or {}).items()):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+    return '\n'.join(lines) + '\n'
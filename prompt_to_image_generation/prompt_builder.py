@@ -0,0 +1,139 @@
+import re
+from functools import lru_cache
+
+STYLE_PREFIX = "highly detailed police composite sketch"
+
+# Style phrases appended after the description, most important first; the tail is dropped first
+STYLE_SUFFIX = (
+    "black and white pencil line drawing",
+    "front view",
+    "no shading",
+    "white background",
+    "clean strong lines",
+    "solid black outlines",
+    "sharp contours",
+    "forensic sketch",
+)
+
+# Priority tiers for description phrases (lower is kept first); a revision's requested
+# adjustment outranks everything, since it is the reason the revision exists
+TIER_ADJUSTMENT = -1
+TIER_FACE = 0
+TIER_IDENTITY = 1
+TIER_OTHER = 2
+TIER_BOILERPLATE = 3
+
+# Suffix phrases are always emitted after every description phrase, adjustment phrases before
+SUFFIX_ORDER = 10_000
+ADJUSTMENT_ORDER = -10_000
+
+FACE_WORDS = {
+    "face", "head", "forehead", "hair", "hairline", "bald", "eyebrow", "eyebrows", "brow", "brows",
+    "eye", "eyes", "eyelids", "nose", "nostrils", "cheek", "cheeks", "cheekbones", "lip", "lips",
+    "mouth", "teeth", "chin", "jaw", "jawline", "ear", "ears", "beard", "mustache", "moustache",
+    "goatee", "stubble", "sideburns", "scar", "scars", "mole", "freckles", "tattoo", "wrinkles",
+    "glasses", "spectacles", "piercing", "dimple", "complexion", "skin",
+}
+IDENTITY_WORDS = {
+    "male", "female", "man", "woman", "boy", "girl", "age", "aged", "old", "young", "teen", "teens",
+    "20s", "30s", "40s", "50s", "60s", "70s", "expression", "build", "ethnicity",
+}
+BOILERPLATE_PATTERNS = (
+    "police sketch", "composite sketch", "forensic sketch", "criminal with features", "black and white",
+    "line drawing", "clean lines", "clean precise lines", "high detail", "front view", "no shading",
+    "pencil", "white background",
+)
+
+
+@lru_cache(maxsize=4096)
+def token_ids(tokenizer, text):
+    """BPE token ids for `text` without BOS/EOS, memoized per tokenizer."""
+    return tuple(tokenizer.encode(text, add_special_tokens=False))
+
+
+def token_budget(tokenizer):
+    """Usable tokens per prompt: the model context minus BOS/EOS."""
+    return tokenizer.model_max_length - 2
+
+
+def split_phrases(text):
+    """Split a free-text description into comma/sentence-separated attribute phrases."""
+    parts = re.split(r"[,.;:\n]+", text)
+    return [p.strip() for p in parts if p.strip()]
+
+
+def phrase_tier(phrase):
+    lowered = phrase.lower()
+    if any(pattern in lowered for pattern in BOILERPLATE_PATTERNS):
+        return TIER_BOILERPLATE
+    words = set(re.findall(r"[a-z0-9]+", lowered))
+    if words & FACE_WORDS:
+        return TIER_FACE
+    if words & IDENTITY_WORDS:
+        return TIER_IDENTITY
+    return TIER_OTHER
+
+
+def truncate_to_tokens(tokenizer, text, max_tokens):
+    """Cut `text` on a BPE token boundary so it encodes to at most `max_tokens` tokens."""
+    ids = token_ids(tokenizer, text)
+    if len(ids) <= max_tokens:
+        return text
+    return tokenizer.decode(ids[:max_tokens]).strip()
+
+
+@lru_cache(maxsize=1024)
+def build_prompt(tokenizer, description, adjustment=None):
+    """
+    Assemble the full line-art prompt within the tokenizer's context window.
+
+    Description phrases are ranked face features > identity > other > style boilerplate
+    and the style suffix is ranked after all of them; phrases are admitted in that order
+    while they fit, then emitted in their original order. The phrases of a revision's
+    `adjustment` come before all of them, whatever they describe, and are emitted first.
+    """
+    budget = token_budget(tokenizer) - len(token_ids(tokenizer, STYLE_PREFIX))
+    separator = len(token_ids(tokenizer, ","))
+
+    candidates = []
+    seen = set()
+    for index, phrase in enumerate(split_phrases(adjustment or "")):
+        key = phrase.lower()
+        if key not in seen:
+            seen.add(key)
+            candidates.append((TIER_ADJUSTMENT, ADJUSTMENT_ORDER + index, phrase))
+    for index, phrase in enumerate(split_phrases(description)):
+        key = phrase.lower()
+        if key not in seen:
+            seen.add(key)
+            candidates.append((phrase_tier(phrase), index, phrase))
+    for index, phrase in enumerate(STYLE_SUFFIX):
+        if phrase not in seen:
+            seen.add(phrase)
+            # Core style words rank with identity details, the rest with description boilerplate
+            tier = TIER_IDENTITY if index < 2 else TIER_BOILERPLATE
+            candidates.append((tier, SUFFIX_ORDER + index, phrase))
+
+    kept = []
+    for tier, order, phrase in sorted(candidates, key=lambda c: (c[0], c[1])):
+        cost = len(token_ids(tokenizer, phrase)) + separator
+        if cost <= budget:
+            kept.append((order, phrase))
+            budget -= cost
+        elif tier <= TIER_FACE and budget > separator + 2:
+            kept.append((order, truncate_to_tokens(tokenizer, phrase, budget - separator)))
+            budget = 0
+    kept.sort()
+
+    dropped = len(candidates) - len(kept)
+    if dropped:
+        print(f"[WARN] Prompt too long, dropped {dropped} low-priority phrase(s).")
+    return ", ".join([STYLE_PREFIX] + [phrase for _, phrase in kept])
+
+
+def composite_prompt(description):
+    """Prompt stored for a composite request: the witness description in the composite wrapper."""
+    return (
+        f"Police sketch of a criminal with features: {description}. "
+        "Forensic sketch, black and white, front view, clean lines, high detail."
+    )
@@ -0,0 +1,225 @@
+"""
+Cache of the read models every page load asks for (a case, its composites, a composite's
+revisions, recent cases), so repeated views skip the JOINs. Credentials are never cached.
+
+Entries expire after a TTL and the least recently used are dropped past a size limit. The
+write paths invalidate exactly the keys they change, so the TTL only bounds staleness from
+writers that can't reach this process's cache. The 'sqlite' backend keeps entries in one
+local SQLite file instead, shared by every web process on the host, so their invalidations
+reach each other too.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from config import Config
+
+
+class MemoryBackend:
+    """In-process TTL/LRU map of key -> pickled value."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, blob), least recently used first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, blob, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, blob)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteBackend:
+    """
+    Entries in a local SQLite file (WAL mode, one connection per thread), shared by every
+    process that opens it. Past `max_entries` the entries filled longest ago are dropped.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connection() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires REAL, filled REAL, value BLOB)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_entries_filled ON entries (filled)")
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, blob, ttl):
+        now = time.time()
+        db = self._connection()
+        db.execute("INSERT OR REPLACE INTO entries (key, expires, filled, value) VALUES (?, ?, ?, ?)",
+                   (key, now + ttl, now, blob))
+        # Trim now and then rather than counting on every fill
+        if hash(key) % 64 == 0:
+            db.execute("DELETE FROM entries WHERE expires < ?", (now,))
+            db.execute("""
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY filled DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def delete(self, keys):
+        self._connection().executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
+
+
+class ReadCache:
+    """
+    Read-through cache keyed by (namespace, id), counting hits and misses per namespace.
+    Values are stored pickled, so callers always get their own copy to modify.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.invalidations = Counter()
+        # Bumped by every invalidation; a load that overlapped one is not stored, as it may predate the write
+        self._generation = 0
+
+    @staticmethod
+    def key(namespace, key):
+        return f"{namespace}:{key}"
+
+    def fetch(self, namespace, key, loader):
+        """The cached value of (namespace, key), else loader() (stored unless it is None)."""
+        cache_key = self.key(namespace, key)
+        try:
+            blob = self.backend.get(cache_key)
+        except Exception as e:
+            print(f"[WARN] Read cache lookup failed: {e}")
+            blob = None
+        if blob is not None:
+            with self._lock:
+                self.hits[namespace] += 1
+            return pickle.loads(blob)
+
+        with self._lock:
+            self.misses[namespace] += 1
+            generation = self._generation
+        value = loader()
+        if value is not None:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                stale = generation != self._generation
+            if not stale:
+                try:
+                    self.backend.set(cache_key, blob, self.ttl)
+                except Exception as e:
+                    print(f"[WARN] Read cache fill failed: {e}")
+        return value
+
+    def invalidate(self, namespace, *keys):
+        """Drop (namespace, key) for each of `keys`."""
+        with self._lock:
+            self._generation += 1
+            self.invalidations[namespace] += len(keys)
+        self.backend.delete([self.key(namespace, key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            namespaces = {}
+            for namespace in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits[namespace], self.misses[namespace]
+                namespaces[namespace] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "invalidations": self.invalidations[namespace],
+                    "hit_rate": round(hits / (hits + misses), 3),
+                }
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "ttl_seconds": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "namespaces": namespaces,
+        }
+
+
+class _NoBackend:
+    """READ_CACHE=off: every lookup misses and nothing is kept."""
+
+    def __len__(self):
+        return 0
+
+    def get(self, key):
+        return None
+
+    def set(self, key, blob, ttl):
+        pass
+
+    def delete(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def default_cache():
+    """The process-wide read cache, on the backend Config.READ_CACHE names."""
+    if Config.READ_CACHE == "sqlite":
+        backend = SqliteBackend(Config.READ_CACHE_PATH, Config.READ_CACHE_SIZE)
+    elif Config.READ_CACHE == "off":
+        backend = _NoBackend()
+    else:
+        backend = MemoryBackend(Config.READ_CACHE_SIZE)
+    return ReadCache(backend, Config.READ_CACHE_TTL)
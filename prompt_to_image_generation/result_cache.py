@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """Collapse case and whitespace so near-identical descriptions share a cache entry."""
+    prompt = re.sub(r"\s+", " ", prompt.strip().lower())
+    return re.sub(r"\s+([,.;:])", r"\1", prompt)
+
+
+def make_cache_key(**params):
+    """Stable hash of every parameter that influences the rendered image."""
+    blob = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk, content-addressed cache of finished sketches with LRU eviction.
+
+    Entries are stored as `<key>.png` under `cache_dir`; recency is tracked in memory
+    and mirrored to file mtimes so the LRU order survives a restart.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def _load(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".png"):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            found.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key, output_path):
+        """Materialize a cached image at `output_path`. Returns True on a hit."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            cached = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                _link_or_copy(cached, output_path)
+                os.utime(cached)
+            except OSError as e:
+                print(f"[WARN] Result cache entry {key} unusable: {e}")
+                self._drop(key)
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def put(self, key, source_path):
+        """Store a freshly generated image, evicting least recently used entries past the size bound."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            cached = self._path(key)
+            tmp_path = f"{cached}.{threading.get_ident()}.tmp"
+            try:
+                shutil.copyfile(source_path, tmp_path)
+                os.replace(tmp_path, cached)
+            except OSError as e:
+                print(f"[WARN] Could not cache {source_path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            size = os.path.getsize(cached)
+            self._entries[key] = size
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def _link_or_copy(source, dest):
+    """Hardlink `source` to `dest` (same filesystem), otherwise fall back to a copy."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
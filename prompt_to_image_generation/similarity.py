@@ -0,0 +1,255 @@
+"""
+Find composites that look alike, across cases.
+
+Every stored sketch gets two compact features: a 64-bit perceptual hash (low frequencies
+of the DCT of a 32x32 grayscale copy, as in pHash; near-duplicates are a few bits apart)
+and a 128-d embedding (gradient-orientation histograms over a 4x4 grid, which follow the
+strokes of a sketch rather than its exact pixels). SimilarityIndex keeps both in NumPy
+arrays, so a top-K query is one XOR/popcount or one matrix-vector product over every
+composite: a few milliseconds at 100k images.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from image_store import tmp_name
+
+try:
+    import fcntl
+except ImportError:  # Windows: savers are serialized within a process only
+    fcntl = None
+
+HASH_SIZE = 8
+HASH_SAMPLE = 32
+GRID = 4
+ORIENTATIONS = 8
+EMBEDDING_SIZE = GRID * GRID * ORIENTATIONS
+EMBEDDING_SAMPLE = 128
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(HASH_SAMPLE)
+
+
+def perceptual_hash(image):
+    """64-bit pHash of a PIL image, as an int."""
+    pixels = np.asarray(image.convert("L").resize((HASH_SAMPLE, HASH_SAMPLE), Image.LANCZOS), dtype=np.float32)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term (overall brightness) would skew the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def image_embedding(image):
+    """Unit-length, zero-mean gradient-orientation histogram of a PIL image (cosine = correlation)."""
+    gray = np.asarray(
+        image.convert("L").resize((EMBEDDING_SAMPLE, EMBEDDING_SAMPLE), Image.BILINEAR), dtype=np.float32
+    ) / 255
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy)
+    # Stroke direction without sign: a dark line on white and its edge pairs fall in one bin
+    bins = np.minimum((np.arctan2(gy, gx) % np.pi / np.pi * ORIENTATIONS).astype(np.intp), ORIENTATIONS - 1)
+    cell = np.arange(EMBEDDING_SAMPLE) * GRID // EMBEDDING_SAMPLE
+    cells = cell[:, None] * GRID + cell[None, :]
+    hist = np.bincount((cells * ORIENTATIONS + bins).ravel(), weights=magnitude.ravel(), minlength=EMBEDDING_SIZE)
+    # Square root damps the few very strong edges (outline, hair) so details count too
+    vector = np.sqrt(hist)
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).astype(np.float32)
+
+
+def image_features(path):
+    """(perceptual hash, embedding) of an image file."""
+    with Image.open(path) as image:
+        image.load()
+        return perceptual_hash(image), image_embedding(image)
+
+
+if hasattr(np, "bitwise_count"):
+    def hamming(hashes, phash):
+        return np.bitwise_count(hashes ^ np.uint64(phash))
+else:
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def hamming(hashes, phash):
+        return _POPCOUNT[(hashes ^ np.uint64(phash)).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on `path` (created if missing), held across processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SimilarityIndex:
+    """
+    Perceptual hashes and embeddings of indexed composites in growable NumPy arrays (row i
+    of each array is one composite). Thread-safe; persisted as one .npz file.
+
+    Every web process (e.g. each gunicorn worker) keeps its own copy in memory and adds the
+    composites it saves. Saving merges in whatever other processes have saved to the file
+    since, so none are lost, but a process only finds another's composites once it has
+    saved (or restarted) after them.
+    """
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        # Held across a whole save (merge, write, rename); _lock only guards the arrays
+        self._save_lock = threading.Lock()
+        self._size = 0
+        self._rows = {}  # composite id -> row
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.case_ids = np.zeros(capacity, dtype=np.int64)
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.vectors = np.zeros((capacity, EMBEDDING_SIZE), dtype=np.float32)
+        # Composites added since the index was last saved
+        self.unsaved = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, composite_id):
+        return composite_id in self._rows
+
+    def _grow(self, capacity):
+        for name in ("ids", "case_ids", "hashes", "vectors"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, composite_id, case_id, phash, embedding):
+        with self._lock:
+            row = self._rows.get(composite_id)
+            if row is None:
+                if self._size == len(self.ids):
+                    self._grow(2 * len(self.ids))
+                row = self._rows[composite_id] = self._size
+                self._size += 1
+            self.ids[row] = composite_id
+            self.case_ids[row] = case_id
+            self.hashes[row] = np.uint64(phash)
+            self.vectors[row] = embedding
+            self.unsaved += 1
+
+    def features(self, composite_id):
+        """(hash, embedding) of an indexed composite, or None."""
+        with self._lock:
+            row = self._rows.get(composite_id)
+            if row is None:
+                return None
+            return int(self.hashes[row]), self.vectors[row].copy()
+
+    def search(self, phash=None, embedding=None, k=10, exclude_case=None, exclude_ids=()):
+        """
+        Top-k composites as dicts (composite_id, case_id, similarity, hash_distance), most similar
+        first: ranked by embedding cosine similarity when `embedding` is given, else by Hamming
+        distance between hashes. Composites of `exclude_case` and `exclude_ids` are left out.
+        """
+        with self._lock:
+            n = self._size
+            distances = hamming(self.hashes[:n], phash) if phash is not None else None
+            scores = self.vectors[:n] @ embedding if embedding is not None else None
+            rank = -scores if scores is not None else distances.astype(np.float32)
+            if exclude_case is not None:
+                rank[self.case_ids[:n] == exclude_case] = np.inf
+            for composite_id in exclude_ids:
+                if composite_id in self._rows:
+                    rank[self._rows[composite_id]] = np.inf
+            k = min(k, n)
+            if k <= 0:
+                return []
+            top = np.argpartition(rank, k - 1)[:k]
+            top = top[np.argsort(rank[top], kind="stable")]
+            return [
+                {
+                    "composite_id": int(self.ids[row]),
+                    "case_id": int(self.case_ids[row]),
+                    "similarity": round(float(scores[row]), 4) if scores is not None else None,
+                    "hash_distance": int(distances[row]) if distances is not None else None,
+                }
+                for row in top if np.isfinite(rank[row])
+            ]
+
+    def merge(self, other):
+        """Add the composites of index `other` that this one lacks; returns how many."""
+        added = 0
+        for row in range(len(other)):
+            composite_id = int(other.ids[row])
+            if composite_id not in self:
+                self.add(composite_id, int(other.case_ids[row]), int(other.hashes[row]), other.vectors[row])
+                added += 1
+        return added
+
+    def save(self, path):
+        """
+        Write the index to `path` (temp file and rename, so readers never load half of it),
+        first merging in composites other processes saved there. One saver at a time, across
+        threads and (where file locks exist) processes.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._save_lock, _file_lock(f"{path}.lock"):
+            if os.path.exists(path):
+                self.merge(SimilarityIndex.load(path))
+            with self._lock:
+                n = self._size
+                arrays = {"ids": self.ids[:n].copy(), "case_ids": self.case_ids[:n].copy(),
+                          "hashes": self.hashes[:n].copy(), "vectors": self.vectors[:n].copy()}
+                self.unsaved = 0
+            tmp_path = tmp_name(path)
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at `path`; empty if there is none yet (or it is unreadable)."""
+        try:
+            data = np.load(path)
+        except FileNotFoundError:
+            return cls()
+        except Exception as e:
+            print(f"[WARN] Similarity index {path} unreadable, starting empty: {e}")
+            return cls()
+        with data:
+            ids = data["ids"]
+            index = cls(capacity=max(1024, 2 * len(ids)))
+            n = len(ids)
+            index.ids[:n] = ids
+            index.case_ids[:n] = data["case_ids"]
+            index.hashes[:n] = data["hashes"]
+            index.vectors[:n] = data["vectors"]
+        index._size = n
+        index._rows = {int(composite_id): row for row, composite_id in enumerate(ids)}
+        return index
+
+
+@lru_cache(maxsize=None)
+def default_index():
+    """The process-wide index, loaded from Config.SIMILARITY_INDEX_PATH on first use."""
+    return SimilarityIndex.load(Config.SIMILARITY_INDEX_PATH)
@@ -25,4 +25,113 @@ document.addEventListener('DOMContentLoaded', function() {
             this.value = this.value.toUpperCase();
         });
     });
-});
\ No newline at end of file
+
+    // Follow pending sketch generation jobs (live previews over server-sent events,
+    // long polling where EventSource is unavailable) instead of reloading the page
+    document.querySelectorAll('.composite-card.pending[data-status-url]').forEach(card => {
+        if (window.EventSource && card.dataset.eventsUrl) {
+            followJob(card);
+        } else {
+            pollJob(card);
+        }
+    });
+
+    // Cancel pending jobs in place
+    document.querySelectorAll('.cancel-job-form').forEach(form => {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            const card = this.closest('.composite-card');
+            fetch(this.action, { method: 'POST', headers: { 'Accept': 'application/json' } })
+                .then(response => response.json())
+                .then(job => showJobStatus(card, job))
+                .catch(() => form.submit());
+        });
+    });
+});
+
+// Update a pending card from a job status payload; returns true once the job has finished
+function showJobStatus(card, job) {
+    if (!card.classList.contains('pending')) {
+        return true;
+    }
+    const statusText = card.querySelector('.job-status');
+    if (job.status === 'done' && (card.dataset.reloadOnDone || job.candidates > 1)) {
+        window.location.reload();
+    } else if (job.status === 'done') {
+        card.classList.remove('pending');
+        card.querySelector('.composite-image').innerHTML =
+            '<img src="' + (job.thumbnail_url || job.image_url) + '" alt="Composite sketch" loading="lazy" />';
+        card.querySelector('.composite-actions').innerHTML =
+            '<a href="' + job.composite_url + '" class="btn btn-view"><i class="fas fa-eye"></i> View</a>';
+    } else if (job.status === 'failed' || job.status === 'cancelled') {
+        card.classList.remove('pending');
+        card.classList.add(job.status);
+        card.querySelector('.composite-image').innerHTML = '<p class="job-status"></p>';
+        card.querySelector('.job-status').textContent = job.status === 'cancelled'
+            ? 'Cancelled.'
+            : 'Generation failed: ' + (job.error || 'unknown error');
+        card.querySelector('.composite-actions').innerHTML = '';
+    } else {
+        statusText.innerHTML = '<i class="fas fa-spinner fa-spin"></i> ' +
+            (job.status === 'running' ? 'Generating...' : queuedText(job));
+        return false;
+    }
+    return true;
+}
+
+function followJob(card) {
+    const events = new EventSource(card.dataset.eventsUrl);
+    events.addEventListener('status', e => {
+        if (showJobStatus(card, JSON.parse(e.data))) {
+            events.close();
+        }
+    });
+    events.addEventListener('preview', e => {
+        const preview = JSON.parse(e.data);
+        if (!card.classList.contains('pending')) {
+            return;
+        }
+        let image = card.querySelector('.job-preview');
+        if (!image) {
+            image = document.createElement('img');
+            image.className = 'job-preview';
+            image.alt = 'Preview of the sketch being generated';
+            card.querySelector('.composite-image').prepend(image);
+        }
+        image.src = preview.image;
+        card.querySelector('.job-status').innerHTML = '<i class="fas fa-spinner fa-spin"></i> Step ' +
+            preview.step + ' of ' + preview.steps;
+    });
+    // Dropped streams (proxy timeouts, server restarts) fall back to long polling
+    events.onerror = () => {
+        events.close();
+        if (card.classList.contains('pending')) {
+            pollJob(card);
+        }
+    };
+}
+
+// "Queued..." with the job's place in line and estimated start, when the server has them
+function queuedText(job) {
+    if (!job.queue_position) {
+        return 'Queued...';
+    }
+    let text = 'Queued (#' + job.queue_position;
+    if (job.estimated_wait !== null && job.estimated_wait !== undefined) {
+        text += job.estimated_wait < 60
+            ? ', starting in under a minute'
+            : ', starting in about ' + Math.round(job.estimated_wait / 60) + ' min';
+    }
+    return text + ')...';
+}
+
+function pollJob(card) {
+    fetch(card.dataset.statusUrl + '?wait=25', { headers: { 'Accept': 'application/json' } })
+        .then(response => response.json())
+        .then(job => {
+            if (!showJobStatus(card, job)) {
+                pollJob(card);
+            }
+        })
+        .catch(() => setTimeout(() => pollJob(card), 5000));
+}
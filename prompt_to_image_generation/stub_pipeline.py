@@ -0,0 +1,134 @@
+"""
+Stand-in for the Stable Diffusion pipeline, selected with SKETCH_PIPELINE=stub.
+
+Pure NumPy (no torch/diffusers, no model download) but shaped like the real thing: a
+tokenizer with CLIP's 77-token window, per-prompt embeddings, a per-step denoise loop
+that honours `callback_on_step_end`, and a decode step producing smooth 512x512 RGB
+images. Output depends only on the seed, prompt embedding and settings, so the result
+cache, seeding and batching behave as they do with the real model. Used by benchmarks;
+never for real cases.
+"""
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from metrics import observe_stage
+
+LATENT_CHANNELS = 4
+LATENT_SCALE = 8
+EMBED_DIM = 768
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+class StubTokenizer:
+    """Word-level tokenizer with CLIP's interface and window (77 incl. BOS/EOS)."""
+
+    model_max_length = 77
+
+    def __init__(self):
+        self._ids = {}
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def encode(self, text, add_special_tokens=True):
+        with self._lock:
+            ids = []
+            for word in _WORD.findall(text.lower()):
+                if word not in self._ids:
+                    self._ids[word] = len(self._ids) + 1
+                    self._words[self._ids[word]] = word
+                ids.append(self._ids[word])
+        return ids
+
+    def decode(self, ids):
+        with self._lock:
+            words = [self._words.get(i, '') for i in ids]
+        return re.sub(r"\s+([^\w\s])", r"\1", ' '.join(words))
+
+
+class StubEmbeddingCache:
+    """PromptEmbeddingCache look-alike: deterministic pseudo-embeddings, (N, 77, 768) float32."""
+
+    def __init__(self, pipe, maxsize=256):
+        self.pipe = pipe
+        self.maxsize = maxsize
+
+    def _encode(self, text):
+        seed = sum(self.pipe.tokenizer.encode(text)) + len(text)
+        return np.random.default_rng(seed).standard_normal((1, StubTokenizer.model_max_length, EMBED_DIM),
+                                                           dtype=np.float32)
+
+    def negative(self, text, count):
+        return np.repeat(self._encode(text), count, axis=0)
+
+    def prompts(self, texts):
+        return np.concatenate([self._encode(text) for text in texts])
+
+    def stats(self):
+        return {'entries': 0, 'max_entries': self.maxsize, 'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'stub': True}
+
+
+class StubPipeline:
+    """Text-to-image and img2img in one object (pass `image=` for img2img)."""
+
+    device = 'cpu'
+
+    def __init__(self, step_seconds=0.0):
+        self.tokenizer = StubTokenizer()
+        self.step_seconds = step_seconds
+        self.components = {'tokenizer': self.tokenizer}
+
+    def __call__(self, prompt_embeds, negative_prompt_embeds, num_inference_steps, guidance_scale, generator,
+                 width=512, height=512, image=None, strength=1.0, callback_on_step_end=None, latents=None):
+        shape = (LATENT_CHANNELS, height // LATENT_SCALE, width // LATENT_SCALE)
+        if latents is None:
+            latents = np.stack([rng.standard_normal(shape, dtype=np.float32) for rng in generator])
+        conditioning = (prompt_embeds - negative_prompt_embeds).mean(axis=(1, 2)).astype(np.float32)
+
+        steps = num_inference_steps
+        if image is not None:
+            steps = max(1, int(num_inference_steps * strength))
+            latents = (1 - strength) * self._encode(image, shape) + strength * latents
+
+        for step in range(steps):
+            # A cheap but real per-step update, so batch size and step count still cost something
+            latents = 0.9 * latents + 0.1 * np.tanh(latents + guidance_scale * conditioning[:, None, None, None])
+            if self.step_seconds:
+                time.sleep(self.step_seconds)
+            if callback_on_step_end is not None:
+                latents = callback_on_step_end(self, step, num_inference_steps - step, {'latents': latents})['latents']
+
+        start = time.perf_counter()
+        images = [self._decode(latent, width, height) for latent in latents]
+        observe_stage('vae_decode', time.perf_counter() - start)
+        return SimpleNamespace(images=images)
+
+    @staticmethod
+    def _encode(images, shape):
+        small = [np.asarray(img.convert('RGB').resize((shape[2], shape[1]))).astype(np.float32) / 127.5 - 1
+                 for img in images]
+        return np.stack([np.concatenate([s.transpose(2, 0, 1), s.mean(axis=2)[None]]) for s in small])
+
+    @staticmethod
+    def _decode(latent, width, height):
+        rgb = np.clip((latent[:3].transpose(1, 2, 0) + 1.5) * 85, 0, 255).astype(np.uint8)
+        return Image.fromarray(rgb).resize((width, height), Image.BICUBIC)
+
+
+def make_generators(seeds):
+    return [np.random.default_rng(seed) for seed in seeds]
+
+
+def draft_latents(seeds, full_size, size):
+    """image_generator.draft_latents for the stub: full-size seeded noise, area-downsampled to unit variance."""
+    full, small = full_size // LATENT_SCALE, size // LATENT_SCALE
+    noise = np.stack([rng.standard_normal((LATENT_CHANNELS, full, full), dtype=np.float32)
+                      for rng in make_generators(seeds)])
+    edges = np.arange(small) * full // small
+    counts = np.diff(np.append(edges, full))
+    pooled = np.add.reduceat(np.add.reduceat(noise, edges, axis=2), edges, axis=3) / np.outer(counts, counts)
+    return (pooled / pooled.std(axis=(1, 2, 3), keepdims=True)).astype(np.float32)
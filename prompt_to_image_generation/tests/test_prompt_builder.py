@@ -0,0 +1,41 @@
+from prompt_builder import STYLE_PREFIX, build_prompt, split_phrases
+from stub_pipeline import StubTokenizer
+
+# Enough face details to fill CLIP's 75-token budget on their own
+PARENT = (
+    "Police sketch of a criminal with features: male, late 40s, oval face with high cheekbones, "
+    "short receding dark hair with a widow's peak, thick bushy eyebrows that meet in the middle, "
+    "deep-set narrow brown eyes with heavy eyelids, long hooked nose with a bump on the bridge, "
+    "thin lips with a downturned mouth, square jaw with a cleft chin, large ears that stick out, "
+    "short stubble beard along the jawline, small scar over the left eyebrow, mole on the right cheek. "
+    "Forensic sketch, black and white, front view, clean lines, high detail."
+)
+
+
+def revision_prompt(adjustment):
+    return f"{adjustment}. {PARENT}"
+
+
+def test_parent_alone_fills_the_budget():
+    # Without being passed as an adjustment, a non-face phrase at the head loses to the face details
+    prompt = build_prompt(StubTokenizer(), revision_prompt("add a baseball cap"))
+    assert "add a baseball cap" not in prompt
+
+
+def test_adjustment_survives_truncation():
+    tokenizer = StubTokenizer()
+    for adjustment in ("add a baseball cap", "make him older", "wearing a hooded sweatshirt, sunglasses"):
+        prompt = build_prompt(tokenizer, revision_prompt(adjustment), adjustment)
+        body = prompt[len(STYLE_PREFIX) + 2:]
+        assert body.startswith(", ".join(split_phrases(adjustment)))
+        assert len(tokenizer.encode(prompt)) <= tokenizer.model_max_length - 2
+        # Stated once, not again where the description repeats it
+        assert prompt.count(split_phrases(adjustment)[0]) == 1
+
+
+def test_long_adjustment_is_cut_rather_than_dropped():
+    tokenizer = StubTokenizer()
+    adjustment = "add a worn red baseball cap " + "with a frayed brim " * 30
+    prompt = build_prompt(tokenizer, revision_prompt(adjustment), adjustment)
+    assert prompt.startswith(f"{STYLE_PREFIX}, add a worn red baseball cap")
+    assert len(tokenizer.encode(prompt)) <= tokenizer.model_max_length - 2
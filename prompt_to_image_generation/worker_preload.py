@@ -0,0 +1,16 @@
+"""
+Imported by the generation pool's fork server before it forks any worker (MODEL_LOADING=mmap):
+loads the model while that helper process is still single-threaded, so every worker forked
+from it inherits the weights' pages. A failure is reported and left to the workers, which
+then load their own copies.
+"""
+import time
+
+import image_generator
+
+_start = time.perf_counter()
+try:
+    image_generator.preload_shared_model()
+    print(f"[INFO] Model loaded in the worker fork server in {time.perf_counter() - _start:.2f}s")
+except Exception as e:
+    print(f"[ERROR] Worker fork server could not preload the model; workers will load their own: {e}")